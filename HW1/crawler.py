@@ -0,0 +1,370 @@
+import os
+import sys
+import csv
+import json
+import random
+import asyncio
+import argparse
+import contextlib
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit
+import aiohttp
+from tqdm import tqdm
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import telemetry
+from parser import parse_article
+from extractors import ENGINES, DEFAULT_ENGINE
+
+SM_NS = {'sm': 'http://www.sitemaps.org/schemas/sitemap/0.9'}
+HEADERS = {"User-Agent": "Mozilla/5.0"}
+COLUMNS = ['url', 'title', 'summary', 'text', 'category']
+DELTA_COLUMNS = ['op'] + COLUMNS
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MIN_LASTMOD = datetime.min.replace(tzinfo=timezone.utc)
+
+
+def parse_lastmod(text):
+    # sitemaps mix dates with and without an offset, missing and naive ones are taken as UTC
+    if not text:
+        return MIN_LASTMOD
+    dt = datetime.fromisoformat(text.strip().replace('Z', '+00:00'))
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+@telemetry.timed('sitemap_parse')
+def parse_sitemap(content, tag):
+    # [(loc, lastmod)] of the <sitemap> entries of an index or the <url> entries of a urlset
+    root = ET.fromstring(content)
+    entries = []
+    for el in root.findall(tag, SM_NS):
+        lm = el.find('sm:lastmod', SM_NS)
+        entries.append((el.find('sm:loc', SM_NS).text.strip(), parse_lastmod(lm.text if lm is not None else None)))
+    return entries
+
+
+def parse_retry_after(value):
+    if not value:
+        return 0
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0)
+
+
+def unchanged(stored, lastmod):
+    # a sitemap lastmod no newer than the stored one; without a lastmod nothing can be skipped
+    return stored is not None and lastmod != MIN_LASTMOD and lastmod <= datetime.fromisoformat(stored)
+
+
+def load_state(path):
+    # {'sitemaps': {loc: lastmod}, 'urls': {url: {lastmod, etag, last_modified}}, 'pending': [url]}
+    state = {'sitemaps': {}, 'urls': {}, 'pending': []}
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            state.update(json.load(f))
+    return state
+
+
+def save_state(path, state):
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+@contextlib.contextmanager
+def open_tsv(path, columns):
+    # appends to the TSV, the header is written only when the file is new
+    new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+    with open(path, 'a', encoding='utf-8', newline='') as out:
+        writer = csv.writer(out, delimiter='\t', lineterminator='\n')
+        if new_file:
+            writer.writerow(columns)
+        yield out, writer
+
+
+class HostLimiter():
+    # at most `concurrency` requests in flight per host and at least 1 / rate seconds between their starts
+    def __init__(self, concurrency=16, rate=None):
+        self.concurrency = concurrency
+        self.interval = 1 / rate if rate else 0
+        self.semaphores = {}
+        self.next_start = {}
+
+    def delay(self, host, seconds):
+        # Retry-After holds back every request to the host, not only the retried one
+        loop = asyncio.get_running_loop()
+        self.next_start[host] = max(self.next_start.get(host, 0), loop.time() + seconds)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, host):
+        if host not in self.semaphores:
+            self.semaphores[host] = asyncio.Semaphore(self.concurrency)
+        async with self.semaphores[host]:
+            loop = asyncio.get_running_loop()
+            now = loop.time()
+            start = max(now, self.next_start.get(host, 0))
+            self.next_start[host] = start + self.interval
+            if start > now:
+                await asyncio.sleep(start - now)
+            yield
+
+
+class Crawler():
+    def __init__(self, out_path, checkpoint_path=None, concurrency=100, per_host=16, rate=None,
+                 retries=3, backoff=0.5, timeout=10, engine=DEFAULT_ENGINE, parse_workers=None):
+        self.out_path = out_path
+        self.checkpoint_path = checkpoint_path if checkpoint_path is not None else out_path + '.done'
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.limiter = HostLimiter(per_host, rate)
+        self.engine = engine
+        self.parse_workers = parse_workers
+        self.pool = None
+        self.fetched = 0
+        self.failed = 0
+        self.deleted = 0
+        self.not_modified = 0
+        self.skipped = 0
+        self.bytes_read = 0
+
+    def session(self):
+        # one pooled keep-alive client for the whole crawl
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host)
+        return aiohttp.ClientSession(connector=connector, headers=HEADERS,
+                                     timeout=aiohttp.ClientTimeout(total=self.timeout))
+
+    async def request(self, session, url, headers=None, allow=()):
+        # (status, body, response headers); retries 429 / 5xx, connection errors and timeouts with
+        # exponential backoff and jitter, other HTTP errors are raised right away unless in allow
+        host = urlsplit(url).netloc
+        for attempt in range(self.retries + 1):
+            retry_after = 0
+            try:
+                async with self.limiter.slot(host):
+                    # wall time of the request and the body, the wait for a slot is not in it
+                    with telemetry.timer('http_fetch'):
+                        async with session.get(url, headers=headers) as resp:
+                            if resp.status in RETRY_STATUSES:
+                                retry_after = parse_retry_after(resp.headers.get('Retry-After'))
+                            if resp.status not in allow:
+                                resp.raise_for_status()
+                            body = await resp.read()
+                    self.bytes_read += len(body)
+                    telemetry.count('http_bytes', len(body))
+                    return resp.status, body, resp.headers
+            except aiohttp.ClientResponseError as e:
+                if e.status not in RETRY_STATUSES or attempt == self.retries:
+                    raise
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt == self.retries:
+                    raise
+            telemetry.count('http_retry')
+            if retry_after:
+                self.limiter.delay(host, retry_after)
+            await asyncio.sleep(max(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5), retry_after))
+
+    async def fetch(self, session, url):
+        return (await self.request(session, url))[1]
+
+    async def sitemap_entries(self, session, sitemap_url, max_links=None, state=None):
+        # {url: lastmod} from the sub-sitemaps newest first, fetched per_host at a time, until max_links urls.
+        # With a refresh state, sub-sitemaps whose lastmod has not moved are not fetched, and the ones
+        # read to the end are recorded
+        sitemaps = parse_sitemap(await self.fetch(session, sitemap_url), 'sm:sitemap')
+        sitemaps.sort(key=lambda x: x[1], reverse=True)
+        if state is not None:
+            sitemaps = [(loc, lm) for loc, lm in sitemaps if not unchanged(state['sitemaps'].get(loc), lm)]
+        entries = {}
+        for i in range(0, len(sitemaps), self.per_host):
+            window = sitemaps[i:i + self.per_host]
+            pages = await asyncio.gather(*(self.fetch(session, loc) for loc, _ in window))
+            for (loc, lm), content in zip(window, pages):
+                for url, url_lm in parse_sitemap(content, 'sm:url'):
+                    entries.setdefault(url, url_lm)
+                    if max_links and len(entries) >= max_links:
+                        return entries
+                if state is not None:
+                    state['sitemaps'][loc] = lm.isoformat()
+        return entries
+
+    def load_checkpoint(self):
+        if not os.path.exists(self.checkpoint_path):
+            return set()
+        with open(self.checkpoint_path, encoding='utf-8') as f:
+            return {line.rstrip('\n') for line in f if line.strip()}
+
+    async def run_pool(self, items, job):
+        # await job(item) for every item on at most `concurrency` worker coroutines fed by a bounded queue
+        queue = asyncio.Queue(maxsize=2 * self.concurrency)
+
+        async def worker():
+            while True:
+                item = await queue.get()
+                try:
+                    await job(item)
+                finally:
+                    progress.update(1)
+                    queue.task_done()
+
+        with tqdm(total=len(items)) as progress:
+            workers = [asyncio.create_task(worker()) for _ in range(min(self.concurrency, len(items)))]
+            for item in items:
+                await queue.put(item)
+            await queue.join()
+            for w in workers:
+                w.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    @contextlib.asynccontextmanager
+    async def parse_pool(self):
+        # parsing is CPU bound, so it runs in worker processes and the event loop only does the I/O
+        with ProcessPoolExecutor(self.parse_workers, initializer=telemetry.init_worker, initargs=(telemetry.enabled,)) as pool:
+            self.pool = pool
+            try:
+                yield
+            finally:
+                self.pool = None
+
+    async def parse(self, url, content):
+        # the parse runs in a worker process, so this is its wall time as the crawl sees it, pool queueing
+        # included; the worker's own 'extract' time comes back with the result
+        with telemetry.timer('html_parse'):
+            article, stats = await asyncio.get_running_loop().run_in_executor(self.pool, telemetry.in_worker, parse_article,
+                                                                              url, content, self.engine)
+        telemetry.merge(stats)
+        return article
+
+    async def crawl(self, sitemap_url, max_links=None):
+        done = self.load_checkpoint()
+        async with self.parse_pool(), self.session() as session:
+            entries = await self.sitemap_entries(session, sitemap_url, max_links)
+            urls = [url for url in entries if url not in done]
+            with open_tsv(self.out_path, COLUMNS) as (out, writer), \
+                    open(self.checkpoint_path, 'a', encoding='utf-8') as checkpoint:
+
+                async def job(url):
+                    try:
+                        row = await self.parse(url, await self.fetch(session, url))
+                    except Exception as e:
+                        # not checkpointed, so a restarted crawl tries the url again
+                        self.failed += 1
+                        tqdm.write(f'failed {url}: {type(e).__name__} {e}')
+                        return
+                    # the row reaches the disk before its url is checkpointed
+                    writer.writerow([row[c] for c in COLUMNS])
+                    out.flush()
+                    checkpoint.write(url + '\n')
+                    checkpoint.flush()
+                    self.fetched += 1
+
+                await self.run_pool(urls, job)
+        return self.fetched, self.failed, len(done)
+
+    async def refresh(self, sitemap_url, state_path, delta_path, max_links=None):
+        # fetches only what is new or changed since the last refresh and appends it to the delta TSV:
+        # an 'upsert' row per new or modified article, a 'delete' row per article answering 404 / 410.
+        # Unchanged sub-sitemaps and urls with an old enough lastmod are not requested at all, the rest
+        # go out as conditional GETs, and urls that failed are retried on the next refresh
+        state = load_state(state_path)
+        sitemaps_before = dict(state['sitemaps'])
+        pending = set()
+        todo = None
+        try:
+            async with self.parse_pool(), self.session() as session:
+                entries = await self.sitemap_entries(session, sitemap_url, max_links, state)
+                for url in state['pending']:
+                    entries.setdefault(url, MIN_LASTMOD)
+                todo = []
+                for url, lm in entries.items():
+                    if unchanged(state['urls'].get(url, {}).get('lastmod'), lm):
+                        self.skipped += 1
+                    else:
+                        todo.append((url, lm))
+                pending.update(url for url, _ in todo)
+                with open_tsv(delta_path, DELTA_COLUMNS) as (out, writer):
+
+                    async def job(item):
+                        url, lm = item
+                        known = state['urls'].get(url, {})
+                        headers = {}
+                        if known.get('etag'):
+                            headers['If-None-Match'] = known['etag']
+                        if known.get('last_modified'):
+                            headers['If-Modified-Since'] = known['last_modified']
+                        try:
+                            status, body, resp_headers = await self.request(session, url, headers, allow=(404, 410))
+                            if status in (404, 410):
+                                writer.writerow(['delete', url] + [''] * (len(COLUMNS) - 1))
+                                state['urls'].pop(url, None)
+                                self.deleted += 1
+                            elif status == 304:
+                                self.not_modified += 1
+                            else:
+                                row = await self.parse(url, body)
+                                writer.writerow(['upsert'] + [row[c] for c in COLUMNS])
+                                self.fetched += 1
+                            out.flush()
+                        except Exception as e:
+                            self.failed += 1
+                            tqdm.write(f'failed {url}: {type(e).__name__} {e}')
+                            return
+                        if status not in (404, 410):
+                            state['urls'][url] = {
+                                'lastmod': lm.isoformat() if lm != MIN_LASTMOD else known.get('lastmod'),
+                                'etag': resp_headers.get('ETag', known.get('etag')),
+                                'last_modified': resp_headers.get('Last-Modified', known.get('last_modified')),
+                            }
+                        pending.discard(url)
+
+                    await self.run_pool(todo, job)
+        finally:
+            # saved even when the refresh breaks off, whatever was not done is pending for the next one;
+            # breaking off while reading the sitemaps leaves them as they were
+            if todo is None:
+                state['sitemaps'] = sitemaps_before
+            state['pending'] = sorted(pending)
+            save_state(state_path, state)
+        return {'upserted': self.fetched, 'deleted': self.deleted, 'not_modified': self.not_modified,
+                'skipped': self.skipped, 'failed': self.failed, 'bytes': self.bytes_read}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sitemap', default='https://russian.rt.com/sitemap.xml')
+    parser.add_argument('--out', default='articles_extracted2.tsv')
+    parser.add_argument('--checkpoint', default=None, help='fetched urls, <out>.done by default')
+    parser.add_argument('--max_links', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--per_host', type=int, default=16)
+    parser.add_argument('--rate', type=float, default=None, help='requests per second per host')
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--timeout', type=float, default=10)
+    parser.add_argument('--engine', default=DEFAULT_ENGINE, choices=sorted(ENGINES))
+    parser.add_argument('--parse_workers', type=int, default=None, help='parser processes, one per CPU by default')
+    parser.add_argument('--state', default=None, help='refresh state JSON, turns on the incremental mode')
+    parser.add_argument('--delta', default=None, help='delta TSV of the incremental mode, <out>.delta.tsv by default')
+    telemetry.add_arguments(parser)
+    args = parser.parse_args()
+    telemetry.start(args.profile, args.telemetry)
+
+    crawler = Crawler(args.out, args.checkpoint, concurrency=args.concurrency, per_host=args.per_host,
+                      rate=args.rate, retries=args.retries, timeout=args.timeout, engine=args.engine,
+                      parse_workers=args.parse_workers)
+    if args.state is not None:
+        delta = args.delta if args.delta is not None else os.path.splitext(args.out)[0] + '.delta.tsv'
+        stats = asyncio.run(crawler.refresh(args.sitemap, args.state, delta, args.max_links))
+        print(', '.join(f'{k}: {v}' for k, v in stats.items()))
+    else:
+        fetched, failed, skipped = asyncio.run(crawler.crawl(args.sitemap, args.max_links))
+        print(f'fetched: {fetched}, failed: {failed}, skipped from checkpoint: {skipped}')
+
+
+if __name__ == "__main__":
+    main()
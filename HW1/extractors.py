@@ -0,0 +1,207 @@
+from html import unescape
+from html.parser import HTMLParser
+from bs4 import BeautifulSoup
+from bs4.dammit import UnicodeDammit, EntitySubstitution
+
+try:
+    import lxml.html
+    from lxml import etree
+except ImportError:
+    lxml = None
+
+# every engine returns (title, summary, text, category) exactly as the BeautifulSoup one does:
+# get_text(separator=' ', strip=True) of the first h1.article__heading and div.article__summary,
+# the same for every <p> of the first div.article__text joined by ' ', and the content of
+# the first <meta name="mediator_theme">
+
+# tags html.parser closes right away, and tags whose strings get_text leaves out
+VOID_TAGS = {'area', 'base', 'basefont', 'bgsound', 'br', 'col', 'command', 'embed', 'frame', 'hr', 'image',
+             'img', 'input', 'isindex', 'keygen', 'link', 'menuitem', 'meta', 'nextid', 'param', 'source',
+             'spacer', 'track', 'wbr'}
+HIDDEN_TAGS = {'script', 'style', 'template', 'rt', 'rp'}
+
+
+def extract_bs4(content):
+    soup = BeautifulSoup(content, 'html.parser')
+    title_el = soup.find('h1', class_='article__heading')
+    title = title_el.get_text(separator=' ', strip=True) if title_el else ''
+    summary_el = soup.find('div', class_='article__summary')
+    summary = summary_el.get_text(separator=' ', strip=True) if summary_el else ''
+    body_el = soup.find('div', class_='article__text')
+    if body_el:
+        paragraphs = [p.get_text(separator=' ', strip=True) for p in body_el.find_all('p')]
+        body = ' '.join(paragraphs)
+    else:
+        body = ''
+    meta_theme = soup.find('meta', attrs={'name': 'mediator_theme'})
+    category = meta_theme['content'] if meta_theme and meta_theme.has_attr('content') else ''
+    return title, summary, body, category
+
+
+def lxml_strings(el):
+    # the strings get_text would visit: text and tails in document order, comments and hidden tags skipped
+    if el.text:
+        yield el.text
+    for child in el:
+        if isinstance(child.tag, str) and child.tag not in HIDDEN_TAGS:
+            yield from lxml_strings(child)
+        if child.tail:
+            yield child.tail
+
+
+def lxml_text(el):
+    return ' '.join(s for s in (s.strip() for s in lxml_strings(el)) if s)
+
+
+def has_class(name):
+    return f'contains(concat(" ", normalize-space(@class), " "), " {name} ")'
+
+
+if lxml is not None:
+    # bytes in a declared encoding: a str with an <?xml encoding?> declaration is refused by lxml
+    HTML_PARSER = lxml.html.HTMLParser(encoding='utf-8')
+    TITLE_XPATH = etree.XPath(f'(//h1[{has_class("article__heading")}])[1]')
+    SUMMARY_XPATH = etree.XPath(f'(//div[{has_class("article__summary")}])[1]')
+    BODY_XPATH = etree.XPath(f'(//div[{has_class("article__text")}])[1]')
+    META_XPATH = etree.XPath('(//meta[@name="mediator_theme"])[1]')
+
+
+def extract_lxml(content):
+    # libxml2 builds the tree in C, the four lookups are precompiled XPath queries. Its HTML parser
+    # repairs broken markup its own way (a <div> or <table> closes an open <p>, a nested <p> closes
+    # the outer one), so on malformed pages the text can differ from bs4's: well-formed pages only
+    try:
+        markup = UnicodeDammit(content, is_html=True).unicode_markup.encode('utf-8')
+        doc = lxml.html.document_fromstring(markup, parser=HTML_PARSER)
+    except etree.ParserError:
+        # nothing but whitespace or comments
+        return '', '', '', ''
+    title = TITLE_XPATH(doc)
+    summary = SUMMARY_XPATH(doc)
+    body = BODY_XPATH(doc)
+    meta = META_XPATH(doc)
+    return (lxml_text(title[0]) if title else '',
+            lxml_text(summary[0]) if summary else '',
+            ' '.join(lxml_text(p) for p in body[0].iter('p')) if body else '',
+            meta[0].get('content', '') if meta else '')
+
+
+class StreamExtractor(HTMLParser):
+    # one pass over the html.parser events without building a tree. The stack of open tags follows
+    # what BeautifulSoup does with them: void tags close at once, an end tag closes everything up to
+    # the nearest open tag of its name and is ignored when there is none
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.stack = []
+        self.closed_void = []
+        self.data = []
+        self.hidden = 0
+        self.title = self.summary = self.body = None
+        self.category = None
+        self.paragraphs = []
+        self.open_targets = []
+
+    def flush(self):
+        # adjacent data is one string for get_text, it ends at any tag, comment or declaration
+        if not self.data:
+            return
+        text = ''.join(self.data).strip()
+        self.data = []
+        if text and not self.hidden:
+            for target in self.open_targets:
+                target.append(text)
+
+    def handle_starttag(self, tag, attrs, startend=False):
+        self.flush()
+        attrs = {k: '' if v is None else v for k, v in attrs}
+        target = None
+        if tag == 'h1' and self.title is None and 'article__heading' in attrs.get('class', '').split():
+            target = self.title = []
+        elif tag == 'div' and self.summary is None and 'article__summary' in attrs.get('class', '').split():
+            target = self.summary = []
+        elif tag == 'div' and self.body is None and 'article__text' in attrs.get('class', '').split():
+            target = self.body = []
+        elif tag == 'p' and self.body is not None and any(t is self.body for _, t in self.stack):
+            target = []
+            self.paragraphs.append(target)
+        elif tag == 'meta' and self.category is None and attrs.get('name') == 'mediator_theme':
+            self.category = attrs.get('content', '')
+        if target is not None and target is not self.body:
+            self.open_targets.append(target)
+        if tag in HIDDEN_TAGS:
+            self.hidden += 1
+        self.stack.append((tag, target))
+        if tag in VOID_TAGS:
+            self.pop_to(len(self.stack) - 1)
+            if not startend:
+                self.closed_void.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs, startend=True)
+
+    def handle_endtag(self, tag):
+        if tag in self.closed_void:
+            # a redundant </br> after <br> does not even end the current string
+            self.closed_void.remove(tag)
+            return
+        self.flush()
+        for i in range(len(self.stack) - 1, -1, -1):
+            if self.stack[i][0] == tag:
+                self.pop_to(i)
+                return
+
+    def pop_to(self, i):
+        while len(self.stack) > i:
+            tag, target = self.stack.pop()
+            if tag in HIDDEN_TAGS:
+                self.hidden -= 1
+            if target is not None and target is not self.body:
+                # open_targets is in stack order, so the popped target is its last one
+                self.open_targets.pop()
+
+    def handle_data(self, data):
+        self.data.append(data)
+
+    def handle_entityref(self, name):
+        character = EntitySubstitution.HTML_ENTITY_TO_CHARACTER.get(name)
+        self.data.append(character if character is not None else '&' + name)
+
+    def handle_charref(self, name):
+        self.data.append(unescape(f'&#{name};'))
+
+    def handle_comment(self, data):
+        self.flush()
+
+    def handle_decl(self, decl):
+        self.flush()
+
+    def unknown_decl(self, data):
+        # CDATA is text for get_text, other declarations are not
+        self.flush()
+        if data.upper().startswith('CDATA['):
+            self.data.append(data[len('CDATA['):])
+            self.flush()
+
+    def handle_pi(self, data):
+        self.flush()
+
+    def result(self):
+        self.close()
+        self.flush()
+        return (' '.join(self.title or []),
+                ' '.join(self.summary or []),
+                ' '.join(' '.join(p) for p in self.paragraphs) if self.body is not None else '',
+                self.category or '')
+
+
+def extract_stream(content):
+    extractor = StreamExtractor()
+    extractor.feed(UnicodeDammit(content, is_html=True).unicode_markup)
+    return extractor.result()
+
+
+ENGINES = {'bs4': extract_bs4, 'stream': extract_stream}
+if lxml is not None:
+    ENGINES['lxml'] = extract_lxml
+# stream matches bs4 on malformed markup as well, lxml is faster but only matches it on well-formed pages
+DEFAULT_ENGINE = 'stream'
@@ -0,0 +1,101 @@
+import os
+import hashlib
+import argparse
+import threading
+from collections import Counter
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    # serves fixtures/<path> and fixtures/<path>.html, {base} in the sitemaps becomes the server address.
+    # Answers conditional GETs from the ETag (content md5) and Last-Modified (file mtime);
+    # with flaky=N the first N requests of every path get a 503
+    def do_GET(self):
+        server = self.server
+        path = self.path.split('?')[0].lstrip('/') or 'sitemap.xml'
+        with server.lock:
+            server.hits[path] += 1
+            attempt = server.hits[path]
+        if attempt <= server.flaky:
+            self.send_response(503)
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        file_path = os.path.join(server.root, path)
+        if not os.path.isfile(file_path):
+            file_path += '.html'
+        if '..' in path or not os.path.isfile(file_path):
+            self.send_error(404)
+            return
+        with open(file_path, 'rb') as f:
+            content = f.read()
+        if file_path.endswith('.xml'):
+            content = content.replace(b'{base}', server.base_url.encode())
+            content_type = 'application/xml'
+        else:
+            content_type = 'text/html; charset=utf-8'
+        etag = '"' + hashlib.md5(content).hexdigest() + '"'
+        mtime = int(os.path.getmtime(file_path))
+        if self.not_modified(etag, mtime):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', formatdate(mtime, usegmt=True))
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def not_modified(self, etag, mtime):
+        # If-None-Match wins over If-Modified-Since, as in RFC 9110
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            return etag in [t.strip() for t in if_none_match.split(',')] or if_none_match.strip() == '*'
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since is not None:
+            try:
+                return mtime <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def start_server(host='127.0.0.1', port=0, root=FIXTURES_DIR, flaky=0, verbose=False):
+    # port=0 picks a free port; the server runs in a daemon thread, stop it with server.shutdown()
+    server = ThreadingHTTPServer((host, port), FixtureHandler)
+    server.daemon_threads = True
+    server.root = root
+    server.flaky = flaky
+    server.verbose = verbose
+    server.hits = Counter()
+    server.lock = threading.Lock()
+    server.base_url = f'http://{host}:{server.server_address[1]}'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--root', default=FIXTURES_DIR)
+    parser.add_argument('--flaky', type=int, default=0, help='answer 503 to the first N requests of every path')
+    args = parser.parse_args()
+
+    server = start_server(args.host, args.port, args.root, args.flaky, verbose=True)
+    print(f'serving {args.root} at {server.base_url}/sitemap.xml')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -1,6 +1,6 @@
 import os 
-import re
 import sys
+import argparse
 import pandas as pd
 import nltk
 from nltk.corpus import stopwords
@@ -8,6 +8,11 @@ from pandarallel import pandarallel
 from collections import Counter
 from сustom_map import CastomCounter
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import telemetry
+from common.tokenizer import tokenize
+from ngram_stream import count_ngrams
+
 nltk.download('stopwords', quiet=True)
 rus_stop = set(stopwords.words('russian'))
 
@@ -16,11 +21,7 @@ pandarallel.initialize(progress_bar=True)
 def preprocess_text(text):
     if not isinstance(text, str):
         return []
-    text = text.lower()
-    text = re.sub(r'\s+', ' ', text)
-    text = re.sub(r'[^\w\s]', ' ', text)
-    tokens = text.split()
-    return [t for t in tokens if t not in rus_stop]
+    return tokenize(text, rus_stop)
 
 def get_ngrams(tokens_list, n):
     ngrams = []
@@ -33,17 +34,41 @@ def get_ngrams(tokens_list, n):
 if __name__ == "__main__":
     N = [2, 3, 4]
     top_len = 20
-    path = sys.argv[1]
-    df = pd.read_csv(path, sep='\t')
-    
-    tokens = df['text'].parallel_apply(preprocess_text).tolist()
-    
-    for n in N:
-        print(f'top {top_len} N-gamm for n={n}')
-        print(f"COUNTER {'_'*100}")
-        print(Counter(get_ngrams(tokens, n)).most_common(top_len))
-        print(f"CASTOM {'_'*100}")
-        print(CastomCounter(get_ngrams(tokens, n)).most_common(top_len))
-        print()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path')
+    parser.add_argument('--stream', action='store_true', help='read the TSV in chunks and count with a bounded memory budget')
+    parser.add_argument('--chunksize', type=int, default=1000)
+    parser.add_argument('--max_items', type=int, default=2000000, help='grams per n kept in memory before spilling to disk')
+    parser.add_argument('--approx', type=int, default=None, help='approximate top grams with this many Space-Saving counters per n')
+    telemetry.add_arguments(parser)
+    args = parser.parse_args()
+    telemetry.start(args.profile, args.telemetry)
     
-    
\ No newline at end of file
+    if args.approx is not None:
+        counters = count_ngrams(args.path, N, rus_stop, args.chunksize, approx=args.approx)
+        for n in N:
+            print(f'top {top_len} N-gamm for n={n}')
+            print(f"SPACE-SAVING {'_'*100}")
+            top = counters[n].most_common(top_len)
+            print([(tuple(gram.split(' ')), cnt, counters[n].error(gram)) for gram, cnt in top])
+            print()
+    elif args.stream:
+        counters = count_ngrams(args.path, N, rus_stop, args.chunksize, args.max_items)
+        for n in N:
+            print(f'top {top_len} N-gamm for n={n}')
+            print(f"STREAM {'_'*100}")
+            print(counters[n].most_common(top_len))
+            counters[n].close()
+            print()
+    else:
+        df = pd.read_csv(args.path, sep='\t')
+        
+        tokens = df['text'].parallel_apply(preprocess_text).tolist()
+        
+        for n in N:
+            print(f'top {top_len} N-gamm for n={n}')
+            print(f"COUNTER {'_'*100}")
+            print(Counter(get_ngrams(tokens, n)).most_common(top_len))
+            print(f"CASTOM {'_'*100}")
+            print(CastomCounter(get_ngrams(tokens, n)).most_common(top_len))
+            print()
@@ -0,0 +1,56 @@
+import heapq
+
+
+class SpaceSaving:
+    # Space-Saving (Metwally et al., 2005): approximate top-k in `capacity` counters.
+    # After N puts every monitored key satisfies count - error <= true count <= count, and
+    # error <= N / capacity, so any key seen more than N / capacity times is always monitored.
+    # A key in most_common(n) is guaranteed to belong to the true top n when count - error of it
+    # is at least the count of the (n+1)-th entry.
+    def __init__(self, capacity=10000):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.heap = []
+        self.total = 0
+
+    def put(self, key, value=None):
+        inc = 1 if value is None else value
+        self.total += inc
+        if key in self.counts:
+            self.counts[key] += inc
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = inc
+            self.errors[key] = 0
+        else:
+            min_key, min_count = self.pop_min()
+            del self.counts[min_key]
+            del self.errors[min_key]
+            self.counts[key] = min_count + inc
+            self.errors[key] = min_count
+        heapq.heappush(self.heap, (self.counts[key], key))
+        if len(self.heap) > 4 * self.capacity:
+            self.heap = [(cnt, k) for k, cnt in self.counts.items()]
+            heapq.heapify(self.heap)
+
+    def pop_min(self):
+        # the heap keeps stale (count, key) entries from earlier increments, they are skipped here
+        while True:
+            cnt, key = heapq.heappop(self.heap)
+            if self.counts.get(key) == cnt:
+                return key, cnt
+
+    def get(self, key):
+        return self.counts.get(key)
+
+    def error(self, key):
+        return self.errors.get(key)
+
+    def items(self):
+        return self.counts.items()
+
+    def most_common(self, n):
+        return heapq.nlargest(n, self.counts.items(), key=lambda x: x[1])
+
+    def __len__(self):
+        return len(self.counts)
@@ -0,0 +1,94 @@
+import os
+import sys
+import heapq
+import tempfile
+from collections import Counter
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import telemetry
+from common.tokenizer import tokenize
+from heavy_hitters import SpaceSaving
+
+
+def iter_token_lists(path, stop_words=None, chunksize=1000):
+    # reads the TSV chunksize rows at a time, only one chunk of texts is ever in memory
+    for chunk in pd.read_csv(path, sep='\t', usecols=['text'], chunksize=chunksize):
+        with telemetry.timer('tokenize'):
+            token_lists = [tokenize(text, stop_words) if isinstance(text, str) else [] for text in chunk['text']]
+        yield from token_lists
+
+
+def iter_ngrams(tokens, ns):
+    # all requested n in one pass over the token list
+    for i in range(len(tokens)):
+        for n in ns:
+            if i + n > len(tokens):
+                break
+            yield n, ' '.join(tokens[i:i + n])
+
+
+class SpillingCounter():
+    # Counter that keeps at most max_items keys in memory: past that, the counts are written to
+    # a sorted run file and the merge of all runs gives the exact totals.
+    # Keys are the space-joined tokens of a gram, tokens never contain spaces.
+    def __init__(self, max_items=2000000, tmp_dir=None):
+        self.max_items = max_items
+        self.tmp_dir = tmp_dir
+        self.counts = Counter()
+        self.runs = []
+
+    def put(self, key, value=None):
+        self.counts[key] += 1 if value is None else value
+        if len(self.counts) > self.max_items:
+            self.spill()
+
+    @telemetry.timed('spill')
+    def spill(self):
+        run = tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=self.tmp_dir, suffix='.run', delete=False)
+        with run:
+            for key in sorted(self.counts):
+                run.write(f'{key}\t{self.counts[key]}\n')
+        self.runs.append(run.name)
+        self.counts = Counter()
+
+    def read_run(self, path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                key, cnt = line.rstrip('\n').split('\t')
+                yield key, int(cnt)
+
+    def items(self):
+        # (key, total count) in key order, streamed from the runs and the in-memory part
+        streams = [self.read_run(path) for path in self.runs]
+        streams.append((key, self.counts[key]) for key in sorted(self.counts))
+        current, total = None, 0
+        for key, cnt in heapq.merge(*streams):
+            if key != current:
+                if current is not None:
+                    yield current, total
+                current, total = key, 0
+            total += cnt
+        if current is not None:
+            yield current, total
+
+    def most_common(self, n):
+        return [(tuple(key.split(' ')), cnt) for key, cnt in heapq.nlargest(n, self.items(), key=lambda x: x[1])]
+
+    def close(self):
+        for path in self.runs:
+            os.remove(path)
+        self.runs = []
+
+
+def count_ngrams(path, ns, stop_words=None, chunksize=1000, max_items=2000000, tmp_dir=None, approx=None):
+    # exact counts with SpillingCounter, or approximate top grams in `approx` counters per n
+    if approx is not None:
+        counters = {n: SpaceSaving(approx) for n in ns}
+    else:
+        counters = {n: SpillingCounter(max_items, tmp_dir) for n in ns}
+    ns = sorted(ns)
+    for tokens in iter_token_lists(path, stop_words, chunksize):
+        for n, gram in iter_ngrams(tokens, ns):
+            counters[n].put(gram)
+    return counters
@@ -1,58 +1,89 @@
+import heapq
+from array import array
+
+EMPTY = object()
+
+
 class CastomCounter:
+    # open addressing with linear probing over parallel key / hash / count arrays;
+    # counts are updated in place and the stored hashes make rehashing a plain copy
     def __init__(self, input_list=None):
-        self.size = 100007 
-        self.buckets = [[] for _ in range(self.size)]
-        self.load_factor_threshold = 0.75
+        self.size = 1 << 17
+        self.mask = self.size - 1
+        self.keys = [EMPTY] * self.size
+        self.hashes = array('q', bytes(8 * self.size))
+        self.counts = array('q', bytes(8 * self.size))
+        self.load_factor_threshold = 0.5
         self.count = 0
         
         if input_list is not None:
             for key in input_list:
                 self.put(key)
 
-    def hash(self, key):
-        s = str(key)
-        h = 0
-        for c in s:
-            h = (h * 31 + ord(c)) % self.size
-        return h
+    def find(self, key, h):
+        # slot holding key, or the empty slot where it would go
+        keys, hashes, mask = self.keys, self.hashes, self.mask
+        i = h & mask
+        while True:
+            k = keys[i]
+            if k is EMPTY or (hashes[i] == h and (k is key or k == key)):
+                return i
+            i = (i + 1) & mask
 
     def put(self, key, value=None):
         
-        if self.count / self.size >= self.load_factor_threshold:
+        if self.count >= self.size * self.load_factor_threshold:
             self.rehash()
         
-        h = self.hash(key)
-        for i, (k, v) in enumerate(self.buckets[h]):
-            if k == key:
-                self.buckets[h][i] = (key, v+1 if value is None else value)
+        h = hash(key)
+        keys, hashes, mask = self.keys, self.hashes, self.mask
+        i = h & mask
+        while True:
+            k = keys[i]
+            if k is EMPTY:
+                keys[i] = key
+                hashes[i] = h
+                self.counts[i] = 1 if value is None else value
+                self.count += 1
                 return
-        self.buckets[h].append((key, 1 if value is None else value))
-        self.count += 1
+            if hashes[i] == h and (k is key or k == key):
+                self.counts[i] = self.counts[i] + 1 if value is None else value
+                return
+            i = (i + 1) & mask
 
     def get(self, key):
-        h = self.hash(key)
-        for k, v in self.buckets[h]:
-            if k == key:
-                return v
-        return None
+        i = self.find(key, hash(key))
+        if self.keys[i] is EMPTY:
+            return None
+        return self.counts[i]
 
     def items(self):
-        for bucket in self.buckets:
-            for k, v in bucket:
+        for k, v in zip(self.keys, self.counts):
+            if k is not EMPTY:
                 yield k, v
 
     def most_common(self, n):
-        return sorted(self.items(), key=lambda x: x[1], reverse=True)[:n]
+        # bounded heap of n items instead of sorting the whole table
+        return heapq.nlargest(n, self.items(), key=lambda x: x[1])
     
     def __len__(self):
         return self.count
     
     def rehash(self):
-        old_buckets = self.buckets
+        old = zip(self.keys, self.hashes, self.counts)
         self.size *= 2
-        self.buckets = [[] for _ in range(self.size)]
-        self.count = 0
+        self.mask = self.size - 1
+        self.keys = [EMPTY] * self.size
+        self.hashes = array('q', bytes(8 * self.size))
+        self.counts = array('q', bytes(8 * self.size))
 
-        for bucket in old_buckets:
-            for key, value in bucket:
-                self.put(key, value)
+        keys, hashes, counts, mask = self.keys, self.hashes, self.counts, self.mask
+        for key, h, cnt in old:
+            if key is EMPTY:
+                continue
+            i = h & mask
+            while keys[i] is not EMPTY:
+                i = (i + 1) & mask
+            keys[i] = key
+            hashes[i] = h
+            counts[i] = cnt
@@ -1,40 +1,78 @@
 import os
 import sys
-import re
+import argparse
+import heapq
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
 import nltk
 from nltk.corpus import stopwords
 from pymorphy3 import MorphAnalyzer
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common import telemetry
+from common.docstore import DocStore
+from common.live import LiveIndex, Segment
+from common.postings import PostingsBuilder, build_parallel
+from common.query import parse_query
+from common.result_cache import ResultCache
+from common.segment import write_segment, read_segment
+from common.tokenizer import tokenize, tokenize_positions
+from lemma_cache import LemmaCache
+
 nltk.download('stopwords', quiet=True)
 rus_stop = set(stopwords.words('russian'))
 
 morph = MorphAnalyzer()
 
 class InvIndex():
-    def __init__(self, df, stop_words=None, morph = None):
+    def __init__(self, df, stop_words=None, morph = None, index=None, n_jobs=1, lemma_vocab=None, cache_size=200000,
+                 doc_ids=None, merge_factor=8, docs=None, positions=False, result_cache_size=10000, result_ttl=None,
+                 result_cache_items=1000000):
         self.stop_words = stop_words
+        self.positions = positions
+        # query text -> tokens, and (search, tokens, top_k) -> results of one index generation
+        self.token_cache = ResultCache(result_cache_size)
+        self.results = ResultCache(result_cache_size, result_ttl, result_cache_items)
         self.morph = morph
+        self.lemma_vocab = lemma_vocab
+        self.lemmas = None
+        if morph is not None:
+            self.lemmas = LemmaCache(morph, maxsize=cache_size)
+            if lemma_vocab is not None and os.path.exists(lemma_vocab):
+                self.lemmas.load_vocab(lemma_vocab)
         df = df.dropna(subset=['text']).reset_index(drop=True)
         df['doc_id'] = df.index.astype(str)
         self.df = df
-        self.index = self.create_index(self.df)
+        if docs is not None and len(docs) != df.shape[0]:
+            raise ValueError(f'docstore has {len(docs)} docs, dataframe has {df.shape[0]}')
+        self.docs = DocStore(df['text'].tolist()) if docs is None else docs
+        index = self.create_index(self.df, n_jobs) if index is None else index
+        if doc_ids is None:
+            doc_ids = np.arange(index.num_docs)
+        self.live = LiveIndex(Segment(index, doc_ids), merge_factor)
+
+    @property
+    def index(self):
+        # the postings as one CompactIndex with live segments and deletes merged in; a read-only view,
+        # compact() is what swaps it in for the segments
+        return self.live.merged().index
+
+    def compact(self):
+        # one segment without deleted docs in place of the live ones; a new generation, so the
+        # cached results go
+        self.live.compact()
         
     def tokenizer(self, text):
-        text = text.lower()
-        text = re.sub(r'\s+', ' ', text)
-        text = re.sub(r'[^\w\s]', ' ', text)
-        tokens = text.split()
+        # 'tokenize' times the split alone, the lemma cache times its pymorphy3 calls as 'lemmatize'
+        with telemetry.timer('tokenize'):
+            tokens = tokenize(text, self.stop_words)
         lemmas = []
         for t in tokens:
-            if self.stop_words is not None and t in self.stop_words:
-                continue
             if self.morph is not None:
-                parses = morph.parse(t)
-                if not parses:
+                lemma = self.lemmas.lemma(t)
+                if lemma is None:
                     continue
-                lemma = parses[0].normal_form
                 if self.stop_words is not None:
                     if lemma not in self.stop_words:
                         lemmas.append(lemma)
@@ -43,76 +81,255 @@ class InvIndex():
             else:
                 lemmas.append(t)
         return lemmas
+
+    def token_positions(self, text):
+        # (lemma, position) pairs of the tokenizer output, positions count every token of the text
+        with telemetry.timer('tokenize'):
+            tokens = tokenize_positions(text, self.stop_words)
+        pairs = []
+        for t, pos in tokens:
+            if self.morph is not None:
+                t = self.lemmas.lemma(t)
+                if t is None or (self.stop_words is not None and t in self.stop_words):
+                    continue
+            pairs.append((t, pos))
+        return pairs
     
-    def create_index(self, df):
-        index = {}
-        for q, row in tqdm(df.iterrows(), total=df.shape[0]):
-            tokens = self.tokenizer(row['text'])
-            doc_id = row['doc_id']
+    def index_chunk(self, doc_ids, texts):
+        builder = PostingsBuilder(self.positions)
+        for doc_id, text in zip(doc_ids, texts):
+            if self.positions:
+                positions = {}
+                for word, pos in self.token_positions(text):
+                    positions.setdefault(word, []).append(pos)
+                builder.add_document(doc_id, {word: len(pos) for word, pos in positions.items()}, positions)
+                continue
+            tokens = self.tokenizer(text)
             freqs = {}
             for word in tokens:
                 freqs[word] = freqs.get(word, 0) + 1
-            for word, cnt in freqs.items():
-                if word in index:
-                    index[word][doc_id] = cnt
-                else:
-                    index[word] = {doc_id: cnt}
-                    
-        return index
+            builder.add_document(doc_id, freqs)
+        return builder
+    
+    def create_index(self, df, n_jobs=1):
+        doc_ids = df['doc_id'].astype(int).tolist()
+        texts = df['text'].tolist()
+        if n_jobs == 1:
+            return self.index_chunk(tqdm(doc_ids), texts).build()
+        return build_parallel(index_chunk, doc_ids, texts, n_jobs,
+                              initializer=init_worker, initargs=(self.stop_words, self.morph is not None, self.lemma_vocab, self.positions),
+                              positions=self.positions).build()
+    
+    def add_segment(self, doc_ids, texts):
+        # doc_ids in increasing order; the segment uses local ids, the live index maps them back
+        self.live.add(self.index_chunk(range(len(texts)), texts).build(), doc_ids)
+
+    def add_documents(self, df):
+        # new rows get the next doc ids and are searchable as soon as this returns
+        df = df.dropna(subset=['text']).reset_index(drop=True)
+        if df.shape[0] == 0:
+            return []
+        start = self.df.shape[0]
+        df['doc_id'] = (df.index + start).astype(str)
+        self.df = pd.concat([self.df, df], ignore_index=True)
+        self.docs.append(df['text'].tolist())
+        self.add_segment(list(range(start, start + df.shape[0])), df['text'].tolist())
+        return df['doc_id'].tolist()
+
+    def delete_documents(self, doc_ids):
+        # the rows stay in self.df, the docs just stop matching
+        return self.live.delete([int(doc_id) for doc_id in doc_ids])
+
+    def update_documents(self, doc_ids, texts):
+        # new text under the same doc ids; the old postings are tombstoned in the same swap
+        pairs = sorted({int(doc_id): text for doc_id, text in zip(doc_ids, texts)}.items())
+        if len(pairs) == 0:
+            return
+        ids = [doc_id for doc_id, _ in pairs]
+        texts = ['' if not isinstance(text, str) else text for _, text in pairs]
+        self.df.loc[ids, 'text'] = texts
+        for doc_id, text in zip(ids, texts):
+            self.docs.put(doc_id, text)
+        self.add_segment(ids, texts)
+
+    def update_document(self, doc_id, text):
+        self.update_documents([doc_id], [text])
+
+    def apply_delta(self, delta):
+        # rows of the HW1 crawler delta TSV, matched to docs by url: 'upsert' updates the doc with
+        # that url or adds a new one, 'delete' deletes it
+        delta = delta.drop_duplicates(subset=['url'], keep='last')
+        by_url = dict(zip(self.df['url'], self.df['doc_id']))
+        deletes = delta[delta['op'] == 'delete']
+        upserts = delta[delta['op'] == 'upsert']
+        known = upserts['url'].isin(by_url)
+        deleted = self.delete_documents([by_url[url] for url in deletes['url'] if url in by_url])
+        self.update_documents([by_url[url] for url in upserts.loc[known, 'url']], upserts.loc[known, 'text'].tolist())
+        added = self.add_documents(upserts.loc[~known].drop(columns=['op']))
+        return {'added': len(added), 'updated': int(known.sum()), 'deleted': deleted}
+
+    def rank(self, results, top_k=None):
+        if top_k is None:
+            results.sort(key=lambda x: x[1], reverse=True)
+            return results
+        return heapq.nlargest(top_k, results, key=lambda x: x[1])
     
-    def search_word(self, word):
-        token = self.tokenizer(word)
+    def query_tokens(self, text, positions=False):
+        # tokenizer (or token_positions) output for a query text, memoized, so a repeated query is
+        # not tokenized and lemmatized again
+        key = (positions, text)
+        tokens = self.token_cache.get(key)
+        if tokens is None:
+            tokens = tuple(self.token_positions(text) if positions else self.tokenizer(text))
+            self.token_cache.put(key, tokens)
+        return tokens
+
+    def cached(self, key, search):
+        # search(snapshot) -> results, reused while the index generation stays the same. top_k=None
+        # lists are cached too: result_cache_items bounds the results held in all, and a list longer
+        # than that is not kept
+        snap = self.live.snapshot()
+        results = self.results.get(key, snap.generation)
+        if results is None:
+            results = search(snap)
+            self.results.put(key, results, snap.generation)
+        return list(results)
+
+    def search_word(self, word, top_k=None):
+        token = self.query_tokens(word)
         if len(token) == 0:
             return []
         
         w = token[0]
-        posting = self.index.get(w, {})
-        if len(posting) == 0:
-            return []
-        results = list(posting.items())
-        results.sort(key=lambda x: x[1], reverse=True)
-        # return [doc[0] for doc in results]
-        return results
+        def search(snap):
+            posting = snap.get(w)
+            if posting is None:
+                return []
+            docs, tfs = posting
+            results = [(str(doc_id), cnt) for doc_id, cnt in zip(docs.tolist(), tfs.tolist())]
+            # return [doc[0] for doc in results]
+            return self.rank(results, top_k)
+        return self.cached(('word', w, top_k), search)
     
-    def search_multiword(self, text):
-        words = self.tokenizer(text)
+    def search_multiword(self, text, top_k=None):
+        words = self.query_tokens(text)
         if len(words) == 0:
             return []
 
-        postings = []
-        for w in words:
-            posting = self.index.get(w, {})
-            if len(posting) == 0:
+        def search(snap):
+            common_docs, scores = snap.intersect(list(words))
+            if len(common_docs) == 0:
                 return []
-            postings.append(posting)
+            results = [(str(doc_id), score) for doc_id, score in zip(common_docs.tolist(), scores.tolist())]
+            # return [doc[0] for doc in results]
+            return self.rank(results, top_k)
+        return self.cached(('and', words, top_k), search)
+    
+    def search_phrase(self, text, top_k=None):
+        # exact phrase on a positional index, scored by how often the phrase occurs in the doc
+        pairs = self.query_tokens(text, positions=True)
+        if len(pairs) == 0:
+            return []
+        words = [word for word, _ in pairs]
+        offsets = [pos - pairs[0][1] for _, pos in pairs]
+        def search(snap):
+            docs, counts = snap.phrase(words, offsets)
+            results = [(str(doc_id), cnt) for doc_id, cnt in zip(docs.tolist(), counts.tolist())]
+            return self.rank(results, top_k)
+        return self.cached(('phrase', tuple(zip(words, offsets)), top_k), search)
+
+    def search_near(self, text, k=10, top_k=None):
+        # all words of text with at most k other tokens between the first and the last of them
+        words = [word for word, _ in self.query_tokens(text, positions=True)]
+        if len(words) == 0:
+            return []
+        def search(snap):
+            docs, counts = snap.near(words, k)
+            results = [(str(doc_id), cnt) for doc_id, cnt in zip(docs.tolist(), counts.tolist())]
+            return self.rank(results, top_k)
+        return self.cached(('near', tuple(words), k, top_k), search)
 
-        common_docs = set(postings[0].keys())
-        for posting in postings[1:]:
-            common_docs &= set(posting.keys())
-        if len(common_docs) == 0:
+    def search_query(self, query, top_k=None):
+        # '"a b c"' is a phrase, 'a NEAR/k b' a proximity query, anything else the plain AND
+        op = parse_query(query)
+        if op[0] == 'phrase':
+            return self.search_phrase(op[1], top_k)
+        if op[0] == 'near':
+            return self.search_near(op[1], op[2], top_k)
+        return self.search_multiword(op[1], top_k)
+    
+    def search_bm25(self, text, top_k=10):
+        words = self.query_tokens(text)
+        if len(words) == 0:
             return []
-        results = []
-        for doc_id in common_docs:
-            score = sum(posting[doc_id] for posting in postings)
-            results.append((doc_id, score))
-        results.sort(key=lambda x: x[1], reverse=True)
-        # return [doc[0] for doc in results]
-        return results
+        def search(snap):
+            return [(str(doc_id), score) for doc_id, score in snap.bm25_top_k(list(words), top_k)]
+        return self.cached(('bm25', words, top_k), search)
+    
+    def save(self, path):
+        stop_words = sorted(self.stop_words) if self.stop_words is not None else None
+        segment = self.live.merged()
+        write_segment(path, segment.index, {'stop_words': stop_words, 'morph': self.morph is not None},
+                      doc_ids=None if segment.identity else segment.doc_ids)
+    
+    @classmethod
+    def load(cls, path, df, mmap=True, lemma_vocab=None, docs=None):
+        index, meta = read_segment(path, mmap=mmap)
+        doc_ids = meta.get('doc_ids')
+        stop_words = set(meta['stop_words']) if meta['stop_words'] is not None else None
+        inv_index = cls(df, stop_words=stop_words, morph=morph if meta['morph'] else None, index=index, lemma_vocab=lemma_vocab,
+                        doc_ids=doc_ids, docs=docs, positions=index.positions is not None)
+        if doc_ids is not None:
+            # written after live changes: deleted docs are gone, but the ids still index the dataframe rows
+            if len(doc_ids) > 0 and doc_ids[-1] >= inv_index.df.shape[0]:
+                raise ValueError(f'index {path} has doc id {doc_ids[-1]}, dataframe has {inv_index.df.shape[0]} rows')
+        elif index.num_docs != inv_index.df.shape[0]:
+            raise ValueError(f'index {path} has {index.num_docs} docs, dataframe has {inv_index.df.shape[0]}')
+        return inv_index
     
     def get_docs(self, doc_id):
-        if isinstance(doc_id, str):
-            return self.df.loc[self.df['doc_id']==doc_id, 'text'].values[0]
-        elif isinstance(doc_id, (list, tuple, set)):
-            return self.df.loc[self.df['doc_id'].isin(doc_id), 'text']
+        # doc ids are row positions, so this is a positional read of the docstore, not a scan of df;
+        # several ids give their texts in the order asked for, e.g. rank order
+        if isinstance(doc_id, (list, tuple, set)):
+            return self.docs.get_many(doc_id)
+        return self.docs.get(doc_id)
         
     def get_corpus_len(self):
         return len(self.index)
+
+
+def init_worker(stop_words, use_morph, lemma_vocab, positions):
+    # tokenizer-only copy of the index for the build_parallel workers
+    global worker_index
+    worker_index = InvIndex(pd.DataFrame({'text': []}), stop_words=stop_words, morph=morph if use_morph else None,
+                            index=PostingsBuilder().build(), lemma_vocab=lemma_vocab, positions=positions)
+
+def index_chunk(doc_ids, texts):
+    return worker_index.index_chunk(doc_ids, texts)
     
 if __name__ == "__main__":
-    path = sys.argv[1]
-    df = pd.read_csv(path, sep='\t')
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path')
+    parser.add_argument('--index', default=None, help='segment file: loaded if it exists, written after the build otherwise')
+    parser.add_argument('--n_jobs', type=int, default=1, help='worker processes for the index build')
+    parser.add_argument('--positions', action='store_true', help='positional index, multiword queries run as phrases')
+    parser.add_argument('--docs', default=None, help='docstore file: loaded if it exists, written after the build otherwise')
+    parser.add_argument('--lemma_vocab', default=None, help='lemma cache file: pre-warms the cache if it exists, written at exit')
+    telemetry.add_arguments(parser)
+    args = parser.parse_args()
+    telemetry.start(args.profile, args.telemetry)
+    df = pd.read_csv(args.path, sep='\t')
+    docs = DocStore.load(args.docs) if args.docs is not None and os.path.exists(args.docs) else None
     
-    inv_index = InvIndex(df, morph=morph, stop_words=rus_stop)
+    if args.index is not None and os.path.exists(args.index):
+        inv_index = InvIndex.load(args.index, df, lemma_vocab=args.lemma_vocab, docs=docs)
+    else:
+        inv_index = InvIndex(df, morph=morph, stop_words=rus_stop, n_jobs=args.n_jobs, lemma_vocab=args.lemma_vocab, docs=docs,
+                             positions=args.positions)
+        if args.index is not None:
+            inv_index.save(args.index)
+    if args.docs is not None and docs is None:
+        inv_index.docs.save(args.docs)
 
     test_query = [
         'отопление',
@@ -123,7 +340,9 @@ if __name__ == "__main__":
     results = []
     for query in test_query:
         print(f'Target word: "{query}"')
-        if len(query.split(' ')) > 1:
+        if len(query.split(' ')) > 1 and inv_index.positions:
+            output = inv_index.search_phrase(query)
+        elif len(query.split(' ')) > 1:
             output = inv_index.search_multiword(query)
         else:
             output = inv_index.search_word(query)
@@ -133,9 +352,8 @@ if __name__ == "__main__":
         tokens_list = inv_index.tokenizer(query)
         
         flag = True
-        for doc_id in output:
-            doc = inv_index.get_docs(doc_id)
-            doc_lemma = inv_index.tokenizer(inv_index.get_docs(doc_id))
+        for doc in inv_index.get_docs(output):
+            doc_lemma = inv_index.tokenizer(doc)
             results.append({'query':query, 'lemma':doc_lemma, 'text':doc})
             for token in tokens_list:
                 if token not in doc:
@@ -145,6 +363,11 @@ if __name__ == "__main__":
     
     df_res = pd.DataFrame(results)
     df_res.to_csv('res.csv')
+    print(f'Result cache: {inv_index.results.stats()}')
+    
+    print(f'Lemma cache: {inv_index.lemmas.stats()}')
+    if args.lemma_vocab is not None:
+        inv_index.lemmas.save_vocab(args.lemma_vocab)
         
     print(f'Num of index with morhp and stop-words: {inv_index.get_corpus_len()}')
     
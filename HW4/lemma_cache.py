@@ -0,0 +1,60 @@
+import threading
+from collections import OrderedDict
+from common import telemetry
+
+MISSING = object()
+
+
+class LemmaCache():
+    # surface form -> lemma with LRU eviction; None is cached for tokens pymorphy3 cannot parse.
+    # Shared by the server's search threads: the dict and the counters change under the lock,
+    # pymorphy3 runs outside it, so two threads may parse the same new token once each
+    def __init__(self, morph, maxsize=200000):
+        self.morph = morph
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lemma(self, token):
+        with self.lock:
+            lemma = self.cache.get(token, MISSING)
+            if lemma is not MISSING:
+                self.hits += 1
+                self.cache.move_to_end(token)
+                return lemma
+            self.misses += 1
+        # only the misses are timed, a hit is cheaper than the timer
+        with telemetry.timer('lemmatize'):
+            parses = self.morph.parse(token)
+        lemma = parses[0].normal_form if parses else None
+        self.put(token, lemma)
+        return lemma
+
+    def put(self, token, lemma):
+        with self.lock:
+            self.cache[token] = lemma
+            self.cache.move_to_end(token)
+            if len(self.cache) > self.maxsize:
+                self.cache.popitem(last=False)
+
+    def save_vocab(self, path):
+        # least recently used first, so loading it back keeps the eviction order
+        with self.lock:
+            items = list(self.cache.items())
+        with open(path, 'w', encoding='utf-8') as f:
+            for token, lemma in items:
+                f.write(f"{token}\t{lemma or ''}\n")
+
+    def load_vocab(self, path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                token, lemma = line.rstrip('\n').split('\t')
+                self.put(token, lemma or None)
+
+    def stats(self):
+        with self.lock:
+            hits, misses, size = self.hits, self.misses, len(self.cache)
+        total = hits + misses
+        return {'hits': hits, 'misses': misses, 'size': size, 'hit_rate': hits / total if total else 0.0}
@@ -0,0 +1,120 @@
+import math
+import numpy as np
+import faiss
+
+KINDS = ['flat', 'sq_fp16', 'sq8', 'pq', 'ivf_flat', 'ivf_pq', 'hnsw']
+# flat-scan kinds with compressed codes: 2 and 1 bytes per dimension, pq_m bytes per vector
+QUANTIZED = {'sq_fp16': 'SQfp16', 'sq8': 'SQ8'}
+# faiss warns below 39 training points per centroid; up to 256 centroids per PQ sub-quantizer
+MIN_POINTS_PER_CENTROID = 39
+
+
+def default_nlist(num_vectors):
+    # ~4 sqrt(n) inverted lists, but no more than the sample can train
+    return max(1, min(int(4 * math.sqrt(num_vectors)), num_vectors // MIN_POINTS_PER_CENTROID))
+
+
+def pq_nbits(num_vectors):
+    # bits per PQ code: 8 (256 centroids per sub-quantizer) when the sample can train them, fewer on
+    # a small corpus; 0 when not even 2 centroids can be trained and the vectors stay unquantized
+    return max(0, min(8, int(math.log2(max(num_vectors // MIN_POINTS_PER_CENTROID, 1)))))
+
+
+def default_pq_m(dim):
+    # the largest number of sub-quantizers up to 64 that divides dim: 512 -> 64, 312 -> 52 bytes per vector
+    return max(m for m in range(1, min(dim, 64) + 1) if dim % m == 0)
+
+
+def factory_string(kind, dim, num_vectors, nlist=None, pq_m=None, hnsw_m=32):
+    if kind == 'flat':
+        return 'Flat'
+    if kind in QUANTIZED:
+        return QUANTIZED[kind]
+    if kind in ('pq', 'ivf_pq') and pq_nbits(num_vectors) == 0 or kind == 'ivf_flat' and num_vectors < MIN_POINTS_PER_CENTROID:
+        # too few vectors to train a codebook or one inverted list: a flat scan of so few is fast anyway
+        return 'Flat'
+    pq_m = default_pq_m(dim) if pq_m is None else pq_m
+    if kind == 'pq':
+        return f'PQ{pq_m}x{pq_nbits(num_vectors)}np'
+    if kind == 'hnsw':
+        return f'HNSW{hnsw_m},Flat'
+    # every inverted list needs at least one training point
+    nlist = default_nlist(num_vectors) if nlist is None else max(1, min(nlist, num_vectors))
+    if kind == 'ivf_flat':
+        return f'IVF{nlist},Flat'
+    if kind == 'ivf_pq':
+        # 'np': no polysemous training, it is only used for Hamming filtering and makes training ~8x slower
+        return f'IVF{nlist},PQ{pq_m}x{pq_nbits(num_vectors)}np'
+    raise ValueError(f'unknown index kind {kind!r}, expected one of {KINDS}')
+
+
+def build_index(embeddings, kind='flat', nlist=None, pq_m=None, hnsw_m=32, ef_construction=80, train_size=None, seed=0):
+    # inner product over L2-normalized embeddings, i.e. cosine similarity; IVF coarse centroids and
+    # PQ codebooks are trained on a random sample of train_size vectors
+    num_vectors, dim = embeddings.shape
+    index = faiss.index_factory(dim, factory_string(kind, dim, num_vectors, nlist, pq_m, hnsw_m), faiss.METRIC_INNER_PRODUCT)
+    if kind == 'hnsw':
+        index.hnsw.efConstruction = ef_construction
+    if not index.is_trained:
+        if train_size is None:
+            # SQ only needs value ranges; IVF needs points per list, PQ per sub-quantizer centroid
+            ivf = faiss.try_extract_index_ivf(index)
+            nlist = ivf.nlist if ivf is not None else 0
+            train_size = MIN_POINTS_PER_CENTROID * max(nlist, 2 ** pq_nbits(num_vectors) if kind in ('pq', 'ivf_pq') else 0,
+                                                       256 if kind == 'sq8' else 0)
+        rng = np.random.default_rng(seed)
+        sample = embeddings[np.sort(rng.choice(num_vectors, min(train_size, num_vectors), replace=False))]
+        index.train(np.ascontiguousarray(sample, dtype=np.float32))
+    index.add(np.ascontiguousarray(embeddings, dtype=np.float32))
+    return index
+
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    # nprobe: inverted lists visited per query (IVF), ef_search: HNSW candidate list size;
+    # both trade recall for latency, the one that does not apply to the index is ignored
+    params = faiss.ParameterSpace()
+    if nprobe is not None and faiss.try_extract_index_ivf(index) is not None:
+        params.set_index_parameter(index, 'nprobe', nprobe)
+    if ef_search is not None and isinstance(index, faiss.IndexHNSW):
+        params.set_index_parameter(index, 'efSearch', ef_search)
+
+
+class Reranker():
+    # exact inner products over a shortlist of approximate hits: vectors[rows[i]] is the float
+    # vector of faiss row i, and vectors can be the memory-mapped embedding store, so the full
+    # precision matrix stays in the page cache instead of a second copy in the process
+    def __init__(self, vectors, rows=None):
+        self.vectors = vectors
+        self.rows = rows
+
+    def row_vectors(self, ids):
+        rows = ids if self.rows is None else self.rows[ids]
+        return np.asarray(self.vectors[rows], dtype=np.float32)
+
+    def rerank(self, queries, I, top_k):
+        found = I >= 0
+        ids = np.where(found, I, 0)
+        vectors = self.row_vectors(ids.ravel()).reshape(*I.shape, -1)
+        D = np.einsum('qkd,qd->qk', vectors, queries)
+        D[~found] = -np.inf
+        order = np.argsort(-D, axis=1, kind='stable')[:, :top_k]
+        D = np.take_along_axis(D, order, axis=1)
+        I = np.take_along_axis(np.where(found, I, -1), order, axis=1)
+        return D, I
+
+
+def reconstruct(index, ids):
+    # the stored (for sq / pq kinds decoded, so approximate) vectors of the given rows
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and ivf.direct_map.type == faiss.DirectMap.NoMap:
+        ivf.make_direct_map()
+    return index.reconstruct_batch(np.asarray(ids, dtype=np.int64))
+
+
+def save_index(index, path):
+    faiss.write_index(index, path)
+
+
+def load_index(path, mmap=False):
+    # mmap leaves the vectors / codes in the page cache instead of reading them into memory
+    return faiss.read_index(path, faiss.IO_FLAG_MMAP if mmap else 0)
@@ -0,0 +1,53 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+class EmbeddingCache():
+    # query text -> embedding with LRU eviction, so repeated popular queries skip the encoder;
+    # encode(list of texts) -> (n, dim) array is only called for the misses, once per batch
+    def __init__(self, encode, maxsize=10000):
+        self.encode = encode
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, texts):
+        # one row per text, in the order given
+        rows = [None] * len(texts)
+        missing = {}
+        with self.lock:
+            for i, text in enumerate(texts):
+                if text in self.cache:
+                    self.hits += 1
+                    self.cache.move_to_end(text)
+                    rows[i] = self.cache[text]
+                else:
+                    # a repeat within the batch shares the first one's encoding
+                    if text in missing:
+                        self.hits += 1
+                    else:
+                        self.misses += 1
+                    missing.setdefault(text, []).append(i)
+        if missing:
+            # the encoder runs outside the lock, other threads can still read the cache meanwhile
+            embeddings = self.encode(list(missing))
+            with self.lock:
+                for (text, where), emb in zip(missing.items(), embeddings):
+                    self.put(text, emb)
+                    for i in where:
+                        rows[i] = emb
+        return np.stack(rows) if rows else np.empty((0, 0), dtype=np.float32)
+
+    def put(self, text, emb):
+        self.cache[text] = emb
+        self.cache.move_to_end(text)
+        if len(self.cache) > self.maxsize:
+            self.cache.popitem(last=False)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.cache),
+                'hit_rate': self.hits / total if total else 0.0}
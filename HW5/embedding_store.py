@@ -0,0 +1,144 @@
+import os
+import json
+import hashlib
+import numpy as np
+from tqdm import tqdm
+
+# an embedding store is a directory:
+#   meta.json        model name, dim, dtype and the current generation
+#   vectors-<g>.bin  raw (rows, dim) matrix, appended a chunk at a time
+#   keys-<g>.txt     content hash of row i on line i, appended after the chunk's vectors are on disk
+# a key is only written once its vector is durable, so after a crash every complete line has its
+# row and the build resumes from there; a torn last line or rows without a key are dropped.
+# compact() writes the next generation and switches to it by replacing meta.json
+KEY_LEN = 32
+
+
+def content_key(text):
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=KEY_LEN // 2).hexdigest()
+
+
+class EmbeddingStore():
+    def __init__(self, path, model_name, dim, dtype='float16'):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.meta_path = os.path.join(path, 'meta.json')
+        meta = {'model_name': model_name, 'dim': int(dim), 'dtype': np.dtype(dtype).name}
+        generation = 0
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, encoding='utf-8') as f:
+                stored = json.load(f)
+            generation = stored.pop('generation')
+            if stored != meta:
+                raise ValueError(f'embedding store {path} holds {stored}, expected {meta}')
+        self.meta = meta
+        self.model_name = model_name
+        self.dim = int(dim)
+        self.dtype = np.dtype(dtype)
+        self.rows = {}
+        self.set_generation(generation)
+        self.recover()
+
+    def set_generation(self, generation):
+        tmp = self.meta_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({**self.meta, 'generation': generation}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.meta_path)
+        self.generation = generation
+        self.vectors_path = os.path.join(self.path, f'vectors-{generation}.bin')
+        self.keys_path = os.path.join(self.path, f'keys-{generation}.txt')
+
+    def recover(self):
+        keys = []
+        if os.path.exists(self.keys_path):
+            with open(self.keys_path, encoding='ascii') as f:
+                for line in f:
+                    if len(line) != KEY_LEN + 1:
+                        break
+                    keys.append(line[:KEY_LEN])
+        row_bytes = self.dim * self.dtype.itemsize
+        num_rows = os.path.getsize(self.vectors_path) // row_bytes if os.path.exists(self.vectors_path) else 0
+        keys = keys[:num_rows]
+        # cut both files back to the rows that have a key
+        with open(self.keys_path, 'a', encoding='ascii') as f:
+            f.truncate(len(keys) * (KEY_LEN + 1))
+        with open(self.vectors_path, 'ab') as f:
+            f.truncate(len(keys) * row_bytes)
+        self.rows = {key: i for i, key in enumerate(keys)}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def missing(self, texts):
+        # distinct texts that have no row yet, in first-seen order
+        seen = set()
+        out = []
+        for text in texts:
+            key = content_key(text)
+            if key not in self.rows and key not in seen:
+                seen.add(key)
+                out.append(text)
+        return out
+
+    def append(self, texts, embeddings):
+        with open(self.vectors_path, 'ab') as f:
+            f.write(np.ascontiguousarray(embeddings, dtype=self.dtype).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        keys = [content_key(text) for text in texts]
+        with open(self.keys_path, 'a', encoding='ascii') as f:
+            f.write(''.join(key + '\n' for key in keys))
+            f.flush()
+            os.fsync(f.fileno())
+        for key in keys:
+            self.rows[key] = len(self.rows)
+
+    def update(self, texts, encode, chunk_size=1024, show_progress_bar=False):
+        # encodes only the texts the store does not have, chunk_size at a time, every chunk durable
+        # before the next one starts; returns how many texts were encoded
+        todo = self.missing(texts)
+        starts = range(0, len(todo), chunk_size)
+        for start in tqdm(starts, disable=not show_progress_bar or len(todo) == 0):
+            chunk = todo[start:start + chunk_size]
+            self.append(chunk, encode(chunk))
+        return len(todo)
+
+    def row_ids(self, texts):
+        return np.array([self.rows[content_key(text)] for text in texts], dtype=np.int64)
+
+    def vectors(self):
+        # read-only memory map of all rows in the stored dtype
+        if len(self.rows) == 0:
+            return np.empty((0, self.dim), dtype=self.dtype)
+        return np.memmap(self.vectors_path, dtype=self.dtype, mode='r', shape=(len(self.rows), self.dim))
+
+    def matrix(self, texts):
+        # float32 (len(texts), dim) rows for texts from the memory-mapped file, no encoding
+        return np.asarray(self.vectors()[self.row_ids(texts)], dtype=np.float32)
+
+    def compact(self, texts):
+        # rewrites the store with only the rows of texts, e.g. after many docs were removed or edited;
+        # texts it has no row for (docs added since the last update) are skipped, update() encodes them
+        keep = {content_key(text) for text in texts}
+        order = sorted(self.rows[key] for key in keep if key in self.rows)
+        keys = {i: key for key, i in self.rows.items()}
+        vectors = self.vectors()
+        old_vectors, old_keys = self.vectors_path, self.keys_path
+        next_vectors = os.path.join(self.path, f'vectors-{self.generation + 1}.bin')
+        next_keys = os.path.join(self.path, f'keys-{self.generation + 1}.txt')
+        with open(next_vectors, 'wb') as f:
+            f.write(np.ascontiguousarray(vectors[order]).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        with open(next_keys, 'w', encoding='ascii') as f:
+            f.write(''.join(keys[i] + '\n' for i in order))
+            f.flush()
+            os.fsync(f.fileno())
+        del vectors
+        # a crash before this line leaves the old generation current and whole
+        self.set_generation(self.generation + 1)
+        self.rows = {keys[i]: n for n, i in enumerate(order)}
+        os.remove(old_vectors)
+        os.remove(old_keys)
@@ -0,0 +1,179 @@
+import os
+import sys
+import time
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'HW3'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'HW4'))
+from common import telemetry
+
+FUSIONS = ['rrf', 'blend']
+RETRIEVALS = ['both', 'lexical']
+STAGES = ['lexical', 'encode', 'ann', 'dense_score', 'fuse', 'total']
+# the stage report covers the last this many searches per stage
+TIMING_WINDOW = 10000
+
+
+def rrf(rankings, k=60):
+    # reciprocal-rank fusion: sum of 1 / (k + rank) over the lists a doc appears in
+    scores = {}
+    for ranking in rankings:
+        for rank, (doc_id, _) in enumerate(ranking, 1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda x: x[1], reverse=True)
+
+
+def min_max(scores):
+    # doc_id -> score scaled to [0, 1]; docs without a score (None) get 0
+    values = [s for s in scores.values() if s is not None]
+    if len(values) == 0:
+        return {doc_id: 0.0 for doc_id in scores}
+    lo, hi = min(values), max(values)
+    return {doc_id: 0.0 if s is None else (s - lo) / (hi - lo) if hi > lo else 1.0 for doc_id, s in scores.items()}
+
+
+def blend(lexical, dense, alpha=0.5):
+    # alpha * dense + (1 - alpha) * lexical over min-max normalized scores of the same candidates
+    lexical, dense = min_max(lexical), min_max(dense)
+    fused = {doc_id: alpha * dense.get(doc_id, 0.0) + (1 - alpha) * lexical.get(doc_id, 0.0) for doc_id in set(lexical) | set(dense)}
+    return sorted(fused.items(), key=lambda x: x[1], reverse=True)
+
+
+class HybridSearch():
+    # BM25 from a HW3 / HW4 InvIndex and dense retrieval from a HW5 InvIndex over the same doc ids.
+    # retrieval='both' runs the lexical search and the query encode + ANN search at the same time;
+    # retrieval='lexical' skips the ANN search and only scores the lexical candidates densely.
+    # Candidates are fused with RRF or score blending; rerank orders the fused top by the dense score.
+    # workers is the size of the lexical search pool, at least the number of threads that call
+    # search() at once so they do not queue behind each other (ThreadPoolExecutor's default if None)
+    def __init__(self, lexical, semantic, fusion='rrf', retrieval='both', candidates=100, rrf_k=60, alpha=0.5, rerank=False,
+                 workers=None):
+        if len(lexical.docs) != len(semantic.docs):
+            raise ValueError(f'lexical index has {len(lexical.docs)} docs, semantic index has {len(semantic.docs)}: '
+                             f'not the same doc id space')
+        if fusion not in FUSIONS:
+            raise ValueError(f'unknown fusion {fusion!r}, expected one of {FUSIONS}')
+        if retrieval not in RETRIEVALS:
+            raise ValueError(f'unknown retrieval {retrieval!r}, expected one of {RETRIEVALS}')
+        self.lexical = lexical
+        self.semantic = semantic
+        self.fusion = fusion
+        self.retrieval = retrieval
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+        self.alpha = alpha
+        self.rerank = rerank
+        self.executor = ThreadPoolExecutor(workers)
+        self.timings = {stage: deque(maxlen=TIMING_WINDOW) for stage in STAGES}
+
+    def timed(self, stage, fn, *args):
+        start = time.perf_counter()
+        result = fn(*args)
+        self.timings[stage].append(time.perf_counter() - start)
+        return result
+
+    def dense(self, query):
+        # the text semantic_search encodes too, so both share the query embedding cache entries
+        query_emb = self.timed('encode', self.semantic.encode_queries, [self.semantic.normalize(query)])
+        if self.retrieval == 'lexical':
+            return query_emb[0], []
+        return query_emb[0], self.timed('ann', self.semantic.search_embeddings, query_emb, self.candidates)[0]
+
+    def dense_scores(self, query_emb, doc_ids):
+        if len(doc_ids) == 0:
+            return {}
+        scores = self.timed('dense_score', self.semantic.score_docs, query_emb, [int(d) for d in doc_ids])
+        return dict(zip(doc_ids, scores))
+
+    def search(self, query, top_k=10):
+        start = time.perf_counter()
+        lexical = self.executor.submit(self.timed, 'lexical', self.lexical.search_bm25, query, self.candidates)
+        query_emb, ann = self.dense(query)
+        lexical = lexical.result()
+
+        fuse_start = time.perf_counter()
+        if self.fusion == 'rrf' and self.retrieval == 'both':
+            fused = rrf([lexical, ann], self.rrf_k)
+        elif self.fusion == 'rrf':
+            # no ANN list: the lexical candidates ranked by their dense score are the second list
+            dense = self.dense_scores(query_emb, [doc_id for doc_id, _ in lexical])
+            ranking = sorted(((d, s) for d, s in dense.items() if s is not None), key=lambda x: x[1], reverse=True)
+            fused = rrf([lexical, ranking], self.rrf_k)
+        else:
+            # docs only the ANN search found get a lexical score of 0, the lexical-only ones a dense score
+            dense = dict(ann)
+            dense.update(self.dense_scores(query_emb, [doc_id for doc_id, _ in lexical if doc_id not in dense]))
+            fused = blend(dict(lexical), dense, self.alpha)
+        if self.rerank:
+            # the docs with a vector trade places by dense score; a doc too short for a vector keeps the
+            # place and the score fusion gave it, instead of dropping out of a list it matched
+            top = fused[:self.candidates]
+            dense = self.dense_scores(query_emb, [doc_id for doc_id, _ in top])
+            held = iter(sorted(((d, s) for d, s in dense.items() if s is not None), key=lambda x: x[1], reverse=True))
+            fused = [next(held) if dense[doc_id] is not None else (doc_id, score) for doc_id, score in top]
+        self.timings['fuse'].append(time.perf_counter() - fuse_start)
+        self.timings['total'].append(time.perf_counter() - start)
+        return fused[:top_k]
+
+    def stage_report(self):
+        # p50 / p99 milliseconds per stage over the last TIMING_WINDOW searches; 'fuse' includes the dense scoring
+        report = {}
+        for stage, times in self.timings.items():
+            times = list(times)
+            if times:
+                report[stage] = {'n': len(times), 'p50_ms': float(np.percentile(times, 50) * 1000),
+                                 'p99_ms': float(np.percentile(times, 99) * 1000)}
+        return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', nargs='?', default='data/articles_extracted.tsv')
+    parser.add_argument('--store', default='data/embeddings', help='embedding store directory of the semantic index')
+    parser.add_argument('--index_kind', default='flat')
+    parser.add_argument('--morph', action='store_true', help='HW4 lemmatized BM25 instead of the HW3 one')
+    parser.add_argument('--fusion', default='rrf', choices=FUSIONS)
+    parser.add_argument('--retrieval', default='both', choices=RETRIEVALS)
+    parser.add_argument('--candidates', type=int, default=100)
+    parser.add_argument('--alpha', type=float, default=0.5, help='dense weight of the blend fusion')
+    parser.add_argument('--rerank', action='store_true', help='order the fused candidates by the dense score')
+    telemetry.add_arguments(parser)
+    args = parser.parse_args()
+    telemetry.start(args.profile, args.telemetry)
+    df = pd.read_csv(args.path, sep='\t')
+
+    from inverted_index_bert import InvIndex as SemanticIndex
+    if args.morph:
+        import inverted_index_morph
+        lexical = inverted_index_morph.InvIndex(df, morph=inverted_index_morph.morph, stop_words=inverted_index_morph.rus_stop)
+    else:
+        import inverted_index
+        lexical = inverted_index.InvIndex(df, stop_words=inverted_index.rus_stop)
+    # one docstore for both, the doc ids are the same
+    semantic = SemanticIndex(df, model_name='distiluse-base-multilingual-cased-v2', store=args.store,
+                             index_kind=args.index_kind, docs=lexical.docs)
+    hybrid = HybridSearch(lexical, semantic, fusion=args.fusion, retrieval=args.retrieval,
+                          candidates=args.candidates, alpha=args.alpha, rerank=args.rerank)
+
+    test_query = [
+        'введение дополнительных пошлин запланировано на октябрь следующего года',
+        'обожаю мультики',
+        'в Московском зоопарке начали',
+        'Ранее во Владивостоке'
+    ]
+    results = []
+    for query in test_query:
+        print(f'Target word: "{query}"')
+        output = hybrid.search(query)
+        print(output)
+        for doc in lexical.get_docs([doc_id for doc_id, _ in output]):
+            results.append({'query': query, 'text': doc})
+        print()
+    pd.DataFrame(results).to_csv('res_hybrid.csv')
+    for stage, stats in hybrid.stage_report().items():
+        print(f'{stage:12s} p50 {stats["p50_ms"]:8.2f} ms   p99 {stats["p99_ms"]:8.2f} ms')
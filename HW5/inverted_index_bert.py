@@ -1,5 +1,8 @@
 import os
 import re
+import sys
+import argparse
+import unicodedata
 import numpy as np
 import pandas as pd
 from tqdm import tqdm
@@ -8,22 +11,79 @@ from sentence_transformers import SentenceTransformer
 import torch
 import faiss
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.batcher import MicroBatcher
+from common import telemetry
+from common.docstore import DocStore
+from common.result_cache import ResultCache
+from ann_index import KINDS, Reranker, build_index, reconstruct, set_search_params, save_index, load_index
+from embedding_cache import EmbeddingCache
+from embedding_store import EmbeddingStore
+
 class InvIndex():
-    def __init__(self, df, embeddings=None, model_name='cointegrated/rubert-tiny'):
+    def __init__(self, df, embeddings=None, model_name='cointegrated/rubert-tiny', docs=None,
+                 index=None, index_kind='flat', nlist=None, pq_m=None, hnsw_m=32, nprobe=16, ef_search=64,
+                 cache_size=10000, max_batch=64, max_wait=0.0, store=None, chunk_size=1024, rerank=0,
+                 result_cache_size=10000, result_ttl=None, result_cache_items=1000000):
         df = df.dropna(subset=['text']).reset_index(drop=True)
-        df = df[df['text'].apply(self.drop_short)].reset_index(drop=True)
+        # doc ids are given before drop_short, so they are the same ones HW3 / HW4 use for the same
+        # articles; the short docs keep their ids, they just have no vector
         df['doc_id'] = df.index.astype(str)
+        num_docs = df.shape[0]
+        if docs is not None and len(docs) != num_docs:
+            raise ValueError(f'docstore has {len(docs)} docs, dataframe has {num_docs}')
+        self.docs = DocStore(df['text'].tolist()) if docs is None else docs
+        df = df[df['text'].apply(self.drop_short)].reset_index(drop=True)
         self.df = df
+        # faiss row -> doc_id, so a whole result matrix maps in one fancy-indexing step, and back
+        self.doc_ids = df['doc_id'].to_numpy()
+        self.rows_of = np.full(num_docs, -1, dtype=np.int64)
+        self.rows_of[df['doc_id'].astype(int).to_numpy()] = np.arange(df.shape[0])
         self.model = SentenceTransformer(model_name)
+        self.query_cache = EmbeddingCache(self.get_emb, maxsize=cache_size)
+        self.batcher = MicroBatcher(self.search_items, max_batch=max_batch, max_wait=max_wait)
+        # (normalized query, top_k) -> results; generation goes up whenever the index or its search params change
+        self.results = ResultCache(result_cache_size, result_ttl, result_cache_items)
+        self.generation = 0
         
-        if embeddings is None:
-            self.embeddings = self.get_emb(df['text'].tolist(), show_progress_bar=True)
-            np.save('embeddings.npy', self.embeddings)
-        elif embeddings.shape[0] == df.shape[0]:
+        if embeddings is not None:
+            if embeddings.shape[0] != df.shape[0]:
+                raise ValueError(f'embeddings have {embeddings.shape[0]} rows, dataframe has {df.shape[0]} docs')
             faiss.normalize_L2(embeddings)
             self.embeddings = embeddings
+        elif store is not None:
+            # store is an embedding store directory; only texts it has no vector for are encoded
+            if isinstance(store, str):
+                store = EmbeddingStore(store, model_name, self.model.get_sentence_embedding_dimension())
+            encoded = store.update(df['text'].tolist(), self.get_emb, chunk_size=chunk_size, show_progress_bar=True)
+            print(f'Embedding store: {encoded} texts encoded, {len(store)} stored')
+            # a prebuilt faiss index already has the vectors, no need to read the matrix
+            self.embeddings = None
+            if index is None:
+                self.embeddings = store.matrix(df['text'].tolist())
+                faiss.normalize_L2(self.embeddings)
+        else:
+            self.embeddings = self.get_emb(df['text'].tolist(), show_progress_bar=True)
+            np.save('embeddings.npy', self.embeddings)
             
-        self.create_index()
+        self.index_kind = index_kind
+        if index is None:
+            self.create_index(nlist=nlist, pq_m=pq_m, hnsw_m=hnsw_m)
+        elif index.ntotal != df.shape[0]:
+            raise ValueError(f'faiss index has {index.ntotal} vectors, dataframe has {df.shape[0]} docs')
+        else:
+            self.index = index
+        self.set_search_params(nprobe, ef_search)
+
+        # faiss keeps its own copy of the vectors (quantized for sq/pq kinds), so the float matrix is
+        # only kept for re-ranking, and not even then when the store's memory map can serve it
+        self.rerank = rerank
+        self.reranker = None
+        if rerank and store is not None:
+            self.reranker = Reranker(store.vectors(), store.row_ids(df['text'].tolist()))
+        elif rerank:
+            self.reranker = Reranker(self.embeddings)
+        self.embeddings = None
         
     def drop_short(self, val):
         if len(val) < 50:
@@ -31,44 +91,117 @@ class InvIndex():
         return True
     
     def get_emb(self, data_list, show_progress_bar=False):
-        embeddings = self.model.encode(data_list, convert_to_numpy=True, show_progress_bar=show_progress_bar)
+        telemetry.count('encoded_texts', len(data_list))
+        with telemetry.timer('encode'):
+            embeddings = self.model.encode(data_list, convert_to_numpy=True, show_progress_bar=show_progress_bar)
         faiss.normalize_L2(embeddings)
         return embeddings
         
         
-    def create_index(self):
-        dim = self.embeddings.shape[1]
-        self.index = faiss.IndexFlatIP(dim)
-        self.index.add(self.embeddings)
+    def create_index(self, nlist=None, pq_m=None, hnsw_m=32):
+        # 'flat' is the exact scan; 'ivf_flat', 'ivf_pq' and 'hnsw' are approximate, see ann_index
+        self.index = build_index(self.embeddings, self.index_kind, nlist=nlist, pq_m=pq_m, hnsw_m=hnsw_m)
+        self.generation += 1
+
+    def set_search_params(self, nprobe=None, ef_search=None):
+        set_search_params(self.index, nprobe, ef_search)
+        self.generation += 1
+
+    def save_index(self, path):
+        save_index(self.index, path)
     
     def semantic_search(self, word, top_k=10):
-        query_emb = self.get_emb([word])
-        D, I = self.index.search(query_emb, top_k)
-        sims = D[0]
-        sims_norm = (sims + 1) / 2
-        results = []
-        for idx, score in zip(I[0], sims_norm):
-            doc_id = self.df.iloc[idx]['doc_id']
-            results.append((doc_id, float(score)))
-        results.sort(key=lambda x: x[1], reverse=True)
-        return results
+        # goes through the micro-batcher: queries from concurrent callers share one encode and one search
+        return self.batcher.submit((word, top_k)).result()
+
+    def search_items(self, items):
+        # MicroBatcher callback: (query, top_k) pairs searched together at the largest top_k
+        top_k = max(k for _, k in items)
+        results = self.semantic_search_batch([query for query, _ in items], top_k)
+        return [res[:k] for res, (_, k) in zip(results, items)]
+
+    def semantic_search_batch(self, queries, top_k=10):
+        # cached results first; one encode for the queries not in the embedding cache and one index
+        # search for all the remaining ones
+        if len(queries) == 0:
+            return []
+        generation = self.generation
+        queries = [self.normalize(query) for query in queries]
+        results = [self.results.get((query, top_k), generation) for query in queries]
+        todo = sorted({query for query, res in zip(queries, results) if res is None})
+        if len(todo) > 0:
+            found = dict(zip(todo, self.search_embeddings(self.encode_queries(todo), top_k)))
+            for query in todo:
+                self.results.put((query, top_k), found[query], generation)
+            results = [found[query] if res is None else res for query, res in zip(queries, results)]
+        return [list(res) for res in results]
+
+    def normalize(self, query):
+        # the text that gets encoded and is the cache key: spacing and Unicode forms that the model
+        # tokenizer does not tell apart map to one key. Case is kept, it can change the embedding
+        return ' '.join(unicodedata.normalize('NFC', query).split())
+
+    def encode_queries(self, queries):
+        return self.query_cache.get_many(queries)
+
+    def search_embeddings(self, query_emb, top_k=10):
+        # faiss returns every row sorted by similarity already
+        if self.reranker is not None:
+            # a shortlist of rerank * top_k approximate hits, re-scored with the float vectors
+            with telemetry.timer('faiss_search'):
+                D, I = self.index.search(query_emb, top_k * self.rerank)
+            with telemetry.timer('rerank'):
+                D, I = self.reranker.rerank(query_emb, I, top_k)
+        else:
+            with telemetry.timer('faiss_search'):
+                D, I = self.index.search(query_emb, top_k)
+        sims_norm = (D + 1) / 2
+        # an IVF index probing too few lists can come back with less than top_k hits, marked -1
+        found = I >= 0
+        doc_ids = self.doc_ids[np.where(found, I, 0)]
+        return [list(zip(ids[f].tolist(), sims[f].tolist())) for ids, sims, f in zip(doc_ids, sims_norm, found)]
+
+    @telemetry.timed('dense_score')
+    def score_docs(self, query_emb, doc_ids):
+        # similarity of one query embedding to the given docs on the semantic_search scale, without
+        # an index search; None for docs without a vector (dropped as too short)
+        rows = self.rows_of[np.asarray(doc_ids, dtype=np.int64)]
+        held = rows >= 0
+        scores = np.full(len(rows), np.nan)
+        if held.any():
+            vectors = self.reranker.row_vectors(rows[held]) if self.reranker is not None else reconstruct(self.index, rows[held])
+            scores[held] = (vectors @ query_emb + 1) / 2
+        return [None if np.isnan(score) else float(score) for score in scores]
     
     
     def get_docs(self, doc_id):
-        if isinstance(doc_id, str):
-            return self.df.loc[self.df['doc_id']==doc_id, 'text'].values[0]
-        elif isinstance(doc_id, (list, tuple, set)):
-            return self.df.loc[self.df['doc_id'].isin(doc_id), 'text']
+        # doc ids are docstore positions, so this is a positional read, not a scan of df;
+        # several ids give their texts in the order asked for, e.g. rank order
+        if isinstance(doc_id, (list, tuple, set)):
+            return self.docs.get_many(doc_id)
+        return self.docs.get(doc_id)
     
 if __name__ == "__main__":
-    path = 'data/articles_extracted.tsv'
-    df = pd.read_csv(path, sep='\t')
-    embeddings = None
-    try:
-        embeddings = np.load('data/embeddings.npy')
-    except:
-        pass
-    inv_index = InvIndex(df, model_name='distiluse-base-multilingual-cased-v2',embeddings=embeddings)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', nargs='?', default='data/articles_extracted.tsv')
+    parser.add_argument('--store', default='data/embeddings', help='embedding store directory, only new or changed docs are encoded')
+    parser.add_argument('--index', default=None, help='faiss index file: loaded if it exists, written after the build otherwise')
+    parser.add_argument('--index_kind', default='flat', choices=KINDS)
+    parser.add_argument('--nlist', type=int, default=None, help='IVF lists, ~4 sqrt(n) if omitted')
+    parser.add_argument('--pq_m', type=int, default=None, help='IVF-PQ bytes per vector')
+    parser.add_argument('--nprobe', type=int, default=16, help='IVF lists visited per query')
+    parser.add_argument('--ef_search', type=int, default=64, help='HNSW candidate list size')
+    parser.add_argument('--rerank', type=int, default=0, help='re-rank rerank * top_k approximate hits with the float vectors, 0 = off')
+    telemetry.add_arguments(parser)
+    args = parser.parse_args()
+    telemetry.start(args.profile, args.telemetry)
+    df = pd.read_csv(args.path, sep='\t')
+    index = load_index(args.index) if args.index is not None and os.path.exists(args.index) else None
+    inv_index = InvIndex(df, model_name='distiluse-base-multilingual-cased-v2', store=args.store, index=index,
+                         index_kind=args.index_kind, nlist=args.nlist, pq_m=args.pq_m, nprobe=args.nprobe, ef_search=args.ef_search,
+                         rerank=args.rerank)
+    if args.index is not None and index is None:
+        inv_index.save_index(args.index)
 
     test_query = [
         'введение дополнительных пошлин запланировано на октябрь следующего года',
@@ -78,30 +211,17 @@ if __name__ == "__main__":
     ]
 
     results = []
-    for query in test_query:
+    outputs = inv_index.semantic_search_batch(test_query)
+    for query, output in zip(test_query, outputs):
         print(f'Target word: "{query}"')
-        output = inv_index.semantic_search(query)
         print(output)
         output = [doc[0] for doc in output]
         
-        for doc_id in output:
-            doc = inv_index.get_docs(doc_id)
+        for doc in inv_index.get_docs(output):
             results.append({'query':query, 'text':doc})
         print()
 
     df_res = pd.DataFrame(results)
     df_res.to_csv('res.csv')
-        
-# Target word: "введение дополнительных пошлин запланировано на октябрь следующего года"
-# [('4518', 0.6549399495124817), ('2476', 0.6511968374252319), ('6192', 0.6510170698165894), ('5535', 0.6382994055747986), ('7396', 0.6338196992874146), ('1655', 0.6328158378601074), ('9677', 0.6294562816619873), ('590', 0.6260074377059937), ('4588', 0.6181036829948425), ('3657', 0.6177862882614136)]
-
-# Target word: "обожаю мультики"
-# [('8941', 0.5958610773086548), ('798', 0.5781135559082031), ('4804', 0.5740636587142944), ('824', 0.5689041018486023), ('7347', 0.5626034736633301), ('459', 0.5620265603065491), ('3577', 0.5608938336372375), ('6838', 0.5585743188858032), ('5806', 0.558009147644043), ('9173', 0.5542946457862854)]
-
-# Target word: "в Московском зоопарке начали"
-# [('3933', 0.7285987734794617), ('9394', 0.7048007249832153), ('3868', 0.7040282487869263), ('4794', 0.6950809955596924), ('9193', 0.6917909979820251), ('8296', 0.6883907318115234), ('3431', 0.684501051902771), ('1557', 0.6827715635299683), ('8817', 0.6820986270904541), ('2667', 0.6805094480514526)]
-
-# Target word: "Ранее во Владивостоке"
-# [('284', 0.6937113404273987), ('7819', 0.693475604057312), ('1972', 0.6908295154571533), ('4070', 0.6889685392379761), ('4087', 0.685509443283081), ('2189', 0.6849928498268127),
-    
-        
\ No newline at end of file
+    print(f'Query cache: {inv_index.query_cache.stats()}')
+    print(f'Result cache: {inv_index.results.stats()}')
@@ -0,0 +1,61 @@
+import argparse
+import time
+import numpy as np
+import faiss
+from corpus import load_embeddings
+from ann_index import build_index, set_search_params
+
+# (kind, build params, search parameter, values swept)
+CONFIGS = [
+    ('ivf_flat', {}, 'nprobe', [1, 4, 16, 64]),
+    ('ivf_pq', {}, 'nprobe', [1, 4, 16, 64]),
+    ('hnsw', {'hnsw_m': 32}, 'ef_search', [16, 32, 64, 128]),
+]
+
+
+def recall_at_k(found, truth):
+    k = truth.shape[1]
+    return np.mean([len(set(f[f >= 0]) & set(t)) / k for f, t in zip(found, truth)])
+
+
+def one_by_one(index, queries, k):
+    # the semantic_search path: one query per call
+    times = []
+    found = []
+    for q in queries:
+        start = time.perf_counter()
+        _, I = index.search(q[None, :], k)
+        times.append(time.perf_counter() - start)
+        found.append(I[0])
+    return np.array(found), np.percentile(times, 50) * 1000, np.percentile(times, 99) * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--embeddings', default=None, help='.npy embedding matrix, synthetic vectors if omitted')
+    parser.add_argument('--n_vectors', type=int, default=100000)
+    parser.add_argument('--dim', type=int, default=512)
+    parser.add_argument('--n_queries', type=int, default=500)
+    parser.add_argument('--k', type=int, default=10)
+    args = parser.parse_args()
+
+    x = load_embeddings(args.embeddings, n_vectors=args.n_vectors + args.n_queries, dim=args.dim)
+    base, queries = x[:-args.n_queries], x[-args.n_queries:]
+    print(f'{len(base)} vectors of dim {base.shape[1]}, {len(queries)} held-out queries')
+
+    flat = build_index(base, 'flat')
+    truth, p50, p99 = one_by_one(flat, queries, args.k)
+    print(f'{"flat":9s} {"":14s} recall@{args.k} 1.000   p50 {p50:7.3f} ms   p99 {p99:7.3f} ms   '
+          f'{faiss.serialize_index(flat).nbytes / 2**20:7.1f} MB')
+
+    for kind, params, knob, values in CONFIGS:
+        start = time.perf_counter()
+        index = build_index(base, kind, **params)
+        build_time = time.perf_counter() - start
+        size = faiss.serialize_index(index).nbytes / 2**20
+        print(f'{kind}: built in {build_time:.1f} s, {size:.1f} MB')
+        for value in values:
+            set_search_params(index, **{knob: value})
+            found, p50, p99 = one_by_one(index, queries, args.k)
+            print(f'{kind:9s} {knob}={value:<5d} recall@{args.k} {recall_at_k(found, truth):.3f}   '
+                  f'p50 {p50:7.3f} ms   p99 {p99:7.3f} ms')
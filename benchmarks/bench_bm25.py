@@ -0,0 +1,76 @@
+import argparse
+import time
+import numpy as np
+from corpus import load_corpus, TEST_QUERIES
+from bench_intersection import high_df_queries
+from common import ranking
+from common.ranking import BM25, bm25_top_k, exhaustive_top_k
+import inverted_index
+
+
+def bm25_exhaustive(index, words, top_k):
+    # scores every matching doc and sorts them all, the way results were ranked before pruning
+    bm25 = BM25(index.num_docs, index.avg_doc_len)
+    scores = {}
+    for w in set(words):
+        posting = index.get(w)
+        if posting is None:
+            continue
+        idf = bm25.idf(len(posting[0]))
+        lens = index.doc_lens[posting[0]].astype(np.float64)
+        for doc, score in zip(posting[0].tolist(), bm25.score(idf, posting[1], lens).tolist()):
+            scores[doc] = scores.get(doc, 0.0) + score
+    results = list(scores.items())
+    results.sort(key=lambda x: (-x[1], x[0]))
+    return results[:top_k]
+
+
+def latencies(fn, queries, repeat):
+    times = []
+    for _ in range(repeat):
+        for words in queries:
+            start = time.perf_counter()
+            fn(words)
+            times.append(time.perf_counter() - start)
+    return np.percentile(times, 50) * 1000, np.percentile(times, 99) * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path', default=None, help='articles TSV, synthetic corpus if omitted')
+    parser.add_argument('--n_docs', type=int, default=10000)
+    parser.add_argument('--top_k', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    df = load_corpus(args.path, n_docs=args.n_docs)
+    inv_index = inverted_index.InvIndex(df, result_cache_size=0)
+    index = inv_index.index
+    queries = [inv_index.tokenizer(q) for q in TEST_QUERIES] + high_df_queries(index)
+
+    def maxscore(words):
+        # the block-max MaxScore walk alone, without the switch to numpy scoring for short postings
+        threshold, ranking.EXHAUSTIVE_POSTINGS = ranking.EXHAUSTIVE_POSTINGS, -1
+        try:
+            return bm25_top_k(index, words, args.top_k)
+        finally:
+            ranking.EXHAUSTIVE_POSTINGS = threshold
+
+    def numpy_exhaustive(words):
+        bm25 = BM25(index.num_docs, index.avg_doc_len)
+        return exhaustive_top_k(index, {w: index.terms[w] for w in words if w in index.terms}, args.top_k, bm25)
+
+    scorers = [('dict', lambda w: bm25_exhaustive(index, w, args.top_k)), ('maxscore', maxscore),
+               ('numpy', numpy_exhaustive), ('bm25_top_k', lambda w: bm25_top_k(index, w, args.top_k))]
+    for words in queries:
+        exact = bm25_exhaustive(index, words, args.top_k)
+        same = all([d for d, _ in fn(words)] == [d for d, _ in exact] and
+                   np.allclose([s for _, s in fn(words)], [s for _, s in exact]) for _, fn in scorers[1:])
+        postings = sum(index.doc_freq(w) for w in words if w in index.terms)
+        print(f"{' '.join(words)[:50]:<50} {postings:8d} postings   same top-{args.top_k}: {same}")
+
+    # dict: every posting scored in Python, as before pruning; bm25_top_k picks maxscore or numpy
+    # by the postings of the query terms (ranking.EXHAUSTIVE_POSTINGS)
+    for name, fn in scorers:
+        p50, p99 = latencies(fn, queries, args.repeat)
+        print(f'{name:<12} p50 {p50:8.3f} ms   p99 {p99:8.3f} ms')
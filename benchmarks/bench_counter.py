@@ -0,0 +1,91 @@
+import argparse
+import time
+import tracemalloc
+from collections import Counter
+from corpus import load_corpus
+from сustom_map import CastomCounter
+from common.tokenizer import tokenize
+
+
+class LegacyCastomCounter:
+    # separate chaining with (key, value) tuples, the CastomCounter before open addressing
+    def __init__(self, input_list=None):
+        self.size = 100007
+        self.buckets = [[] for _ in range(self.size)]
+        self.load_factor_threshold = 0.75
+        self.count = 0
+        if input_list is not None:
+            for key in input_list:
+                self.put(key)
+
+    def hash(self, key):
+        s = str(key)
+        h = 0
+        for c in s:
+            h = (h * 31 + ord(c)) % self.size
+        return h
+
+    def put(self, key, value=None):
+        if self.count / self.size >= self.load_factor_threshold:
+            self.rehash()
+        h = self.hash(key)
+        for i, (k, v) in enumerate(self.buckets[h]):
+            if k == key:
+                self.buckets[h][i] = (key, v + 1 if value is None else value)
+                return
+        self.buckets[h].append((key, 1 if value is None else value))
+        self.count += 1
+
+    def items(self):
+        for bucket in self.buckets:
+            for k, v in bucket:
+                yield k, v
+
+    def rehash(self):
+        old_buckets = self.buckets
+        self.size *= 2
+        self.buckets = [[] for _ in range(self.size)]
+        self.count = 0
+        for bucket in old_buckets:
+            for key, value in bucket:
+                self.put(key, value)
+
+
+def get_ngrams(tokens_list, n):
+    return [tuple(tokens[i:i + n]) for tokens in tokens_list for i in range(len(tokens) - n + 1)]
+
+
+def measure(build, grams):
+    # timed and traced in separate runs, tracemalloc slows pure-Python inserts down several times
+    start = time.perf_counter()
+    counter = build(grams)
+    elapsed = time.perf_counter() - start
+    del counter
+    tracemalloc.start()
+    counter = build(grams)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return counter, elapsed, memory
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path', default=None, help='articles TSV, synthetic corpus if omitted')
+    parser.add_argument('--n_docs', type=int, default=3000)
+    parser.add_argument('--legacy', action='store_true', help='also run the chaining CastomCounter, slow')
+    args = parser.parse_args()
+
+    tokens = [tokenize(text) for text in load_corpus(args.path, n_docs=args.n_docs)['text'].dropna()]
+    engines = [('Counter', Counter), ('CastomCounter', CastomCounter)]
+    if args.legacy:
+        engines.append(('legacy', LegacyCastomCounter))
+    for n in [2, 3, 4]:
+        grams = get_ngrams(tokens, n)
+        print(f'n={n}: {len(grams)} grams')
+        expected = None
+        for name, build in engines:
+            counter, elapsed, memory = measure(build, grams)
+            counts = dict(counter.items())
+            expected = counts if expected is None else expected
+            print(f'  {name:<14} {elapsed:7.2f} s  {memory / 2**20:8.1f} MB  '
+                  f'{len(grams) / elapsed / 1e6:5.2f} M inserts/s  same counts {counts == expected}')
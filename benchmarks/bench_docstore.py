@@ -0,0 +1,59 @@
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+from corpus import load_corpus
+from common.docstore import DocStore
+
+
+def scan_page(df, page):
+    # the old get_docs: one string-compare scan of the doc_id column per hit
+    return [df.loc[df['doc_id'] == doc_id, 'text'].values[0] for doc_id in page]
+
+
+def page_latency(fetch, pages):
+    times = []
+    for page in pages:
+        start = time.perf_counter()
+        fetch(page)
+        times.append(time.perf_counter() - start)
+    return np.percentile(times, 50) * 1000, np.percentile(times, 99) * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path', default=None, help='articles TSV, synthetic corpus if omitted')
+    parser.add_argument('--n_docs', type=int, default=20000)
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--page_size', type=int, default=10)
+    args = parser.parse_args()
+
+    df = load_corpus(args.path, n_docs=args.n_docs)
+    df = df.dropna(subset=['text']).reset_index(drop=True)
+    df['doc_id'] = df.index.astype(str)
+    rng = np.random.default_rng(0)
+    pages = [rng.integers(0, df.shape[0], size=args.page_size).astype(str).tolist() for _ in range(args.pages)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'docs.bin')
+        memory = DocStore(df['text'].tolist())
+        start = time.perf_counter()
+        memory.save(path)
+        save_time = time.perf_counter() - start
+        mapped = DocStore.load(path)
+        raw = sum(len(t.encode('utf-8')) for t in df['text'])
+        size = os.path.getsize(path)
+        print(f'{df.shape[0]} docs: raw text {raw / 2**20:.1f} MiB, docstore file {size / 2**20:.1f} MiB '
+              f'({size / raw:.0%}), written in {save_time:.2f} s')
+
+        for page in pages[:10]:
+            assert scan_page(df, page) == memory.get_many(page) == mapped.get_many(page)
+
+        print(f'fetch of a {args.page_size}-doc result page:')
+        for name, fetch in [('dataframe scan', lambda page: scan_page(df, page)),
+                            ('docstore in memory', memory.get_many),
+                            ('docstore mmap+zlib', mapped.get_many)]:
+            p50, p99 = page_latency(fetch, pages)
+            print(f'  {name:20s} p50 {p50:8.3f} ms   p99 {p99:8.3f} ms')
+        del mapped
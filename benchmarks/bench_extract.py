@@ -0,0 +1,89 @@
+import argparse
+import glob
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from corpus import ROOT, ALPHABET
+from extractors import ENGINES
+
+FIXTURES = os.path.join(ROOT, 'HW1', 'fixtures', 'news')
+# broken markup: blocks and nested <p> inside <p>, unclosed and stray tags, an <?xml?> declaration, cp1251
+MALFORMED = os.path.join(ROOT, 'HW1', 'fixtures', 'malformed')
+# engines that only match bs4 on well-formed markup
+APPROXIMATE = {'lxml'}
+
+
+def random_words(rng, n):
+    return ' '.join(''.join(rng.choice(ALPHABET) for _ in range(rng.randint(2, 10))) for _ in range(n))
+
+
+def synthetic_page(rng, n_paragraphs=30):
+    # the shape of a saved RT article: a long menu, inline scripts and widgets around a small article
+    menu = ''.join(f'<li class="menu__item"><a href="/section/{i}">{random_words(rng, 2)}</a></li>' for i in range(300))
+    scripts = ''.join(f'<script>window.dataLayer.push({{"id": {i}, "html": "<p>{random_words(rng, 5)}</p>"}});</script>'
+                      for i in range(20))
+    paragraphs = ''.join(f'<p>{random_words(rng, rng.randint(10, 60))} <a href="/news/{i}">{random_words(rng, 2)}</a>'
+                         f'&nbsp;&laquo;{random_words(rng, 3)}&raquo;</p>' for i in range(n_paragraphs))
+    related = ''.join(f'<div class="card"><a href="/news/{i}"><p class="card__title">{random_words(rng, 6)}</p></a></div>'
+                      for i in range(40))
+    return (f'<!DOCTYPE html><html lang="ru"><head><meta charset="utf-8"><title>{random_words(rng, 8)}</title>'
+            f'<meta name="mediator_theme" content="{random_words(rng, 1)}">{scripts}</head><body>'
+            f'<header><ul class="menu">{menu}</ul></header><div class="article">'
+            f'<h1 class="article__heading">{random_words(rng, 8)}</h1>'
+            f'<div class="article__summary">{random_words(rng, 20)}</div>'
+            f'<div class="article__text">{paragraphs}<blockquote><p>{random_words(rng, 15)}</p></blockquote>'
+            f'<!-- ad --><div class="read-more"><p>{random_words(rng, 5)}</p></div></div></div>'
+            f'<div class="related">{related}</div><footer><p>{random_words(rng, 20)}</p></footer></body></html>').encode()
+
+
+def pages_per_sec(fn, pages, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for page in pages:
+            fn(page)
+    return repeat * len(pages) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', default=None, help='directory of saved .html pages, synthetic pages if omitted')
+    parser.add_argument('--n_pages', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    fixtures = [open(p, 'rb').read() for p in sorted(glob.glob(os.path.join(FIXTURES, '*.html')))]
+    malformed = {os.path.basename(p): open(p, 'rb').read() for p in sorted(glob.glob(os.path.join(MALFORMED, '*.html')))}
+    if args.pages is not None:
+        pages = [open(p, 'rb').read() for p in sorted(glob.glob(os.path.join(args.pages, '*.html')))]
+    else:
+        rng = random.Random(0)
+        pages = [synthetic_page(rng) for _ in range(args.n_pages)]
+
+    for page in fixtures + pages:
+        expected = ENGINES['bs4'](page)
+        for name, fn in ENGINES.items():
+            assert fn(page) == expected, name
+    print(f'engines {sorted(ENGINES)} identical on {len(fixtures)} fixtures and {len(pages)} pages '
+          f'of {sum(map(len, pages)) / len(pages) / 1024:.0f} KB on average')
+    for page_name, page in malformed.items():
+        expected = ENGINES['bs4'](page)
+        for name, fn in ENGINES.items():
+            if name in APPROXIMATE:
+                if fn(page) != expected:
+                    print(f'{name} differs from bs4 on malformed {page_name}')
+            else:
+                assert fn(page) == expected, (name, page_name)
+    print(f'engines {sorted(set(ENGINES) - APPROXIMATE)} identical on {len(malformed)} malformed fixtures')
+
+    rates = {name: pages_per_sec(fn, pages) for name, fn in ENGINES.items()}
+    for name, rate in rates.items():
+        print(f'{name:7s} {rate:8.1f} pages/s   {rate / rates["bs4"]:5.1f}x')
+
+    for name in ENGINES:
+        with ProcessPoolExecutor(args.workers) as pool:
+            list(pool.map(ENGINES[name], pages[:args.workers]))
+            start = time.perf_counter()
+            list(pool.map(ENGINES[name], pages, chunksize=8))
+            rate = len(pages) / (time.perf_counter() - start)
+        print(f'{name:7s} {rate:8.1f} pages/s in {args.workers} processes')
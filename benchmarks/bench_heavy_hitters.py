@@ -0,0 +1,34 @@
+import argparse
+import time
+from collections import Counter
+from corpus import load_corpus
+from heavy_hitters import SpaceSaving
+from ngram_stream import iter_ngrams
+from common.tokenizer import tokenize
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path', default=None, help='articles TSV, synthetic corpus if omitted')
+    parser.add_argument('--n_docs', type=int, default=3000)
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--capacities', type=int, nargs='+', default=[1000, 10000, 100000])
+    args = parser.parse_args()
+
+    tokens = [tokenize(text) for text in load_corpus(args.path, n_docs=args.n_docs)['text'].dropna()]
+    for n in [2, 3, 4]:
+        grams = [gram for t in tokens for _, gram in iter_ngrams(t, [n])]
+        exact = Counter(grams)
+        true_top = {gram for gram, _ in exact.most_common(args.top)}
+        print(f'n={n}: {len(grams)} grams, {len(exact)} distinct')
+        for capacity in args.capacities:
+            start = time.perf_counter()
+            sketch = SpaceSaving(capacity)
+            for gram in grams:
+                sketch.put(gram)
+            elapsed = time.perf_counter() - start
+            top = sketch.most_common(args.top)
+            recall = len(true_top & {gram for gram, _ in top}) / len(true_top)
+            max_error = max(cnt - exact[gram] for gram, cnt in top)
+            print(f'  capacity {capacity:>7}: recall@{args.top} {recall:.2f}   max overcount {max_error:>5}   '
+                  f'bound N/capacity {len(grams) / capacity:9.1f}   {elapsed:6.2f} s')
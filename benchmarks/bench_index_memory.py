@@ -0,0 +1,38 @@
+import argparse
+import gc
+import tracemalloc
+from corpus import load_corpus, build_dict_index
+import inverted_index
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    index = build()
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return index, after - before
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path', default=None, help='articles TSV, synthetic corpus if omitted')
+    parser.add_argument('--n_docs', type=int, default=10000)
+    args = parser.parse_args()
+
+    df = load_corpus(args.path, n_docs=args.n_docs)
+    inv_index = inverted_index.InvIndex(df, result_cache_size=0)
+    df = inv_index.df
+    text_bytes = df['text'].str.encode('utf-8').str.len().sum()
+
+    dict_index, dict_mem = measure(lambda: build_dict_index(inv_index, df))
+    del dict_index
+    compact_index, compact_mem = measure(lambda: inv_index.create_index(df))
+
+    print(f'docs: {len(df)}, terms: {len(compact_index)}, postings: {len(compact_index.tfs)}')
+    print(f'text:          {text_bytes / 2**20:8.1f} MB')
+    print(f'dict index:    {dict_mem / 2**20:8.1f} MB')
+    print(f'compact index: {compact_mem / 2**20:8.1f} MB (arrays {compact_index.nbytes() / 2**20:.1f} MB)')
+    print(f'ratio:         {dict_mem / compact_mem:8.1f}x')
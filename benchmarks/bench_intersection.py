@@ -0,0 +1,55 @@
+import argparse
+import time
+import numpy as np
+from corpus import load_corpus, build_dict_index, dict_search_multiword, TEST_QUERIES
+import inverted_index
+import inverted_index_morph
+
+
+def high_df_queries(index, n=4):
+    # already tokenized: lemmas must not go through the morph tokenizer a second time
+    by_df = sorted(index.terms, key=index.doc_freq, reverse=True)
+    top, mid, rare = by_df[:n], by_df[len(by_df) // 100], by_df[len(by_df) // 2]
+    return [
+        [top[0], top[1]],
+        top[:4],
+        [top[0], mid],
+        [top[0], top[1], rare],
+    ]
+
+
+def timeit(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return np.median(times) * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path', default=None, help='articles TSV, synthetic corpus if omitted')
+    parser.add_argument('--n_docs', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    df = load_corpus(args.path, n_docs=args.n_docs)
+    variants = [
+        ('plain', inverted_index.InvIndex(df, result_cache_size=0)),
+        ('morph', inverted_index_morph.InvIndex(df, morph=inverted_index_morph.morph, stop_words=inverted_index_morph.rus_stop,
+                                                 result_cache_size=0)),
+    ]
+    for name, inv_index in variants:
+        dict_index = build_dict_index(inv_index, inv_index.df)
+        print(f'{name} index, {len(inv_index.df)} docs')
+        print(f"{'query':<60} {'df':>16} {'hits':>6} {'sets ms':>8} {'skips ms':>9}")
+        queries = [(query, inv_index.tokenizer(query)) for query in TEST_QUERIES]
+        queries += [(' '.join(words), words) for words in high_df_queries(inv_index.index)]
+        for query, words in queries:
+            dfs = '/'.join(str(inv_index.index.doc_freq(w)) for w in words)
+            hits = len(inv_index.index.intersect(words)[0]) if words else 0
+            old = timeit(lambda: dict_search_multiword(dict_index, words), args.repeat)
+            new = timeit(lambda: inv_index.index.intersect(words), args.repeat)
+            print(f'{query[:60]:<60} {dfs[:16]:>16} {hits:>6} {old:8.3f} {new:9.3f}')
+        print()
@@ -0,0 +1,42 @@
+import argparse
+import os
+import tempfile
+import time
+import pandas as pd
+from corpus import load_corpus
+from common.postings import PostingsBuilder
+import inverted_index_morph as hw4
+
+
+def tokenizer_index(**kwargs):
+    return hw4.InvIndex(pd.DataFrame({'text': []}), stop_words=hw4.rus_stop, morph=hw4.morph,
+                        index=PostingsBuilder().build(), **kwargs)
+
+
+def tokenize_all(inv_index, texts):
+    start = time.perf_counter()
+    tokens = [inv_index.tokenizer(text) for text in texts]
+    return tokens, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path', default=None, help='articles TSV, synthetic corpus if omitted')
+    parser.add_argument('--n_docs', type=int, default=2000)
+    args = parser.parse_args()
+
+    texts = load_corpus(args.path, n_docs=args.n_docs)['text'].dropna().tolist()
+    # cache_size=0 evicts every entry right away, which is the same as parsing every occurrence
+    uncached, uncached_time = tokenize_all(tokenizer_index(cache_size=0), texts)
+    cached_index = tokenizer_index()
+    cached, cached_time = tokenize_all(cached_index, texts)
+    print(f'docs: {len(texts)}, identical tokens: {cached == uncached}')
+    print(f'no cache:  {uncached_time:8.2f} s')
+    print(f'cold LRU:  {cached_time:8.2f} s   {uncached_time / cached_time:5.1f}x   {cached_index.lemmas.stats()}')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        vocab = os.path.join(tmp, 'lemmas.tsv')
+        cached_index.lemmas.save_vocab(vocab)
+        warm_index = tokenizer_index(lemma_vocab=vocab)
+        warm, warm_time = tokenize_all(warm_index, texts)
+    print(f'pre-warmed:{warm_time:8.2f} s   {uncached_time / warm_time:5.1f}x   {warm_index.lemmas.stats()}')
@@ -0,0 +1,58 @@
+import argparse
+import time
+import numpy as np
+from corpus import load_corpus, TEST_QUERIES
+import inverted_index
+
+
+def query_latency(inv_index, queries, repeat=5):
+    times = []
+    for _ in range(repeat):
+        for q in queries:
+            start = time.perf_counter()
+            inv_index.search_bm25(q, 10)
+            times.append(time.perf_counter() - start)
+    return np.percentile(times, 50) * 1000, np.percentile(times, 99) * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path', default=None, help='articles TSV, synthetic corpus if omitted')
+    parser.add_argument('--n_docs', type=int, default=20000)
+    parser.add_argument('--n_new', type=int, default=2000, help='docs added after the initial build')
+    parser.add_argument('--batch', type=int, default=50)
+    args = parser.parse_args()
+
+    df = load_corpus(args.path, n_docs=args.n_docs + args.n_new)
+    queries = TEST_QUERIES + [' '.join(t.split()[:3]) for t in df['text'].dropna().sample(50, random_state=0)]
+    base, new = df.iloc[:args.n_docs], df.iloc[args.n_docs:]
+
+    start = time.perf_counter()
+    inv_index = inverted_index.InvIndex(base, result_cache_size=0)
+    build_time = time.perf_counter() - start
+    print(f'initial build of {args.n_docs} docs: {build_time:.2f} s')
+
+    p50, p99 = query_latency(inv_index, queries)
+    print(f'bm25 one segment:        p50 {p50:6.2f} ms   p99 {p99:6.2f} ms')
+
+    add_times = []
+    for i in range(0, len(new), args.batch):
+        start = time.perf_counter()
+        inv_index.add_documents(new.iloc[i:i + args.batch])
+        add_times.append(time.perf_counter() - start)
+    segments = len(inv_index.live.snapshot().segments)
+    p50, p99 = query_latency(inv_index, queries)
+    print(f'add {args.batch} docs until searchable: mean {np.mean(add_times) * 1000:.1f} ms, '
+          f'max {np.max(add_times) * 1000:.1f} ms (full rebuild {build_time:.2f} s)')
+    print(f'bm25 {segments:2d} segments:        p50 {p50:6.2f} ms   p99 {p99:6.2f} ms')
+
+    doc_ids = inv_index.df['doc_id'].sample(args.n_new // 10, random_state=0).tolist()
+    start = time.perf_counter()
+    inv_index.delete_documents(doc_ids)
+    print(f'delete {len(doc_ids)} docs: {(time.perf_counter() - start) * 1000:.1f} ms')
+
+    start = time.perf_counter()
+    inv_index.compact()
+    print(f'compact into one segment: {time.perf_counter() - start:.2f} s')
+    p50, p99 = query_latency(inv_index, queries)
+    print(f'bm25 compacted:          p50 {p50:6.2f} ms   p99 {p99:6.2f} ms')
@@ -0,0 +1,48 @@
+import argparse
+import os
+import tempfile
+import tracemalloc
+from collections import Counter
+import pandas as pd
+from corpus import synthetic_corpus
+from ngram_stream import count_ngrams, iter_ngrams
+from common.tokenizer import tokenize
+
+
+def count_in_memory(path, ns):
+    # whole TSV and every gram in RAM, like get_n_gram.py without --stream
+    df = pd.read_csv(path, sep='\t')
+    counters = {n: Counter() for n in ns}
+    for tokens in (tokenize(text) for text in df['text'].dropna()):
+        for n, gram in iter_ngrams(tokens, ns):
+            counters[n][gram] += 1
+    return counters
+
+
+def peak_memory(fn):
+    tracemalloc.start()
+    result = fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, peak
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 2000, 4000])
+    parser.add_argument('--max_items', type=int, default=100000)
+    args = parser.parse_args()
+    ns = [2, 3, 4]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_docs in args.sizes:
+            path = os.path.join(tmp, f'corpus_{n_docs}.tsv')
+            synthetic_corpus(n_docs=n_docs, seed=n_docs).to_csv(path, sep='\t', index=False)
+            exact, memory_peak = peak_memory(lambda: count_in_memory(path, ns))
+            streamed, stream_peak = peak_memory(lambda: count_ngrams(path, ns, chunksize=500, max_items=args.max_items, tmp_dir=tmp))
+            same = all(dict(streamed[n].items()) == exact[n] for n in ns)
+            runs = sum(len(c.runs) for c in streamed.values())
+            for c in streamed.values():
+                c.close()
+            print(f'docs {n_docs:>6}: in-memory peak {memory_peak / 2**20:8.1f} MB   '
+                  f'streaming peak {stream_peak / 2**20:8.1f} MB ({runs} runs)   same counts {same}')
@@ -0,0 +1,38 @@
+import argparse
+import time
+import numpy as np
+from corpus import load_corpus
+from common.segment import INDEX_ARRAYS
+import inverted_index
+import inverted_index_morph
+
+
+def same_index(a, b):
+    return (list(a.terms.items()) == list(b.terms.items()) and a.num_docs == b.num_docs
+            and all(np.array_equal(getattr(a, name), getattr(b, name)) for name in INDEX_ARRAYS))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path', default=None, help='articles TSV, synthetic corpus if omitted')
+    parser.add_argument('--n_docs', type=int, default=10000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    df = load_corpus(args.path, n_docs=args.n_docs)
+    variants = [
+        ('plain', lambda n_jobs: inverted_index.InvIndex(df, n_jobs=n_jobs)),
+        ('morph', lambda n_jobs: inverted_index_morph.InvIndex(df, morph=inverted_index_morph.morph,
+                                                               stop_words=inverted_index_morph.rus_stop, n_jobs=n_jobs)),
+    ]
+    for name, build in variants:
+        print(f'{name} index')
+        serial = None
+        for n_jobs in args.workers:
+            start = time.perf_counter()
+            index = build(n_jobs).index
+            elapsed = time.perf_counter() - start
+            if serial is None:
+                serial, serial_time = index, elapsed
+            print(f'workers {n_jobs:>2}: {elapsed:8.2f} s   speedup {serial_time / elapsed:5.2f}x   identical {same_index(serial, index)}')
+        print()
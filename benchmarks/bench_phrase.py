@@ -0,0 +1,61 @@
+import argparse
+import time
+import numpy as np
+from corpus import load_corpus, TEST_QUERIES
+import inverted_index
+
+
+def verify_phrase(inv_index, text):
+    # the old way: AND over the postings, then re-tokenize every candidate to look for the phrase
+    words = inv_index.tokenizer(text)
+    results = []
+    for doc_id, _ in inv_index.search_multiword(text):
+        tokens = inv_index.tokenizer(inv_index.get_docs(doc_id))
+        cnt = sum(1 for i in range(len(tokens) - len(words) + 1) if tokens[i:i + len(words)] == words)
+        if cnt > 0:
+            results.append((doc_id, cnt))
+    return results
+
+
+def latency(search, queries, repeat):
+    times = []
+    for _ in range(repeat):
+        for q in queries:
+            start = time.perf_counter()
+            search(q)
+            times.append(time.perf_counter() - start)
+    return np.percentile(times, 50) * 1000, np.percentile(times, 99) * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path', default=None, help='articles TSV, synthetic corpus if omitted')
+    parser.add_argument('--n_docs', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    df = load_corpus(args.path, n_docs=args.n_docs)
+    plain = inverted_index.InvIndex(df, result_cache_size=0)
+    start = time.perf_counter()
+    positional = inverted_index.InvIndex(df, positions=True, result_cache_size=0)
+    print(f'positional build: {time.perf_counter() - start:.2f} s')
+    index = positional.index
+    print(f'index arrays: {plain.index.nbytes() / 2**20:.1f} MB without positions, {index.nbytes() / 2**20:.1f} MB with, '
+          f'{index.positions.nbytes / index.tfs.sum():.2f} bytes per position')
+
+    rng = np.random.default_rng(0)
+    queries = [q for q in TEST_QUERIES if len(q.split()) > 1]
+    for text in df['text'].dropna().sample(50, random_state=0):
+        tokens = text.split()
+        start = int(rng.integers(0, max(1, len(tokens) - 3)))
+        queries.append(' '.join(tokens[start:start + int(rng.integers(2, 4))]))
+    for q in queries:
+        assert sorted(positional.search_phrase(q)) == sorted(verify_phrase(plain, q)), q
+
+    print(f'{len(queries)} phrase queries:')
+    for name, search in [('AND + re-tokenize', lambda q: verify_phrase(plain, q)),
+                         ('positional phrase', positional.search_phrase),
+                         ('positional NEAR/5', lambda q: positional.search_near(q, 5)),
+                         ('AND only', plain.search_multiword)]:
+        p50, p99 = latency(search, queries, args.repeat)
+        print(f'  {name:18s} p50 {p50:8.2f} ms   p99 {p99:8.2f} ms')
@@ -0,0 +1,74 @@
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+import faiss
+from corpus import load_embeddings
+from ann_index import Reranker, build_index, set_search_params
+from bench_ann import recall_at_k
+
+# (label, kind, search params)
+CONFIGS = [
+    ('sq_fp16', 'sq_fp16', {}),
+    ('sq8', 'sq8', {}),
+    ('pq', 'pq', {}),
+    ('ivf_pq nprobe=16', 'ivf_pq', {'nprobe': 16}),
+]
+
+
+def run(index, queries, k, reranker=None, rerank=4):
+    times = []
+    found = []
+    for q in queries:
+        q = q[None, :]
+        start = time.perf_counter()
+        if reranker is None:
+            _, I = index.search(q, k)
+        else:
+            _, I = index.search(q, k * rerank)
+            _, I = reranker.rerank(q, I, k)
+        times.append(time.perf_counter() - start)
+        found.append(I[0])
+    return np.array(found), np.percentile(times, 50) * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--embeddings', default=None, help='.npy embedding matrix, synthetic vectors if omitted')
+    parser.add_argument('--n_vectors', type=int, default=100000)
+    parser.add_argument('--dim', type=int, default=512)
+    parser.add_argument('--n_queries', type=int, default=300)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--rerank', type=int, default=4, help='shortlist of rerank * k hits for the exact re-ranking')
+    args = parser.parse_args()
+
+    x = load_embeddings(args.embeddings, n_vectors=args.n_vectors + args.n_queries, dim=args.dim)
+    base, queries = x[:-args.n_queries], x[-args.n_queries:]
+    mb = 2**20
+    print(f'{len(base)} vectors of dim {base.shape[1]}, {len(queries)} queries, recall@{args.k} against flat float32')
+
+    flat = build_index(base, 'flat')
+    truth, p50 = run(flat, queries, args.k)
+    flat_size = faiss.serialize_index(flat).nbytes / mb
+    # before: the float32 matrix in self.embeddings plus the copy inside IndexFlatIP
+    print(f'{"flat float32 (before)":28s} index {flat_size:7.1f} MB + matrix {base.nbytes / mb:7.1f} MB   '
+          f'recall {1.0:.3f}   p50 {p50:6.3f} ms')
+    print(f'{"flat float32 (now)":28s} index {flat_size:7.1f} MB + matrix {0:7.1f} MB')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # the embedding store keeps float16 rows; re-ranking reads them through the memory map
+        path = os.path.join(tmp, 'vectors.bin')
+        base.astype(np.float16).tofile(path)
+        reranker = Reranker(np.memmap(path, dtype=np.float16, mode='r', shape=base.shape))
+        for label, kind, params in CONFIGS:
+            index = build_index(base, kind)
+            set_search_params(index, **params)
+            size = faiss.serialize_index(index).nbytes / mb
+            found, p50 = run(index, queries, args.k)
+            print(f'{label:28s} index {size:7.1f} MB                     '
+                  f'recall {recall_at_k(found, truth):.3f}   p50 {p50:6.3f} ms')
+            found, p50 = run(index, queries, args.k, reranker, args.rerank)
+            print(f'{label + f" + rerank x{args.rerank}":28s} index {size:7.1f} MB + mmap fp16 {os.path.getsize(path) / mb:5.1f} MB   '
+                  f'recall {recall_at_k(found, truth):.3f}   p50 {p50:6.3f} ms')
+        del reranker
@@ -0,0 +1,50 @@
+import argparse
+import time
+import numpy as np
+from corpus import load_corpus, query_log
+import inverted_index
+
+
+def run(inv_index, queries, top_k):
+    times = []
+    for q in queries:
+        start = time.perf_counter()
+        inv_index.search_bm25(q, top_k)
+        times.append(time.perf_counter() - start)
+    return np.percentile(times, 50) * 1000, np.percentile(times, 99) * 1000, sum(times)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path', default=None, help='articles TSV, synthetic corpus if omitted')
+    parser.add_argument('--n_docs', type=int, default=10000)
+    parser.add_argument('--n_queries', type=int, default=20000)
+    parser.add_argument('--n_distinct', type=int, default=5000)
+    parser.add_argument('--zipf_a', type=float, default=1.2)
+    parser.add_argument('--top_k', type=int, default=10)
+    parser.add_argument('--add_every', type=int, default=0, help='add a small batch of docs every n queries, 0 = never')
+    args = parser.parse_args()
+
+    df = load_corpus(args.path, n_docs=args.n_docs)
+    queries = query_log(df, args.n_queries, args.n_distinct, args.zipf_a)
+    print(f'{len(queries)} queries, {len(set(queries))} distinct')
+
+    for name, cache_size in [('no cache', 0), ('cache 1000', 1000), ('cache 10000', 10000)]:
+        inv_index = inverted_index.InvIndex(df.iloc[:args.n_docs // 2], result_cache_size=cache_size)
+        if args.add_every:
+            # writes bump the index generation, so every add empties the cache in effect
+            rest = df.iloc[args.n_docs // 2:]
+            step = max(1, len(rest) * args.add_every // len(queries))
+            p50, p99, total = [], [], 0.0
+            for i in range(0, len(queries), args.add_every):
+                inv_index.add_documents(rest.iloc[i // args.add_every * step:(i // args.add_every + 1) * step])
+                a, b, t = run(inv_index, queries[i:i + args.add_every], args.top_k)
+                p50.append(a)
+                p99.append(b)
+                total += t
+            p50, p99 = np.median(p50), np.max(p99)
+        else:
+            p50, p99, total = run(inv_index, queries, args.top_k)
+        stats = inv_index.results.stats()
+        print(f'{name:12s} hit rate {stats["hit_rate"]:.3f}   p50 {p50:7.3f} ms   p99 {p99:7.3f} ms   '
+              f'{len(queries) / total:9.0f} queries/s')
@@ -0,0 +1,71 @@
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from corpus import load_corpus
+import inverted_index_bert
+
+
+def query_log(df, n_queries, n_distinct, seed=0):
+    # zipf-distributed repeats of short snippets, like a real query log with a few popular queries
+    rng = np.random.default_rng(seed)
+    distinct = []
+    for text in df['text'].sample(n_distinct, random_state=seed):
+        words = text.split()
+        start = int(rng.integers(0, max(1, len(words) - 5)))
+        distinct.append(' '.join(words[start:start + int(rng.integers(2, 6))]))
+    ranks = np.arange(1, n_distinct + 1)
+    probs = 1.0 / ranks / (1.0 / ranks).sum()
+    return [distinct[i] for i in rng.choice(n_distinct, size=n_queries, p=probs)]
+
+
+def report(name, times, total):
+    print(f'{name:28s} {len(times) / total:8.1f} q/s   p50 {np.percentile(times, 50) * 1000:7.2f} ms   '
+          f'p99 {np.percentile(times, 99) * 1000:7.2f} ms')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path', default=None, help='articles TSV, synthetic corpus if omitted')
+    parser.add_argument('--embeddings', default=None, help='saved doc embeddings, encoded from the corpus if omitted')
+    parser.add_argument('--n_docs', type=int, default=10000)
+    parser.add_argument('--n_queries', type=int, default=2000)
+    parser.add_argument('--n_distinct', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--model', default='cointegrated/rubert-tiny')
+    args = parser.parse_args()
+
+    df = load_corpus(args.path, n_docs=args.n_docs)
+    embeddings = np.load(args.embeddings) if args.embeddings is not None else None
+    inv_index = inverted_index_bert.InvIndex(df, embeddings=embeddings, model_name=args.model, result_cache_size=0)
+    queries = query_log(inv_index.df, args.n_queries, args.n_distinct)
+
+    # the old path: a forward pass and an index search per query, no cache
+    times = []
+    start = time.perf_counter()
+    for q in queries:
+        t = time.perf_counter()
+        inv_index.index.search(inv_index.get_emb([q]), 10)
+        times.append(time.perf_counter() - t)
+    report('encode + search per query', times, time.perf_counter() - start)
+
+    def timed(q):
+        t = time.perf_counter()
+        inv_index.semantic_search(q)
+        return time.perf_counter() - t
+
+    for name, warm in [('micro-batched, cold cache', False), ('micro-batched, warm cache', True)]:
+        if not warm:
+            inv_index.query_cache.cache.clear()
+        with ThreadPoolExecutor(args.threads) as executor:
+            start = time.perf_counter()
+            times = list(executor.map(timed, queries))
+            report(f'{name} x{args.threads}', times, time.perf_counter() - start)
+    print(f'query cache: {inv_index.query_cache.stats()}')
+    print(f'batcher: {inv_index.batcher.stats()}')
+
+    start = time.perf_counter()
+    inv_index.query_cache.cache.clear()
+    inv_index.semantic_search_batch(queries)
+    total = time.perf_counter() - start
+    print(f'{"semantic_search_batch, all":28s} {len(queries) / total:8.1f} q/s')
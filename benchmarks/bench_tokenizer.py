@@ -0,0 +1,54 @@
+import argparse
+import random
+import re
+import time
+from corpus import load_corpus
+from common.tokenizer import tokenize, iter_tokens
+
+
+def legacy_tokenize(text, stop_words=None):
+    # preprocess_text / InvIndex.tokenizer before the shared tokenizer
+    text = text.lower()
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'[^\w\s]', ' ', text)
+    tokens = text.split()
+    if stop_words is not None:
+        return [t for t in tokens if t not in stop_words]
+    return tokens
+
+
+def fuzz_texts(n, seed=0):
+    # punctuation, unicode spaces, control characters, combining marks and case-special letters
+    rng = random.Random(seed)
+    alphabet = list('abcXYZабвЁЯ019_-.,!?«»—–\'"()\t\n\r\x0b\x0c\x1c\x1f\x00   　') + ['İ', 'ß', 'Σ', 'ΑΣ', '́', '​', '①', '²']
+    return [''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 60))) for _ in range(n)]
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path', default=None, help='articles TSV, synthetic corpus if omitted')
+    parser.add_argument('--n_docs', type=int, default=10000)
+    args = parser.parse_args()
+
+    texts = load_corpus(args.path, n_docs=args.n_docs)['text'].dropna().tolist()
+    stop_words = {'и', 'в', 'на', 'не', 'что'}
+
+    checks = texts + fuzz_texts(20000)
+    for sw in [None, stop_words]:
+        expected = [legacy_tokenize(t, sw) for t in checks]
+        assert [tokenize(t, sw) for t in checks] == expected
+        assert [list(iter_tokens(t, sw)) for t in checks] == expected
+    print(f'identical on {len(texts)} docs and {len(checks) - len(texts)} fuzz strings')
+
+    _, legacy_time = timed(lambda: [legacy_tokenize(t, stop_words) for t in texts])
+    _, single_time = timed(lambda: [tokenize(t, stop_words) for t in texts])
+    _, iter_time = timed(lambda: [list(iter_tokens(t, stop_words)) for t in texts])
+    print(f'legacy:      {legacy_time:7.3f} s')
+    print(f'tokenize:    {single_time:7.3f} s   {legacy_time / single_time:5.2f}x')
+    print(f'iter_tokens: {iter_time:7.3f} s   {legacy_time / iter_time:5.2f}x')
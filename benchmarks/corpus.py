@@ -0,0 +1,147 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+for hw in ['', 'HW1', 'HW2', 'HW3', 'HW4', 'HW5']:
+    path = os.path.join(ROOT, hw)
+    if path not in sys.path:
+        sys.path.append(path)
+
+# the test_query strings of the HW3 / HW4 __main__ blocks
+TEST_QUERIES = [
+    'отопление',
+    'перемена',
+    'в Московском зоопарке начали',
+    'Ранее во Владивостоке'
+]
+
+ALPHABET = list('абвгдежзийклмнопрстуфхцчшщыэюя')
+
+
+def synthetic_corpus(n_docs=10000, vocab_size=50000, doc_len=(50, 400), seed=0):
+    # zipf-distributed words, so a few terms have very long postings like in real news text
+    rng = np.random.default_rng(seed)
+    lens = rng.integers(3, 12, size=vocab_size)
+    vocab = np.array([''.join(rng.choice(ALPHABET, size=l)) for l in lens])
+    ranks = np.arange(1, vocab_size + 1)
+    probs = 1.0 / ranks
+    probs /= probs.sum()
+    sizes = rng.integers(*doc_len, size=n_docs)
+    words = rng.choice(vocab, size=sizes.sum(), p=probs).tolist()
+    bounds = np.concatenate([[0], np.cumsum(sizes)])
+    texts = [' '.join(words[bounds[i]:bounds[i + 1]]).capitalize() + '.' for i in range(n_docs)]
+    return pd.DataFrame({'url': [f'synthetic/{i}' for i in range(n_docs)], 'text': texts})
+
+
+def russian_vocab():
+    # lemmas of the Russian words in the HW3-HW5 result files, and every inflected form of each
+    import re
+    from pymorphy3 import MorphAnalyzer
+    from nltk.corpus import stopwords
+    morph = MorphAnalyzer()
+    stop = set(stopwords.words('russian'))
+    words = set()
+    for hw in ['HW3', 'HW4', 'HW5']:
+        res = pd.read_csv(os.path.join(ROOT, hw, 'res.csv'))
+        for text in res['text'].dropna():
+            words.update(re.findall('[а-яё]{3,}', text.lower()))
+    lemmas = sorted({morph.parse(word)[0].normal_form for word in words} - stop)
+    forms = [sorted({form.word for form in morph.parse(lemma)[0].lexeme}) for lemma in lemmas]
+    return lemmas, forms, sorted(stop)
+
+
+def russian_corpus(n_docs=10000, doc_len=(50, 400), stop_share=0.35, topic_share=0.5, topic_size=20, seed=0):
+    # real Russian words in Zipf-distributed lemmas, every occurrence a random inflected form of its
+    # lemma, and stop words at about their share of news text: what the stop word and morphology
+    # variants are for, which synthetic_corpus (random letters, one form per word) does not exercise.
+    # topic_share of a doc's words come from topic_size lemmas of its own, so like in news a lemma
+    # is repeated in the docs about it, in different forms, instead of spread evenly over all docs
+    rng = np.random.default_rng(seed)
+    lemmas, forms, stop = russian_vocab()
+    order = rng.permutation(len(lemmas))
+    probs = 1.0 / np.arange(1, len(lemmas) + 1)
+    sizes = rng.integers(*doc_len, size=n_docs)
+    n_words = int(sizes.sum())
+    lemma_ids = order[rng.choice(len(lemmas), size=n_words, p=probs / probs.sum())]
+    topics = rng.integers(0, len(lemmas), size=(n_docs, topic_size))
+    doc_of = np.repeat(np.arange(n_docs), sizes)
+    in_topic = rng.random(n_words) < topic_share
+    lemma_ids[in_topic] = topics[doc_of[in_topic], rng.integers(0, topic_size, size=int(in_topic.sum()))]
+    n_forms = np.array([len(f) for f in forms])
+    form_ids = (rng.random(n_words) * n_forms[lemma_ids]).astype(np.int64)
+    stop_probs = 1.0 / np.arange(1, len(stop) + 1)
+    stop_ids = rng.choice(len(stop), size=n_words, p=stop_probs / stop_probs.sum())
+    is_stop = rng.random(n_words) < stop_share
+    words = [stop[s] if st else forms[l][f] for l, f, s, st in zip(lemma_ids, form_ids, stop_ids, is_stop)]
+    bounds = np.concatenate([[0], np.cumsum(sizes)])
+    texts = [' '.join(words[bounds[i]:bounds[i + 1]]).capitalize() + '.' for i in range(n_docs)]
+    return pd.DataFrame({'url': [f'russian/{i}' for i in range(n_docs)], 'text': texts})
+
+
+def build_dict_index(inv_index, df):
+    # the dict-of-dicts layout InvIndex used before the compact postings
+    index = {}
+    for doc_id, text in zip(df['doc_id'], df['text']):
+        freqs = {}
+        for word in inv_index.tokenizer(text):
+            freqs[word] = freqs.get(word, 0) + 1
+        for word, cnt in freqs.items():
+            if word in index:
+                index[word][doc_id] = cnt
+            else:
+                index[word] = {doc_id: cnt}
+    return index
+
+
+def dict_search_multiword(index, words):
+    # search_multiword over the dict-of-dicts index, as it was before the compact postings
+    if len(words) == 0:
+        return []
+    postings = []
+    for w in words:
+        posting = index.get(w, {})
+        if len(posting) == 0:
+            return []
+        postings.append(posting)
+    common_docs = set(postings[0].keys())
+    for posting in postings[1:]:
+        common_docs &= set(posting.keys())
+    return [(doc_id, sum(posting[doc_id] for posting in postings)) for doc_id in common_docs]
+
+
+def synthetic_embeddings(n_vectors=100000, dim=512, n_clusters=200, noise=0.5, seed=0):
+    # unit vectors scattered around random topic centres, a stand-in for the HW5 sentence embeddings
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    x = centres[rng.integers(0, n_clusters, size=n_vectors)]
+    x += noise * rng.standard_normal((n_vectors, dim)).astype(np.float32)
+    x /= np.linalg.norm(x, axis=1, keepdims=True)
+    return x
+
+
+def load_embeddings(path=None, n_vectors=100000, dim=512, seed=0):
+    # a saved embedding matrix (np.save) or synthetic vectors
+    if path is not None:
+        x = np.load(path).astype(np.float32)
+        return x / np.linalg.norm(x, axis=1, keepdims=True)
+    return synthetic_embeddings(n_vectors=n_vectors, dim=dim, seed=seed)
+
+
+def load_corpus(path=None, n_docs=10000, seed=0):
+    if path is not None:
+        return pd.read_csv(path, sep='\t')
+    return synthetic_corpus(n_docs=n_docs, seed=seed)
+
+
+def query_log(df, n_queries, n_distinct, zipf_a, seed=0):
+    # n_distinct 1-3 word queries cut from the corpus, drawn with Zipf popularity like a real query log
+    rng = np.random.default_rng(seed)
+    distinct = []
+    for text in df['text'].dropna().sample(n_distinct, replace=True, random_state=seed):
+        tokens = text.split()
+        start = int(rng.integers(0, max(1, len(tokens) - 3)))
+        distinct.append(' '.join(tokens[start:start + int(rng.integers(1, 4))]))
+    ranks = rng.zipf(zipf_a, n_queries)
+    return [distinct[(r - 1) % n_distinct] for r in ranks]
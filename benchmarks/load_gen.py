@@ -0,0 +1,96 @@
+import argparse
+import asyncio
+import json
+import time
+from urllib.parse import quote, urlsplit
+import numpy as np
+import pandas as pd
+from corpus import query_log
+
+
+async def connect(args):
+    if args.unix is not None:
+        return await asyncio.open_unix_connection(args.unix)
+    url = urlsplit(args.url)
+    return await asyncio.open_connection(url.hostname, url.port or 80)
+
+
+async def request(reader, writer, target):
+    # one GET on a keep-alive connection; returns the status and the JSON body
+    writer.write(f'GET {target} HTTP/1.1\r\nHost: search\r\n\r\n'.encode('latin-1'))
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+
+async def client(args, queries, deadline, latencies, statuses, offset):
+    # closed loop: the next request goes out as soon as the previous one is answered
+    reader, writer = await connect(args)
+    i = offset
+    while time.perf_counter() < deadline:
+        query = queries[i % len(queries)]
+        i += args.concurrency
+        target = f'/search?q={quote(query)}&top_k={args.top_k}' + (f'&mode={args.mode}' if args.mode else '')
+        start = time.perf_counter()
+        try:
+            status, _ = await request(reader, writer, target)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            statuses['connection'] = statuses.get('connection', 0) + 1
+            writer.close()
+            reader, writer = await connect(args)
+            continue
+        statuses[status] = statuses.get(status, 0) + 1
+        if status == 200:
+            latencies.append(time.perf_counter() - start)
+        elif status == 503:
+            # the server sheds load, back off a little like a real client would on Retry-After
+            await asyncio.sleep(args.backoff)
+    writer.close()
+
+
+async def main(args, queries):
+    if args.warmup > 0:
+        await asyncio.gather(*[client(args, queries, time.perf_counter() + args.warmup, [], {}, i) for i in range(args.concurrency)])
+    latencies, statuses = [], {}
+    start = time.perf_counter()
+    deadline = start + args.duration
+    await asyncio.gather(*[client(args, queries, deadline, latencies, statuses, i) for i in range(args.concurrency)])
+    elapsed = time.perf_counter() - start
+    reader, writer = await connect(args)
+    _, server_stats = await request(reader, writer, '/stats')
+    writer.close()
+    return latencies, statuses, elapsed, server_stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--unix', default=None, help='Unix socket path of the server instead of --url')
+    parser.add_argument('--path', default='data/articles_extracted.tsv', help='articles TSV to cut a Zipf query log from, the one the server serves')
+    parser.add_argument('--n_distinct', type=int, default=2000)
+    parser.add_argument('--zipf_a', type=float, default=1.2)
+    parser.add_argument('--concurrency', type=int, default=32, help='connections, each with one request in flight')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds of measured load')
+    parser.add_argument('--warmup', type=float, default=1.0, help='seconds of unmeasured load first')
+    parser.add_argument('--top_k', type=int, default=10)
+    parser.add_argument('--mode', default=None, help='server search mode, its default if omitted')
+    parser.add_argument('--backoff', type=float, default=0.01, help='seconds a client waits after a 503')
+    args = parser.parse_args()
+
+    # thousands of distinct queries with Zipf popularity, so the server's result cache sees a
+    # realistic hit rate instead of the same four HW3 test queries every time
+    queries = query_log(pd.read_csv(args.path, sep='\t'), 100000, args.n_distinct, args.zipf_a)
+    latencies, statuses, elapsed, server_stats = asyncio.run(main(args, queries))
+    print(f'{args.concurrency} connections, {elapsed:.1f} s, responses {statuses}')
+    if latencies:
+        print(f'{len(latencies) / elapsed:9.1f} queries/s   p50 {np.percentile(latencies, 50) * 1000:8.2f} ms   '
+              f'p99 {np.percentile(latencies, 99) * 1000:8.2f} ms')
+    print(f'server: {server_stats}')
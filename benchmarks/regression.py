@@ -0,0 +1,229 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from corpus import query_log, russian_corpus
+
+VARIANTS = ['plain', 'stop_words', 'morph', 'bert']
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+# metric -> (better, relative tolerance, absolute slack): a lower-is-better metric regresses when it is
+# above baseline * (1 + tolerance) + slack, a higher-is-better one when it is below baseline - slack.
+# Timings are noisy on a shared machine, sizes and quality are not
+METRICS = {
+    'build_s': ('lower', 0.5, 0.5),
+    'peak_rss_mb': ('lower', 0.2, 20.0),
+    'build_rss_mb': ('lower', 0.2, 20.0),
+    'index_mb': ('lower', 0.1, 0.1),
+    'p50_ms': ('lower', 0.5, 0.2),
+    'p99_ms': ('lower', 1.0, 1.0),
+    'recall': ('higher', 0.0, 0.01),
+    'ndcg': ('higher', 0.0, 0.01),
+}
+
+
+def known_item_judgments(df, n_queries, seed=0, words=(3, 6), inflect=0.5):
+    # known-item queries: a few consecutive words of a doc, with that doc as the one relevant answer
+    # (grade 1). With probability inflect a word is replaced by a random form of its lemma, the way
+    # a user does not type the form the article has; that is what the morphology variant is for.
+    # Doc ids are the row positions the indexes give after dropna
+    from pymorphy3 import MorphAnalyzer
+    morph = MorphAnalyzer()
+    texts = df['text'].dropna().reset_index(drop=True)
+    rng = np.random.default_rng(seed)
+    judgments = []
+    for doc_id in rng.choice(len(texts), size=min(n_queries, len(texts)), replace=False):
+        tokens = texts[doc_id].split()
+        n = int(rng.integers(*words))
+        start = int(rng.integers(0, max(1, len(tokens) - n)))
+        query = []
+        for token in tokens[start:start + n]:
+            if rng.random() < inflect:
+                forms = sorted({form.word for form in morph.parse(token.lower().strip('.,:;!?«»"()'))[0].lexeme})
+                token = forms[int(rng.integers(len(forms)))]
+            query.append(token)
+        judgments.append({'query': ' '.join(query), 'relevant': {str(doc_id): 1}})
+    return judgments
+
+
+def proc_status_mb(field):
+    # VmRSS / VmHWM of this process from /proc, in MB. ru_maxrss is no use in a spawned worker: it is
+    # carried over from the parent through fork + exec, while VmHWM belongs to the new address space
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) / 1024
+
+
+def recall_at_k(found, relevant, k):
+    return len([d for d in found[:k] if d in relevant]) / len(relevant)
+
+
+def ndcg_at_k(found, relevant, k):
+    dcg = sum((2 ** relevant.get(d, 0) - 1) / np.log2(rank + 2) for rank, d in enumerate(found[:k]))
+    ideal = sorted(relevant.values(), reverse=True)[:k]
+    idcg = sum((2 ** g - 1) / np.log2(rank + 2) for rank, g in enumerate(ideal))
+    return dcg / idcg if idcg > 0 else 0.0
+
+
+def build(variant, df, bert_model, tmp):
+    # the index and its search(query, top_k); result caches are off so repeats of the query log are
+    # searched again, the lemma and embedding caches are part of the variant as it is used
+    if variant == 'bert':
+        import inverted_index_bert
+        index = inverted_index_bert.InvIndex(df, model_name=bert_model, store=os.path.join(tmp, 'embeddings'),
+                                             result_cache_size=0)
+        return index, index.semantic_search, lambda path: index.save_index(path)
+    if variant == 'morph':
+        import inverted_index_morph
+        index = inverted_index_morph.InvIndex(df, morph=inverted_index_morph.morph, stop_words=inverted_index_morph.rus_stop,
+                                              result_cache_size=0)
+    else:
+        import inverted_index
+        stop_words = inverted_index.rus_stop if variant == 'stop_words' else None
+        index = inverted_index.InvIndex(df, stop_words=stop_words, result_cache_size=0)
+    return index, index.search_bm25, lambda path: index.save(path)
+
+
+def run_variant(variant, df, queries, judgments, top_k, bert_model):
+    # runs in a spawned interpreter, not a fork of this one, so peak RSS counts this variant's imports
+    # and build (and the corpus it was sent), not the parent's heap; build_rss_mb is how far the build
+    # took it above the resident set it started from
+    rss_start = proc_status_mb('VmRSS')
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        try:
+            index, search, save = build(variant, df, bert_model, tmp)
+        except ImportError as e:
+            return {'skipped': f'{type(e).__name__}: {e}'}
+        build_s = time.perf_counter() - start
+        peak_rss_mb = proc_status_mb('VmHWM')
+        path = os.path.join(tmp, 'index')
+        save(path)
+        index_mb = os.path.getsize(path) / 2**20
+
+    # one untimed pass so first-touch costs (lazy imports, mmap faults) are not in the percentiles
+    for query in queries[:100]:
+        search(query, top_k)
+    times = []
+    for query in queries:
+        start = time.perf_counter()
+        search(query, top_k)
+        times.append(time.perf_counter() - start)
+
+    recall, ndcg = [], []
+    for judgment in judgments:
+        found = [str(doc_id) for doc_id, _ in search(judgment['query'], top_k)]
+        recall.append(recall_at_k(found, judgment['relevant'], top_k))
+        ndcg.append(ndcg_at_k(found, judgment['relevant'], top_k))
+    return {'build_s': build_s, 'peak_rss_mb': peak_rss_mb, 'build_rss_mb': peak_rss_mb - rss_start, 'index_mb': index_mb,
+            'p50_ms': float(np.percentile(times, 50) * 1000), 'p99_ms': float(np.percentile(times, 99) * 1000),
+            'recall': float(np.mean(recall)), 'ndcg': float(np.mean(ndcg))}
+
+
+def compare(results, baseline, slack=1.0):
+    # regressions as (variant, metric, value, baseline value, limit); variants or metrics missing
+    # on either side are not compared
+    regressions = []
+    for variant, metrics in results.items():
+        base = baseline.get(variant, {})
+        for metric, (better, tolerance, abs_slack) in METRICS.items():
+            if metric not in metrics or metric not in base:
+                continue
+            if better == 'lower':
+                limit = base[metric] * (1 + tolerance * slack) + abs_slack * slack
+                failed = metrics[metric] > limit
+            else:
+                limit = base[metric] - abs_slack * slack
+                failed = metrics[metric] < limit
+            if failed:
+                regressions.append((variant, metric, metrics[metric], base[metric], limit))
+    return regressions
+
+
+def report(results, baseline):
+    print(f'{"variant":12s} ' + ' '.join(f'{metric:>18s}' for metric in METRICS))
+    for variant, metrics in results.items():
+        if 'skipped' in metrics:
+            print(f'{variant:12s} skipped: {metrics["skipped"]}')
+            continue
+        cells = []
+        for metric in METRICS:
+            base = baseline.get(variant, {}).get(metric)
+            cell = f'{metrics[metric]:.3f}' + (f' ({base:.3f})' if base is not None else '')
+            cells.append(f'{cell:>18s}')
+        print(f'{variant:12s} ' + ' '.join(cells))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path', default=None, help='articles TSV, generated Russian text (corpus.russian_corpus) if omitted')
+    parser.add_argument('--n_docs', type=int, default=5000)
+    parser.add_argument('--variants', nargs='+', default=VARIANTS, choices=VARIANTS)
+    parser.add_argument('--n_queries', type=int, default=2000, help='length of the Zipf query log for the latencies')
+    parser.add_argument('--n_judged', type=int, default=300, help='known-item queries for recall / nDCG')
+    parser.add_argument('--inflect', type=float, default=0.5, help='share of known-item query words put in another form')
+    parser.add_argument('--judgments', default=None, help='judgments JSON: loaded if it exists, written otherwise')
+    parser.add_argument('--top_k', type=int, default=10)
+    parser.add_argument('--bert_model', default='cointegrated/rubert-tiny')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--update', action='store_true', help='write the results as the new baseline instead of comparing')
+    parser.add_argument('--slack', type=float, default=1.0, help='multiplier on all tolerances, e.g. 2 on a noisy machine')
+    parser.add_argument('--output', default=None, help='also write the results of this run as JSON')
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.path, sep='\t') if args.path is not None else russian_corpus(n_docs=args.n_docs)
+    queries = query_log(df, args.n_queries, min(args.n_queries, 1000), 1.2)
+    if args.judgments is not None and os.path.exists(args.judgments):
+        with open(args.judgments, encoding='utf-8') as f:
+            judgments = json.load(f)
+    else:
+        judgments = known_item_judgments(df, args.n_judged, inflect=args.inflect)
+        if args.judgments is not None:
+            with open(args.judgments, 'w', encoding='utf-8') as f:
+                json.dump(judgments, f, ensure_ascii=False, indent=1)
+    config = {'path': args.path, 'n_docs': len(df), 'n_queries': args.n_queries, 'n_judged': len(judgments), 'top_k': args.top_k,
+              'judgments': args.judgments, 'inflect': args.inflect, 'bert_model': args.bert_model}
+
+    results = {}
+    for variant in args.variants:
+        # a fresh interpreter per variant: its own peak RSS, and no index from the previous one in memory
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            results[variant] = pool.submit(run_variant, variant, df, queries, judgments, args.top_k, args.bert_model).result()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            stored = json.load(f)
+        if stored['config'] == config:
+            baseline = stored['variants']
+        elif not args.update:
+            print(f'baseline {args.baseline} was recorded with {stored["config"]}, this run is {config}: not comparable')
+            sys.exit(2)
+    report(results, baseline)
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'config': config, 'variants': results}, f, indent=1)
+
+    if args.update:
+        # skipped variants keep their old baseline entry, or are recorded as skipped with the reason
+        merged = {v: m for v, m in results.items() if 'skipped' not in m or v not in baseline}
+        merged = {v: merged.get(v, baseline.get(v)) for v in VARIANTS if v in merged or v in baseline}
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({'config': config, 'variants': merged}, f, indent=1)
+        print(f'baseline written to {args.baseline}')
+        sys.exit(0)
+    if not baseline:
+        print(f'no baseline at {args.baseline}, record one with --update')
+        sys.exit(2)
+    regressions = compare({v: m for v, m in results.items() if 'skipped' not in m}, baseline, args.slack)
+    for variant, metric, value, base, limit in regressions:
+        print(f'REGRESSION {variant} {metric}: {value:.3f}, baseline {base:.3f}, limit {limit:.3f}')
+    if regressions:
+        sys.exit(1)
+    print('no regressions')
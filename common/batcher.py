@@ -0,0 +1,64 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class MicroBatcher():
+    # callers on any thread submit() one item and get a Future; a single worker thread runs
+    # process(items) -> results on whatever has queued up, at most max_batch items at a time.
+    # With max_wait=0 a lone caller is served right away and batches form from the requests that
+    # arrive while the worker is busy; max_wait > 0 holds a batch open that long for more
+    def __init__(self, process, max_batch=64, max_wait=0.0):
+        self.process = process
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.worker = None
+        self.batches = 0
+        self.items = 0
+
+    def submit(self, item):
+        future = Future()
+        self.queue.put((item, future))
+        with self.lock:
+            if self.worker is None:
+                self.worker = threading.Thread(target=self.run, daemon=True)
+                self.worker.start()
+        return future
+
+    def next_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            items = [item for item, _ in batch]
+            try:
+                results = self.process(items)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(items)
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def stats(self):
+        return {'batches': self.batches, 'items': self.items,
+                'mean_batch': self.items / self.batches if self.batches else 0.0}
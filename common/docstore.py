@@ -0,0 +1,90 @@
+import json
+import struct
+import zlib
+import numpy as np
+
+# docstore file layout, the same framing as a segment file:
+#   magic (8 bytes) | version (uint32) | header length (uint64) | json header | offsets | blob
+# doc i is the zlib stream blob[offsets[i]:offsets[i + 1]], so one lookup is two array reads and
+# one inflate of that doc only
+MAGIC = b'DOCSTORE'
+VERSION = 1
+ALIGN = 64
+PREFIX = struct.Struct('<8sIQ')
+
+
+class DocStore():
+    # doc texts by integer doc id. Docs read from a file stay compressed in the (memory-mapped) blob
+    # and are inflated on access; docs added or replaced afterwards are kept as plain str
+    def __init__(self, texts=(), offsets=None, blob=None):
+        self.offsets = np.zeros(1, dtype=np.int64) if offsets is None else offsets
+        self.blob = np.empty(0, dtype=np.uint8) if blob is None else blob
+        self.num_stored = len(self.offsets) - 1
+        self.added = list(texts)
+        self.replaced = {}
+
+    def __len__(self):
+        return self.num_stored + len(self.added)
+
+    def get(self, doc_id):
+        doc_id = int(doc_id)
+        if doc_id < 0 or doc_id >= len(self):
+            raise KeyError(doc_id)
+        if doc_id >= self.num_stored:
+            return self.added[doc_id - self.num_stored]
+        text = self.replaced.get(doc_id)
+        if text is None:
+            text = zlib.decompress(self.blob[self.offsets[doc_id]:self.offsets[doc_id + 1]]).decode('utf-8')
+        return text
+
+    def get_many(self, doc_ids):
+        # texts in the order of doc_ids, e.g. the rank order of a result page
+        return [self.get(doc_id) for doc_id in doc_ids]
+
+    def append(self, texts):
+        start = len(self)
+        self.added.extend(texts)
+        return list(range(start, len(self)))
+
+    def put(self, doc_id, text):
+        doc_id = int(doc_id)
+        if doc_id >= self.num_stored:
+            self.added[doc_id - self.num_stored] = text
+        else:
+            self.replaced[doc_id] = text
+
+    def save(self, path, level=6):
+        chunks = [zlib.compress(self.get(i).encode('utf-8'), level) for i in range(len(self))]
+        offsets = np.zeros(len(chunks) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(c) for c in chunks])
+        header = json.dumps({'num_docs': len(chunks), 'codec': 'zlib'}).encode('utf-8')
+        data_start = -(-(PREFIX.size + len(header)) // ALIGN) * ALIGN
+        blob_start = data_start + -(-offsets.nbytes // ALIGN) * ALIGN
+        with open(path, 'wb') as f:
+            f.write(PREFIX.pack(MAGIC, VERSION, len(header)))
+            f.write(header)
+            f.seek(data_start)
+            f.write(offsets.tobytes())
+            f.seek(blob_start)
+            for chunk in chunks:
+                f.write(chunk)
+            f.truncate(blob_start + int(offsets[-1]))
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        with open(path, 'rb') as f:
+            magic, version, header_len = PREFIX.unpack(f.read(PREFIX.size))
+            if magic != MAGIC:
+                raise ValueError(f'{path} is not a docstore')
+            if version != VERSION:
+                raise ValueError(f'unsupported docstore version {version}, expected {VERSION}')
+            header = json.loads(f.read(header_len).decode('utf-8'))
+        data_start = -(-(PREFIX.size + header_len) // ALIGN) * ALIGN
+        if mmap:
+            data = np.memmap(path, dtype=np.uint8, mode='r')
+        else:
+            data = np.fromfile(path, dtype=np.uint8)
+        num_offsets = header['num_docs'] + 1
+        offsets = data[data_start:data_start + num_offsets * 8].view(np.int64)
+        blob_start = data_start + -(-num_offsets * 8 // ALIGN) * ALIGN
+        return cls(offsets=offsets, blob=data[blob_start:])
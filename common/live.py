@@ -0,0 +1,299 @@
+import heapq
+import math
+import threading
+import numpy as np
+from common import telemetry
+from common.postings import CompactIndex, build_blocks, encode_positions, gather_runs, vbyte_decode
+from common.ranking import BM25, bm25_top_k
+
+
+class Segment():
+    # an immutable CompactIndex over local docs 0..n-1 and the global id of every local doc;
+    # local ids always follow the order of the global ones
+    def __init__(self, index, doc_ids):
+        self.index = index
+        self.doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        self.identity = bool((self.doc_ids == np.arange(len(self.doc_ids))).all())
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def locate(self, doc_ids):
+        # local ids of the given global ids, -1 where the segment does not hold them
+        if len(self.doc_ids) == 0:
+            return np.full(len(doc_ids), -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.doc_ids, doc_ids), len(self.doc_ids) - 1)
+        return np.where(self.doc_ids[pos] == doc_ids, pos, -1)
+
+
+def segment_postings(index):
+    # (term_id, local doc, tf) of every posting of the index
+    lens = np.diff(index.offsets)
+    cs = np.cumsum(index.doc_deltas, dtype=np.int64)
+    before = np.concatenate([[0], cs])[index.offsets[:-1]]
+    return np.repeat(np.arange(len(lens)), lens), cs - np.repeat(before, lens), index.tfs.astype(np.int64)
+
+
+def merge_segments(segments, lives):
+    # one segment with the live docs of all the given ones, the postings of deleted docs are dropped
+    doc_ids = np.concatenate([seg.doc_ids[live] for seg, live in zip(segments, lives)])
+    order = np.argsort(doc_ids, kind='stable')
+    doc_ids = doc_ids[order]
+    new_local = np.empty(len(order), dtype=np.int64)
+    new_local[order] = np.arange(len(order))
+    doc_lens = np.concatenate([seg.index.doc_lens[:len(seg)][live] for seg, live in zip(segments, lives)])[order]
+
+    positional = all(seg.index.positions is not None for seg in segments)
+    terms = {}
+    all_terms, all_docs, all_tfs, all_gaps = [], [], [], []
+    first = 0
+    for seg, live in zip(segments, lives):
+        # local id in the merged segment of every live doc of this one
+        remap = np.full(len(seg), -1, dtype=np.int64)
+        remap[live] = new_local[first:first + int(live.sum())]
+        first += int(live.sum())
+        term_map = np.empty(len(seg.index.offsets) - 1, dtype=np.int64)
+        for term, term_id in seg.index.terms.items():
+            term_map[term_id] = terms.setdefault(term, len(terms))
+        term_ids, docs, tfs = segment_postings(seg.index)
+        keep = live[docs]
+        all_terms.append(term_map[term_ids[keep]])
+        all_docs.append(remap[docs[keep]])
+        all_tfs.append(tfs[keep])
+        if positional:
+            starts = np.zeros(len(tfs), dtype=np.int64)
+            starts[1:] = np.cumsum(tfs)[:-1]
+            kept = np.flatnonzero(keep)
+            all_gaps.append(vbyte_decode(seg.index.positions)[gather_runs(starts[kept], tfs[kept])])
+
+    term_ids = np.concatenate(all_terms)
+    docs = np.concatenate(all_docs)
+    tfs = np.concatenate(all_tfs)
+    # terms left without postings are dropped and the rest renumbered in first-seen order
+    counts = np.bincount(term_ids, minlength=len(terms))
+    renumber = np.cumsum(counts > 0) - 1
+    terms = {term: int(renumber[t]) for term, t in terms.items() if counts[t] > 0}
+    term_ids = renumber[term_ids]
+    order = np.lexsort((docs, term_ids))
+    if positional:
+        # position gaps restart at every posting, so they move with it as whole runs
+        starts = np.zeros(len(tfs), dtype=np.int64)
+        starts[1:] = np.cumsum(tfs)[:-1]
+        gaps = np.concatenate(all_gaps)[gather_runs(starts[order], tfs[order])]
+    term_ids, docs, tfs = term_ids[order], docs[order], tfs[order]
+
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(counts[counts > 0])
+    doc_deltas = np.diff(docs, prepend=0)
+    doc_deltas[offsets[:-1]] = docs[offsets[:-1]]
+    doc_deltas = doc_deltas.astype(np.uint32)
+    tfs = tfs.astype(np.uint32)
+    doc_lens = doc_lens.astype(np.uint32)
+    blocks = build_blocks(offsets, doc_deltas, tfs, doc_lens)
+    positions = encode_positions(gaps, offsets, tfs, blocks[0]) if positional else (None, None)
+    return Segment(CompactIndex(terms, offsets, doc_deltas, tfs, len(doc_ids), doc_lens, *blocks, *positions), doc_ids)
+
+
+class Snapshot():
+    # the segments and their live masks at one moment; masks are replaced, never changed in place,
+    # so a query on a snapshot does not see the deletes, adds and merges that come after it.
+    # Collection statistics count deleted docs until a merge drops them, as Lucene does.
+    # generation goes up with every published snapshot, results of one generation stay valid for it
+    def __init__(self, segments, lives, generation=0):
+        self.segments = segments
+        self.lives = lives
+        self.generation = generation
+        # the segments merged into one, built on first use by LiveIndex.merged()
+        self.view = None
+        self.num_docs = sum(seg.index.num_docs for seg in segments)
+        total_len = sum(float(seg.index.doc_lens.sum()) for seg in segments)
+        self.avg_doc_len = total_len / max(self.num_docs, 1)
+        self.num_live = sum(int(live.sum()) for live in lives)
+        self.all_live = self.num_live == self.num_docs
+
+    def doc_freq(self, term):
+        return sum(seg.index.doc_freq(term) for seg in self.segments)
+
+    def __contains__(self, term):
+        return any(term in seg.index for seg in self.segments)
+
+    def merged(self, parts):
+        # per segment (local docs, scores) -> global docs in increasing order, deleted docs dropped
+        if len(self.segments) == 1 and self.segments[0].identity and self.all_live:
+            return parts[0]
+        docs, scores = [], []
+        for seg, live, (d, s) in zip(self.segments, self.lives, parts):
+            keep = live[d]
+            docs.append(seg.doc_ids[d[keep]])
+            scores.append(s[keep])
+        if len(docs) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        docs, scores = np.concatenate(docs), np.concatenate(scores)
+        order = np.argsort(docs, kind='stable')
+        return docs[order], scores[order]
+
+    def get(self, term):
+        parts = [seg.index.get(term) for seg in self.segments]
+        if all(p is None for p in parts):
+            return None
+        empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+        return self.merged([empty if p is None else p for p in parts])
+
+    @telemetry.timed('intersect')
+    def intersect(self, words):
+        return self.merged([seg.index.intersect(words) for seg in self.segments])
+
+    @telemetry.timed('phrase')
+    def phrase(self, words, offsets=None):
+        return self.merged([seg.index.phrase(words, offsets) for seg in self.segments])
+
+    @telemetry.timed('near')
+    def near(self, words, k):
+        return self.merged([seg.index.near(words, k) for seg in self.segments])
+
+    @telemetry.timed('score')
+    def bm25_top_k(self, words, top_k=10, k1=1.2, b=0.75):
+        # every segment gives its top k of live docs under the collection-wide idf and average length
+        bm25 = BM25(self.num_docs, self.avg_doc_len, k1, b)
+        idfs = {w: bm25.idf(self.doc_freq(w)) for w in set(words)}
+        results = []
+        for seg, live in zip(self.segments, self.lives):
+            seg_live = None if live.all() else live
+            for doc, score in bm25_top_k(seg.index, words, top_k, bm25=bm25, idfs=idfs, live=seg_live):
+                results.append((int(seg.doc_ids[doc]), score))
+        return heapq.nsmallest(top_k, results, key=lambda x: (-x[1], x[0]))
+
+
+class LiveIndex():
+    # LSM-style index: every batch of added docs becomes a small immutable segment, deletes are
+    # tombstones in the live masks, and segments of about the same size are merged in a background
+    # thread once merge_factor of them pile up. Readers take snapshot(), writers swap in a new one
+    def __init__(self, segment, merge_factor=8, background=True):
+        self.merge_factor = merge_factor
+        self.background = background
+        self.lock = threading.Lock()
+        self.merging = None
+        self.current = Snapshot((segment,), (np.ones(len(segment), dtype=bool),))
+
+    def snapshot(self):
+        return self.current
+
+    def publish(self, segments, lives):
+        self.current = Snapshot(tuple(segments), tuple(lives), self.current.generation + 1)
+
+    def tombstone(self, snap, doc_ids):
+        # new live masks without the live copies of doc_ids, and how many there were
+        lives = list(snap.lives)
+        deleted = 0
+        for i, seg in enumerate(snap.segments):
+            local = seg.locate(doc_ids)
+            local = local[local >= 0]
+            local = local[lives[i][local]]
+            if len(local) > 0:
+                lives[i] = lives[i].copy()
+                lives[i][local] = False
+                deleted += len(local)
+        return lives, deleted
+
+    def add(self, index, doc_ids):
+        # doc_ids must be increasing; docs that are already live elsewhere are replaced by the new
+        # copies in the same swap, so no snapshot misses them or has them twice
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        with self.lock:
+            snap = self.current
+            lives, _ = self.tombstone(snap, doc_ids)
+            self.publish(snap.segments + (Segment(index, doc_ids),), lives + [np.ones(len(doc_ids), dtype=bool)])
+        self.maybe_merge()
+
+    def delete(self, doc_ids):
+        # tombstones the live copies of doc_ids, returns how many there were
+        with self.lock:
+            snap = self.current
+            lives, deleted = self.tombstone(snap, np.asarray(doc_ids, dtype=np.int64))
+            if deleted:
+                self.publish(snap.segments, lives)
+        return deleted
+
+    def tier(self, segment):
+        return int(math.log(max(len(segment), 1), self.merge_factor))
+
+    def pick_merge(self, snap):
+        # the segments of the first tier (by size) that has merge_factor of them
+        tiers = {}
+        for seg in snap.segments:
+            tiers.setdefault(self.tier(seg), []).append(seg)
+        for tier in sorted(tiers):
+            if len(tiers[tier]) >= self.merge_factor:
+                return tiers[tier]
+        return None
+
+    def maybe_merge(self):
+        with self.lock:
+            if self.merging is not None:
+                return
+            sources = self.pick_merge(self.current)
+            if sources is None:
+                return
+            if self.background:
+                self.merging = threading.Thread(target=self.merge, args=(sources,), daemon=True)
+                self.merging.start()
+                return
+        self.merge(sources)
+
+    def merge(self, sources):
+        snap = self.current
+        used = [snap.lives[snap.segments.index(seg)] for seg in sources]
+        merged = merge_segments(sources, used)
+        with self.lock:
+            snap = self.current
+            self.merging = None
+            if not all(any(seg is s for s in snap.segments) for seg in sources):
+                # compact() got there first
+                return
+            merged_live = np.ones(len(merged), dtype=bool)
+            for seg, live in zip(sources, used):
+                # docs deleted while the merge was running are deleted in the merged segment too
+                gone = merged.locate(seg.doc_ids[live & ~snap.lives[snap.segments.index(seg)]])
+                merged_live[gone[gone >= 0]] = False
+            first = min(snap.segments.index(seg) for seg in sources)
+            segments, new_lives = [], []
+            for i, (seg, live) in enumerate(zip(snap.segments, snap.lives)):
+                if i == first:
+                    segments.append(merged)
+                    new_lives.append(merged_live)
+                if not any(seg is s for s in sources):
+                    segments.append(seg)
+                    new_lives.append(live)
+            self.publish(segments, new_lives)
+        self.maybe_merge()
+
+    def wait(self):
+        # blocks until no merge is running
+        while True:
+            with self.lock:
+                merging = self.merging
+            if merging is None:
+                return
+            merging.join()
+
+    def merged(self):
+        # the current snapshot as one segment without deleted docs, e.g. to write it out. It is not
+        # published, so the generation and the results cached for it stay as they are
+        snap = self.current
+        if snap.view is None:
+            if len(snap.segments) == 1 and snap.lives[0].all():
+                snap.view = snap.segments[0]
+            else:
+                snap.view = merge_segments(snap.segments, snap.lives)
+        return snap.view
+
+    def compact(self):
+        # merged() published in place of the segments, a new generation
+        self.wait()
+        with self.lock:
+            snap = self.current
+            if len(snap.segments) == 1 and snap.lives[0].all():
+                return snap.segments[0]
+            merged = snap.view if snap.view is not None else merge_segments(snap.segments, snap.lives)
+            self.publish((merged,), (np.ones(len(merged), dtype=bool),))
+            return merged
@@ -0,0 +1,342 @@
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from tqdm import tqdm
+from common import telemetry
+
+BLOCK_SIZE = 128
+
+
+class PostingsBuilder():
+    # documents must be added in increasing doc_id order; with positions=True every posting also
+    # keeps the positions of the term in the doc as gaps (the first one absolute)
+    def __init__(self, positions=False):
+        self.terms = {}
+        self.docs = []
+        self.tfs = []
+        self.last_doc = []
+        self.pos_gaps = [] if positions else None
+        self.doc_lens = array('I')
+        self.num_docs = 0
+
+    def add_term(self, word):
+        term_id = len(self.docs)
+        self.terms[word] = term_id
+        self.docs.append(array('I'))
+        self.tfs.append(array('I'))
+        self.last_doc.append(0)
+        if self.pos_gaps is not None:
+            self.pos_gaps.append(array('I'))
+        return term_id
+
+    @telemetry.timed('posting_update')
+    def add_document(self, doc_id, freqs, positions=None):
+        # positions: word -> increasing positions of the word in the doc, needed by a positional builder
+        if (self.pos_gaps is not None) != (positions is not None):
+            raise ValueError('positions must be given exactly when the builder is positional')
+        for word, cnt in freqs.items():
+            term_id = self.terms.get(word)
+            if term_id is None:
+                term_id = self.add_term(word)
+            self.docs[term_id].append(doc_id - self.last_doc[term_id])
+            self.tfs[term_id].append(cnt)
+            self.last_doc[term_id] = doc_id
+            if positions is not None:
+                pos = positions[word]
+                gaps = self.pos_gaps[term_id]
+                gaps.append(pos[0])
+                gaps.extend([b - a for a, b in zip(pos, pos[1:])])
+        self.doc_lens.extend([0] * (doc_id - len(self.doc_lens)))
+        self.doc_lens.append(sum(freqs.values()))
+        self.num_docs += 1
+
+    def merge(self, other):
+        # appends a builder whose doc ids all come after the ones already added, term ids are
+        # assigned in the same first-seen order a serial build would use
+        if (self.pos_gaps is None) != (other.pos_gaps is None):
+            raise ValueError('cannot merge a positional builder with a non-positional one')
+        for word, other_id in other.terms.items():
+            term_id = self.terms.get(word)
+            if term_id is None:
+                term_id = self.add_term(word)
+            docs = other.docs[other_id]
+            self.docs[term_id].append(docs[0] - self.last_doc[term_id])
+            self.docs[term_id].extend(docs[1:])
+            self.tfs[term_id].extend(other.tfs[other_id])
+            self.last_doc[term_id] = other.last_doc[other_id]
+            if self.pos_gaps is not None:
+                # gaps restart at every posting, so they carry over unchanged
+                self.pos_gaps[term_id].extend(other.pos_gaps[other_id])
+        self.doc_lens.extend(other.doc_lens[len(self.doc_lens):])
+        self.num_docs += other.num_docs
+
+    @telemetry.timed('posting_build')
+    def build(self):
+        offsets = np.zeros(len(self.docs) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(d) for d in self.docs])
+        doc_deltas = np.empty(offsets[-1], dtype=np.uint32)
+        tfs = np.empty(offsets[-1], dtype=np.uint32)
+        for term_id, (d, t) in enumerate(zip(self.docs, self.tfs)):
+            doc_deltas[offsets[term_id]:offsets[term_id + 1]] = d
+            tfs[offsets[term_id]:offsets[term_id + 1]] = t
+        doc_lens = np.frombuffer(self.doc_lens, dtype=np.uint32).copy()
+        blocks = build_blocks(offsets, doc_deltas, tfs, doc_lens)
+        positions = None
+        if self.pos_gaps is not None:
+            gaps = np.empty(int(tfs.sum()), dtype=np.uint32)
+            start = 0
+            for g in self.pos_gaps:
+                gaps[start:start + len(g)] = g
+                start += len(g)
+            positions = encode_positions(gaps, offsets, tfs, blocks[0])
+        return CompactIndex(self.terms, offsets, doc_deltas, tfs, self.num_docs, doc_lens, *blocks,
+                            *(positions or (None, None)))
+
+
+def build_parallel(index_chunk, doc_ids, texts, n_jobs, initializer=None, initargs=(), positions=False):
+    # index_chunk(doc_ids, texts) -> PostingsBuilder runs in the worker processes on contiguous
+    # slices of the corpus; the partial builders are merged back in doc order, and the workers'
+    # stage timers into this process's
+    step = max(1, -(-len(doc_ids) // (n_jobs * 4)))
+    starts = range(0, len(doc_ids), step)
+    builder = PostingsBuilder(positions)
+    with ProcessPoolExecutor(n_jobs, initializer=telemetry.init_worker,
+                             initargs=(telemetry.enabled, initializer, initargs)) as executor:
+        parts = executor.map(telemetry.in_worker, [index_chunk] * len(starts),
+                             [doc_ids[s:s + step] for s in starts], [texts[s:s + step] for s in starts])
+        for part, stats in tqdm(parts, total=len(starts)):
+            builder.merge(part)
+            telemetry.merge(stats)
+    return builder
+
+
+def build_blocks(offsets, doc_deltas, tfs, doc_lens):
+    # one entry per BLOCK_SIZE postings: the last doc id of the block for skipping, and the
+    # largest tf / shortest document in it, which bound the BM25 score of any doc in the block
+    num_blocks = (np.diff(offsets) + BLOCK_SIZE - 1) // BLOCK_SIZE
+    skip_offsets = np.zeros(len(offsets), dtype=np.int64)
+    skip_offsets[1:] = np.cumsum(num_blocks)
+    skip_docs = np.empty(skip_offsets[-1], dtype=np.uint32)
+    block_max_tf = np.empty(skip_offsets[-1], dtype=np.uint32)
+    block_min_len = np.empty(skip_offsets[-1], dtype=np.uint32)
+    for term_id in range(len(offsets) - 1):
+        start, end = offsets[term_id], offsets[term_id + 1]
+        docs = np.cumsum(doc_deltas[start:end], dtype=np.int64)
+        firsts = np.arange(0, end - start, BLOCK_SIZE)
+        lasts = np.minimum(firsts + BLOCK_SIZE, end - start) - 1
+        blocks = slice(skip_offsets[term_id], skip_offsets[term_id + 1])
+        skip_docs[blocks] = docs[lasts]
+        block_max_tf[blocks] = np.maximum.reduceat(tfs[start:end], firsts)
+        block_min_len[blocks] = np.minimum.reduceat(doc_lens[docs], firsts)
+    return skip_offsets, skip_docs, block_max_tf, block_min_len
+
+
+def vbyte_encode(values):
+    # 7 bits per byte, low bits first, the high bit set on every byte but the last of a value
+    values = values.astype(np.uint64)
+    nbytes = np.ones(len(values), dtype=np.int64)
+    for shift in (7, 14, 21, 28):
+        nbytes += values >= (1 << shift)
+    starts = np.zeros(len(values), dtype=np.int64)
+    starts[1:] = np.cumsum(nbytes)[:-1]
+    owner = np.repeat(np.arange(len(values)), nbytes)
+    k = np.arange(int(nbytes.sum())) - starts[owner]
+    out = (values[owner] >> (7 * k).astype(np.uint64)) & 127
+    out |= np.where(k < nbytes[owner] - 1, 128, 0).astype(np.uint64)
+    return out.astype(np.uint8), nbytes
+
+
+def vbyte_decode(data):
+    if len(data) == 0:
+        return np.empty(0, dtype=np.int64)
+    ends = data < 128
+    starts = np.zeros(int(ends.sum()), dtype=np.int64)
+    starts[1:] = np.flatnonzero(ends)[:-1] + 1
+    owner = np.cumsum(ends) - ends
+    k = np.arange(len(data)) - starts[owner]
+    return np.add.reduceat((data & 127).astype(np.int64) << (7 * k), starts)
+
+
+def encode_positions(gaps, offsets, tfs, skip_offsets):
+    # the position gaps of all postings as one vbyte stream; pos_offsets[b] is where skip block b
+    # starts in it, so the positions of a block decode without the ones before it
+    data, nbytes = vbyte_encode(gaps)
+    num_blocks = np.diff(skip_offsets)
+    first_posting = np.repeat(offsets[:-1], num_blocks) + \
+        (np.arange(skip_offsets[-1]) - np.repeat(skip_offsets[:-1], num_blocks)) * BLOCK_SIZE
+    value_starts = np.zeros(len(tfs) + 1, dtype=np.int64)
+    value_starts[1:] = np.cumsum(tfs, dtype=np.int64)
+    byte_starts = np.zeros(len(gaps) + 1, dtype=np.int64)
+    byte_starts[1:] = np.cumsum(nbytes)
+    pos_offsets = np.empty(skip_offsets[-1] + 1, dtype=np.int64)
+    pos_offsets[:-1] = byte_starts[value_starts[first_posting]]
+    pos_offsets[-1] = len(data)
+    return data, pos_offsets
+
+
+def gather_runs(starts, lens):
+    # indices of the runs [starts[i], starts[i] + lens[i]) one after another
+    firsts = np.zeros(len(lens), dtype=np.int64)
+    firsts[1:] = np.cumsum(lens)[:-1]
+    return np.arange(int(lens.sum())) + np.repeat(starts - firsts, lens)
+
+
+class CompactIndex():
+    # term -> term_id; postings of term_id live in [offsets[term_id], offsets[term_id + 1])
+    # of the parallel doc_deltas / tfs arrays, doc ids are delta-encoded and sorted.
+    # skip_docs[skip_offsets[term_id]:skip_offsets[term_id + 1]] holds the last doc id
+    # of every BLOCK_SIZE postings, so a block can be decoded without the ones before it;
+    # block_max_tf / block_min_len sit next to it for the block-max BM25 bounds.
+    # A positional index adds the vbyte position gaps of every posting (tfs[i] of them for
+    # posting i) and pos_offsets, the start of every skip block in them
+    def __init__(self, terms, offsets, doc_deltas, tfs, num_docs, doc_lens,
+                 skip_offsets, skip_docs, block_max_tf, block_min_len, positions=None, pos_offsets=None):
+        self.terms = terms
+        self.offsets = offsets
+        self.doc_deltas = doc_deltas
+        self.tfs = tfs
+        self.num_docs = num_docs
+        self.doc_lens = doc_lens
+        self.skip_offsets = skip_offsets
+        self.skip_docs = skip_docs
+        self.block_max_tf = block_max_tf
+        self.block_min_len = block_min_len
+        self.positions = positions
+        self.pos_offsets = pos_offsets
+        self.avg_doc_len = float(doc_lens.sum()) / max(num_docs, 1)
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __contains__(self, term):
+        return term in self.terms
+
+    def doc_freq(self, term):
+        term_id = self.terms.get(term)
+        if term_id is None:
+            return 0
+        return int(self.offsets[term_id + 1] - self.offsets[term_id])
+
+    def get(self, term):
+        term_id = self.terms.get(term)
+        if term_id is None:
+            return None
+        start, end = self.offsets[term_id], self.offsets[term_id + 1]
+        docs = np.cumsum(self.doc_deltas[start:end], dtype=np.int64)
+        return docs, self.tfs[start:end].astype(np.int64)
+
+    def decode_blocks(self, term_id, blocks):
+        start, end = self.offsets[term_id], self.offsets[term_id + 1]
+        skips = self.skip_docs[self.skip_offsets[term_id]:self.skip_offsets[term_id + 1]]
+        starts = start + blocks * BLOCK_SIZE
+        lens = np.minimum(starts + BLOCK_SIZE, end) - starts
+        seg_first = np.zeros(len(blocks), dtype=np.int64)
+        seg_first[1:] = np.cumsum(lens)[:-1]
+        idx = np.arange(lens.sum()) + np.repeat(starts - seg_first, lens)
+        cs = np.cumsum(self.doc_deltas[idx], dtype=np.int64)
+        cs_before = np.where(seg_first > 0, cs[seg_first - 1], 0)
+        bases = np.where(blocks > 0, skips[blocks - 1], 0).astype(np.int64)
+        docs = cs - np.repeat(cs_before - bases, lens)
+        return docs, self.tfs[idx].astype(np.int64)
+
+    def probe(self, term_id, docs, scores):
+        # keeps the candidates present in term_id's postings and adds its tf to their scores;
+        # only the blocks the candidates fall into are decoded
+        skips = self.skip_docs[self.skip_offsets[term_id]:self.skip_offsets[term_id + 1]]
+        blocks = np.searchsorted(skips, docs)
+        inside = blocks < len(skips)
+        docs, scores, blocks = docs[inside], scores[inside], blocks[inside]
+        if len(docs) == 0:
+            return docs, scores
+        block_docs, block_tfs = self.decode_blocks(term_id, np.unique(blocks))
+        pos = np.searchsorted(block_docs, docs)
+        found = block_docs[pos] == docs
+        return docs[found], scores[found] + block_tfs[pos[found]]
+
+    def intersect(self, words):
+        # conjunctive query: terms go from the rarest up, so the work follows the shortest posting
+        term_ids = [self.terms.get(w) for w in words]
+        if len(term_ids) == 0 or None in term_ids:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        term_ids.sort(key=lambda t: self.offsets[t + 1] - self.offsets[t])
+        start, end = self.offsets[term_ids[0]], self.offsets[term_ids[0] + 1]
+        docs = np.cumsum(self.doc_deltas[start:end], dtype=np.int64)
+        scores = self.tfs[start:end].astype(np.int64)
+        for term_id in term_ids[1:]:
+            docs, scores = self.probe(term_id, docs, scores)
+            if len(docs) == 0:
+                break
+        return docs, scores
+
+    def term_positions(self, term_id, docs):
+        # (doc, position) of every occurrence of the term in docs, which must all be in its postings;
+        # only the blocks the docs fall into are decoded
+        skips = self.skip_docs[self.skip_offsets[term_id]:self.skip_offsets[term_id + 1]]
+        blocks = np.unique(np.searchsorted(skips, docs))
+        block_docs, block_tfs = self.decode_blocks(term_id, blocks)
+        first = self.skip_offsets[term_id] + blocks
+        byte_starts = self.pos_offsets[first]
+        data = self.positions[gather_runs(byte_starts, self.pos_offsets[first + 1] - byte_starts)]
+        cs = np.cumsum(vbyte_decode(data))
+        starts = np.zeros(len(block_tfs), dtype=np.int64)
+        starts[1:] = np.cumsum(block_tfs)[:-1]
+        before = np.where(starts > 0, cs[starts - 1], 0)
+        pos = cs - np.repeat(before, block_tfs)
+        sel = np.searchsorted(block_docs, docs)
+        lens = block_tfs[sel]
+        return np.repeat(docs, lens), pos[gather_runs(starts[sel], lens)]
+
+    def check_positions(self):
+        if self.positions is None:
+            raise ValueError('the index has no positions, build it with positions=True')
+
+    def phrase(self, words, offsets=None):
+        # docs where words[i] occurs at p + offsets[i] for some p, and how many such p each has.
+        # Candidates come from the conjunctive intersection and shrink term by term, rarest first
+        self.check_positions()
+        offsets = list(range(len(words))) if offsets is None else list(offsets)
+        docs, _ = self.intersect(words)
+        if len(docs) == 0:
+            return docs, docs
+        order = sorted(range(len(words)), key=lambda i: self.doc_freq(words[i]))
+        shift = max(offsets)
+        starts = None
+        for i in order:
+            d, p = self.term_positions(self.terms[words[i]], docs)
+            # start of the phrase if this occurrence is word i of it
+            keys = (d << 32) + (p - offsets[i] + shift)
+            starts = keys if starts is None else np.intersect1d(starts, keys, assume_unique=True)
+            if len(starts) == 0:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+            docs = np.unique(starts >> 32)
+        return np.unique(starts >> 32, return_counts=True)
+
+    def near(self, words, k):
+        # docs where all words occur with at most k other tokens between the first and the last of
+        # them, and how many occurrences end such a window
+        self.check_positions()
+        words = list(dict.fromkeys(words))
+        docs, _ = self.intersect(words)
+        if len(docs) == 0:
+            return docs, docs
+        keys = []
+        for w in words:
+            d, p = self.term_positions(self.terms[w], docs)
+            keys.append((d << 32) + p)
+        events = np.concatenate(keys)
+        window_start = events
+        for term_keys in keys:
+            # the last occurrence of the term at or before every event; one from an earlier doc is
+            # at least 2**32 back and never fits the window
+            last = np.searchsorted(term_keys, events, side='right') - 1
+            found = np.where(last >= 0, term_keys[np.maximum(last, 0)], -(1 << 62))
+            window_start = np.minimum(window_start, found)
+        ends = events[events - window_start <= k + len(words) - 1]
+        return np.unique(ends >> 32, return_counts=True)
+
+    def nbytes(self):
+        arrays = [self.offsets, self.doc_deltas, self.tfs, self.doc_lens,
+                  self.skip_offsets, self.skip_docs, self.block_max_tf, self.block_min_len]
+        if self.positions is not None:
+            arrays += [self.positions, self.pos_offsets]
+        return sum(a.nbytes for a in arrays)
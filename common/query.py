@@ -0,0 +1,15 @@
+import re
+
+NEAR_RE = re.compile(r'\s+NEAR/(\d+)\s+')
+
+
+def parse_query(query):
+    # '"a b c"' -> ('phrase', 'a b c'); 'a NEAR/3 b NEAR/3 c' -> ('near', 'a b c', 3), with the
+    # smallest k when they differ; anything else -> ('and', query)
+    query = query.strip()
+    if len(query) > 1 and query[0] == '"' and query[-1] == '"':
+        return ('phrase', query[1:-1])
+    parts = NEAR_RE.split(query)
+    if len(parts) > 1:
+        return ('near', ' '.join(parts[::2]), min(int(k) for k in parts[1::2]))
+    return ('and', query)
@@ -0,0 +1,165 @@
+import heapq
+import math
+from bisect import bisect_left
+import numpy as np
+
+
+class BM25():
+    def __init__(self, num_docs, avg_doc_len, k1=1.2, b=0.75):
+        self.num_docs = num_docs
+        self.avg_doc_len = avg_doc_len
+        self.k1 = k1
+        self.b = b
+
+    def idf(self, doc_freq):
+        return math.log(1 + (self.num_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+
+    def score(self, idf, tf, doc_len):
+        norm = self.k1 * (1 - self.b + self.b * doc_len / self.avg_doc_len)
+        return idf * tf * (self.k1 + 1) / (tf + norm)
+
+
+class TermCursor():
+    # walks one term's postings a block at a time; a block is decoded only when it has to be scored
+    def __init__(self, index, term_id, bm25, idf=None):
+        self.index = index
+        self.term_id = term_id
+        self.bm25 = bm25
+        blocks = slice(index.skip_offsets[term_id], index.skip_offsets[term_id + 1])
+        self.skips_array = index.skip_docs[blocks]
+        self.skips = self.skips_array.tolist()
+        self.idf = bm25.idf(int(index.offsets[term_id + 1] - index.offsets[term_id])) if idf is None else idf
+        # the score is increasing in tf and decreasing in doc length, so the block's largest tf
+        # and shortest doc give an upper bound for every posting in it
+        self.block_ubs = bm25.score(self.idf, index.block_max_tf[blocks].astype(np.float64),
+                                    index.block_min_len[blocks].astype(np.float64)).tolist()
+        self.ub = max(self.block_ubs)
+        self.block = 0
+        self.decoded = None
+
+    def seek(self, doc):
+        # moves to the block that holds the first posting >= doc, False when the postings are exhausted
+        self.block = bisect_left(self.skips, doc, self.block)
+        return self.block < len(self.skips)
+
+    def window_ub(self, lo, hi):
+        first = bisect_left(self.skips, lo, self.block)
+        last = min(bisect_left(self.skips, hi, first), len(self.skips) - 1)
+        return max(self.block_ubs[first:last + 1], default=0.0)
+
+    def block_postings(self):
+        if self.decoded is None or self.decoded[0] != self.block:
+            docs, tfs = self.index.decode_blocks(self.term_id, np.array([self.block]))
+            self.decoded = (self.block, docs, tfs)
+        return self.decoded[1], self.decoded[2]
+
+    def scores(self, docs, doc_lens):
+        # bm25 contribution of this term to each of the sorted docs, 0 where the term is absent
+        blocks = np.searchsorted(self.skips_array, docs)
+        inside = blocks < len(self.skips)
+        result = np.zeros(len(docs))
+        if not inside.any():
+            return result
+        block_docs, block_tfs = self.index.decode_blocks(self.term_id, np.unique(blocks[inside]))
+        pos = np.minimum(np.searchsorted(block_docs, docs), len(block_docs) - 1)
+        found = block_docs[pos] == docs
+        result[found] = self.bm25.score(self.idf, block_tfs[pos[found]], doc_lens[found])
+        return result
+
+
+# queries whose terms have at most this many postings in all are scored exhaustively in numpy,
+# about 20 ns a posting; MaxScore pays a Python loop step per block and prunes nothing when every
+# term is essential (all of them common), so it only wins past millions of postings
+EXHAUSTIVE_POSTINGS = 1 << 22
+
+
+def exhaustive_top_k(index, term_ids, top_k, bm25, idfs=None, live=None):
+    # every posting of every term decoded and scored at once, summed per doc with bincount;
+    # the same order as bm25_top_k: score descending, then doc id
+    scores = np.zeros(index.num_docs)
+    for w, term_id in term_ids.items():
+        start, end = index.offsets[term_id], index.offsets[term_id + 1]
+        docs = np.cumsum(index.doc_deltas[start:end], dtype=np.int64)
+        idf = bm25.idf(int(end - start)) if idfs is None else idfs[w]
+        scores += np.bincount(docs, bm25.score(idf, index.tfs[start:end].astype(np.float64),
+                                               index.doc_lens[docs].astype(np.float64)), minlength=index.num_docs)
+    if live is not None:
+        scores[~live[:index.num_docs]] = 0.0
+    docs = np.flatnonzero(scores > 0)
+    if len(docs) > top_k:
+        kth = np.partition(scores[docs], len(docs) - top_k)[len(docs) - top_k]
+        docs = docs[scores[docs] >= kth]
+    order = np.lexsort((docs, -scores[docs]))[:top_k]
+    return [(doc, score) for doc, score in zip(docs[order].tolist(), scores[docs[order]].tolist())]
+
+
+def bm25_top_k(index, words, top_k=10, k1=1.2, b=0.75, bm25=None, idfs=None, live=None):
+    # disjunctive BM25 with block-max MaxScore. Terms whose summed upper bounds cannot beat the
+    # current k-th score are non-essential: they never produce candidates, only add to the scores
+    # of docs found by the essential ones. The doc id space is walked one essential block at a
+    # time, and a window whose block bounds cannot reach the threshold is skipped undecoded.
+    # A segment of a larger index passes the collection-wide bm25 and {word: idf}, and a live
+    # mask that keeps deleted docs out of the top k
+    if bm25 is None:
+        bm25 = BM25(index.num_docs, index.avg_doc_len, k1, b)
+    term_ids = {w: index.terms[w] for w in words if w in index.terms}
+    if len(term_ids) == 0 or top_k <= 0:
+        return []
+    if sum(int(index.offsets[t + 1] - index.offsets[t]) for t in term_ids.values()) <= EXHAUSTIVE_POSTINGS:
+        return exhaustive_top_k(index, term_ids, top_k, bm25, idfs, live)
+    cursors = sorted((TermCursor(index, t, bm25, None if idfs is None else idfs[w]) for w, t in term_ids.items()),
+                     key=lambda c: c.ub)
+    prefix_ub = np.cumsum([c.ub for c in cursors]).tolist()
+
+    heap = []
+    threshold = 0.0
+    first_essential = 0
+    lo = 0
+    while first_essential < len(cursors):
+        essential = [c for c in cursors[first_essential:] if c.seek(lo)]
+        if len(essential) == 0:
+            break
+        hi = min(c.skips[c.block] for c in essential)
+        non_essential = cursors[:first_essential]
+        window_ubs = [c.window_ub(lo, hi) for c in non_essential]
+        bound = sum(c.block_ubs[c.block] for c in essential) + sum(window_ubs)
+        if len(heap) == top_k and bound <= threshold:
+            lo = hi + 1
+            continue
+
+        postings = [c.block_postings() for c in essential]
+        docs = np.unique(np.concatenate([d[(d >= lo) & (d <= hi)] for d, _ in postings]))
+        if live is not None:
+            docs = docs[live[docs]]
+        doc_lens = index.doc_lens[docs].astype(np.float64)
+        scores = np.zeros(len(docs))
+        for c, (block_docs, block_tfs) in zip(essential, postings):
+            pos = np.minimum(np.searchsorted(block_docs, docs), len(block_docs) - 1)
+            found = block_docs[pos] == docs
+            scores[found] += bm25.score(c.idf, block_tfs[pos[found]], doc_lens[found])
+
+        remaining = sum(window_ubs)
+        for i in range(len(non_essential) - 1, -1, -1):
+            if len(heap) == top_k:
+                keep = scores + remaining > threshold
+                docs, scores, doc_lens = docs[keep], scores[keep], doc_lens[keep]
+            if len(docs) == 0:
+                break
+            remaining -= window_ubs[i]
+            scores += non_essential[i].scores(docs, doc_lens)
+
+        if len(heap) == top_k:
+            keep = scores > threshold
+            docs, scores = docs[keep], scores[keep]
+        for doc, score in zip(docs.tolist(), scores.tolist()):
+            if len(heap) < top_k:
+                heapq.heappush(heap, (score, -doc))
+            elif score > heap[0][0]:
+                heapq.heapreplace(heap, (score, -doc))
+        if len(heap) == top_k:
+            threshold = heap[0][0]
+            while first_essential < len(cursors) and prefix_ub[first_essential] <= threshold:
+                first_essential += 1
+        lo = hi + 1
+
+    return [(-neg_doc, score) for score, neg_doc in sorted(heap, reverse=True)]
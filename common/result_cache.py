@@ -0,0 +1,68 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResultCache():
+    # key -> search results with LRU eviction and an optional ttl in seconds. Every entry remembers
+    # the index generation it was computed on; a lookup with another generation is a miss, so adds,
+    # deletes and merges invalidate the cache without walking it. None means a miss, never store it.
+    # maxsize bounds the entries, max_items the total len() of the values they hold; a value longer
+    # than max_items is not stored
+    def __init__(self, maxsize=10000, ttl=None, max_items=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_items = max_items
+        self.cache = OrderedDict()
+        self.items = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.expired = 0
+
+    def get(self, key, generation=0):
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            entry_generation, expires, value = entry
+            if entry_generation != generation:
+                self.stale += 1
+                self.remove(key)
+                return None
+            if expires is not None and time.monotonic() > expires:
+                self.expired += 1
+                self.remove(key)
+                return None
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return value
+
+    def put(self, key, value, generation=0):
+        if self.max_items is not None and len(value) > self.max_items:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self.lock:
+            if key in self.cache:
+                self.remove(key)
+            self.cache[key] = (generation, expires, value)
+            self.items += len(value)
+            while len(self.cache) > self.maxsize or (self.max_items is not None and self.items > self.max_items):
+                self.remove(next(iter(self.cache)))
+
+    def remove(self, key):
+        # under the lock
+        self.items -= len(self.cache.pop(key)[2])
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+            self.items = 0
+
+    def stats(self):
+        # stale and expired lookups are misses too
+        total = self.hits + self.misses + self.stale + self.expired
+        return {'hits': self.hits, 'misses': self.misses, 'stale': self.stale, 'expired': self.expired,
+                'size': len(self.cache), 'items': self.items, 'hit_rate': self.hits / total if total else 0.0}
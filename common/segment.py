@@ -0,0 +1,126 @@
+import json
+import struct
+import numpy as np
+from common.postings import CompactIndex
+
+# segment file layout:
+#   magic (8 bytes) | version (uint32) | header length (uint64) | json header | arrays
+# the header lists every array as [offset, dtype, length]; arrays start on ALIGN-byte boundaries
+# so they can be viewed straight out of the memory map. A segment written from a live index whose
+# docs are not 0..num_docs-1 also stores the global id of every local doc as 'doc_ids'
+MAGIC = b'INVSEG\x00\x00'
+VERSION = 1
+ALIGN = 64
+PREFIX = struct.Struct('<8sIQ')
+INDEX_ARRAYS = ['offsets', 'doc_deltas', 'tfs', 'doc_lens', 'skip_offsets', 'skip_docs', 'block_max_tf', 'block_min_len']
+# only in segments of a positional index
+POSITION_ARRAYS = ['positions', 'pos_offsets']
+
+
+class TermTable():
+    # read-only term -> term_id mapping over the sorted utf-8 term blob of a segment
+    def __init__(self, blob, term_offsets, term_ids):
+        self.blob = blob
+        self.term_offsets = term_offsets
+        self.term_ids = term_ids
+
+    def term(self, i):
+        return bytes(self.blob[self.term_offsets[i]:self.term_offsets[i + 1]]).decode('utf-8')
+
+    def get(self, term, default=None):
+        key = term.encode('utf-8')
+        lo, hi = 0, len(self.term_ids)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if bytes(self.blob[self.term_offsets[mid]:self.term_offsets[mid + 1]]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self.term_ids) and self.term(lo) == term:
+            return int(self.term_ids[lo])
+        return default
+
+    def __getitem__(self, term):
+        term_id = self.get(term)
+        if term_id is None:
+            raise KeyError(term)
+        return term_id
+
+    def __contains__(self, term):
+        return self.get(term) is not None
+
+    def __len__(self):
+        return len(self.term_ids)
+
+    def __iter__(self):
+        for i in range(len(self.term_ids)):
+            yield self.term(i)
+
+    def items(self):
+        for i in range(len(self.term_ids)):
+            yield self.term(i), int(self.term_ids[i])
+
+
+def term_arrays(terms):
+    items = sorted(terms.items())
+    encoded = [t.encode('utf-8') for t, _ in items]
+    term_offsets = np.zeros(len(items) + 1, dtype=np.int64)
+    term_offsets[1:] = np.cumsum([len(t) for t in encoded])
+    blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    term_ids = np.array([term_id for _, term_id in items], dtype=np.uint32)
+    return {'term_blob': blob, 'term_offsets': term_offsets, 'term_ids': term_ids}
+
+
+def write_segment(path, index, meta=None, doc_ids=None):
+    terms = dict(index.terms.items())
+    names = INDEX_ARRAYS + (POSITION_ARRAYS if index.positions is not None else [])
+    arrays = {name: np.ascontiguousarray(getattr(index, name)) for name in names}
+    arrays.update(term_arrays(terms))
+    if doc_ids is not None:
+        arrays['doc_ids'] = np.ascontiguousarray(doc_ids, dtype=np.int64)
+
+    layout = {}
+    offset = 0
+    for name, a in arrays.items():
+        layout[name] = [offset, a.dtype.str, len(a)]
+        offset += -(-a.nbytes // ALIGN) * ALIGN
+    header = json.dumps({'num_docs': index.num_docs, 'arrays': layout, 'meta': meta or {}}).encode('utf-8')
+    data_start = -(-(PREFIX.size + len(header)) // ALIGN) * ALIGN
+
+    with open(path, 'wb') as f:
+        f.write(PREFIX.pack(MAGIC, VERSION, len(header)))
+        f.write(header)
+        for name, a in arrays.items():
+            f.seek(data_start + layout[name][0])
+            f.write(a.tobytes())
+        f.truncate(data_start + offset)
+
+
+def read_segment(path, mmap=True):
+    with open(path, 'rb') as f:
+        magic, version, header_len = PREFIX.unpack(f.read(PREFIX.size))
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not an index segment')
+        if version != VERSION:
+            raise ValueError(f'unsupported segment version {version}, expected {VERSION}')
+        header = json.loads(f.read(header_len).decode('utf-8'))
+    data_start = -(-(PREFIX.size + header_len) // ALIGN) * ALIGN
+
+    if mmap:
+        data = np.memmap(path, dtype=np.uint8, mode='r')
+    else:
+        data = np.fromfile(path, dtype=np.uint8)
+    arrays = {}
+    for name, (offset, dtype, length) in header['arrays'].items():
+        start = data_start + offset
+        arrays[name] = data[start:start + length * np.dtype(dtype).itemsize].view(dtype)
+
+    terms = TermTable(arrays['term_blob'], arrays['term_offsets'], arrays['term_ids'])
+    index = CompactIndex(terms, arrays['offsets'], arrays['doc_deltas'], arrays['tfs'], header['num_docs'],
+                         arrays['doc_lens'], arrays['skip_offsets'], arrays['skip_docs'],
+                         arrays['block_max_tf'], arrays['block_min_len'],
+                         arrays.get('positions'), arrays.get('pos_offsets'))
+    meta = header['meta']
+    if 'doc_ids' in arrays:
+        meta['doc_ids'] = arrays['doc_ids']
+    return index, meta
@@ -0,0 +1,311 @@
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import asyncio
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(ROOT)
+from common import telemetry
+
+ENGINES = ['hw3', 'hw4', 'hw5', 'hybrid']
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error',
+           503: 'Service Unavailable'}
+
+
+class SearchServer():
+    # HTTP/1.1 (keep-alive) over TCP or a Unix socket in front of one loaded index. The event loop
+    # only parses requests; searches run on a thread pool sharing the index read-only (a live index
+    # query works on its own snapshot, numpy and faiss release the GIL for the heavy parts).
+    # modes: name -> search(query, top_k); batch_modes: name -> search(queries, top_k) for engines
+    # that do a batch in one go. At most max_pending requests are queued or running, the ones
+    # beyond get a 503 with Retry-After at once instead of waiting in an unbounded queue.
+    #   GET  /search?q=...&top_k=10&mode=...&docs=1
+    #   POST /search  {"queries": [...], "top_k": 10, "mode": ..., "docs": false}
+    #   GET  /stats, GET /health, GET /metrics (the telemetry in Prometheus text format)
+    def __init__(self, modes, batch_modes=None, get_docs=None, stats=None, threads=4, max_pending=256, max_top_k=1000):
+        self.modes = modes
+        self.batch_modes = batch_modes or {}
+        self.default_mode = next(iter(modes))
+        self.get_docs = get_docs
+        self.engine_stats = stats
+        self.threads = threads
+        self.max_pending = max_pending
+        self.max_top_k = max_top_k
+        self.executor = None
+        self.pending = 0
+        self.requests = 0
+        self.rejected = 0
+        self.errors = 0
+        self.latencies = deque(maxlen=10000)
+        self.started = time.time()
+
+    async def serve(self, sock):
+        # sock is already bound and listening, so forked workers can all accept on it
+        self.executor = ThreadPoolExecutor(self.threads) if self.threads > 0 else None
+        if sock.family == socket.AF_UNIX:
+            server = await asyncio.start_unix_server(self.handle, sock=sock)
+        else:
+            server = await asyncio.start_server(self.handle, sock=sock)
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, server.close)
+        async with server:
+            try:
+                await server.serve_forever()
+            except asyncio.CancelledError:
+                pass
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                    headers = {}
+                    while True:
+                        line = await reader.readline()
+                        if line in (b'\r\n', b'\n', b''):
+                            break
+                        name, _, value = line.decode('latin-1').partition(':')
+                        headers[name.strip().lower()] = value.strip()
+                    body = await reader.readexactly(int(headers.get('content-length', 0)))
+                except ValueError:
+                    writer.write(self.response(400, {'error': 'malformed request'}, keep_alive=False))
+                    await writer.drain()
+                    break
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                status, payload = await self.route(method, target, body)
+                writer.write(self.response(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def response(self, status, payload, keep_alive=True):
+        if isinstance(payload, str):
+            body, content_type = payload.encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8'
+        else:
+            body, content_type = json.dumps(payload, ensure_ascii=False, default=float).encode('utf-8'), 'application/json; charset=utf-8'
+        head = [f'HTTP/1.1 {status} {REASONS[status]}', f'Content-Type: {content_type}',
+                f'Content-Length: {len(body)}', 'Connection: ' + ('keep-alive' if keep_alive else 'close')]
+        if status == 503:
+            head.append('Retry-After: 1')
+        return ('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body
+
+    async def route(self, method, target, body):
+        url = urlsplit(target)
+        if url.path == '/health':
+            return 200, {'status': 'ok'}
+        if url.path == '/stats':
+            return 200, self.stats()
+        if url.path == '/metrics':
+            return 200, telemetry.prometheus()
+        if url.path != '/search':
+            return 404, {'error': f'no such path {url.path}'}
+        if method == 'GET':
+            params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+            if 'q' not in params:
+                return 400, {'error': 'missing q'}
+            queries, single = [params['q']], True
+            docs = params.get('docs', '0') not in ('0', 'false', '')
+        elif method == 'POST':
+            try:
+                params = json.loads(body or b'{}')
+                queries, single = [str(q) for q in params['queries']], False
+            except (ValueError, KeyError, TypeError):
+                return 400, {'error': 'body must be JSON with a "queries" list'}
+            docs = bool(params.get('docs', False))
+        else:
+            return 405, {'error': f'{method} not allowed'}
+        mode = params.get('mode', self.default_mode)
+        if mode not in self.modes:
+            return 400, {'error': f'unknown mode {mode!r}, expected one of {list(self.modes)}'}
+        try:
+            top_k = min(int(params.get('top_k', 10)), self.max_top_k)
+        except (ValueError, TypeError):
+            return 400, {'error': 'top_k must be an integer'}
+
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            return 503, {'error': 'overloaded, retry later'}
+        self.pending += 1
+        self.requests += 1
+        start = time.perf_counter()
+        try:
+            if self.executor is None:
+                # threads=0: on the event loop thread, one request at a time, the only thread cProfile sees
+                results = self.search(mode, queries, top_k, docs)
+            else:
+                results = await asyncio.get_running_loop().run_in_executor(self.executor, self.search, mode, queries, top_k, docs)
+        except ValueError as e:
+            # a query the index cannot answer, e.g. a phrase on an index without positions
+            return 400, {'error': str(e)}
+        except Exception as e:
+            self.errors += 1
+            return 500, {'error': repr(e)}
+        finally:
+            self.pending -= 1
+        self.latencies.append(time.perf_counter() - start)
+        return 200, results[0] if single else {'results': results}
+
+    def search(self, mode, queries, top_k, docs):
+        if len(queries) > 1 and mode in self.batch_modes:
+            found = self.batch_modes[mode](queries, top_k)
+        else:
+            found = [self.modes[mode](query, top_k) for query in queries]
+        results = []
+        for query, hits in zip(queries, found):
+            hits = [[str(doc_id), score] for doc_id, score in hits]
+            result = {'query': query, 'results': hits}
+            if docs and self.get_docs is not None:
+                result['docs'] = self.get_docs([doc_id for doc_id, _ in hits]) if hits else []
+            results.append(result)
+        return results
+
+    def stats(self):
+        stats = {'pid': os.getpid(), 'uptime_s': time.time() - self.started, 'requests': self.requests,
+                 'rejected': self.rejected, 'errors': self.errors, 'pending': self.pending, 'max_pending': self.max_pending}
+        if self.latencies:
+            stats['p50_ms'] = float(np.percentile(self.latencies, 50) * 1000)
+            stats['p99_ms'] = float(np.percentile(self.latencies, 99) * 1000)
+        if self.engine_stats is not None:
+            stats['engine'] = self.engine_stats()
+        if telemetry.enabled:
+            stats['telemetry'] = telemetry.snapshot()
+        return stats
+
+
+def listen(host='127.0.0.1', port=8000, unix=None, backlog=1024):
+    if unix is not None:
+        if os.path.exists(unix):
+            os.remove(unix)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(unix)
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, port))
+    sock.listen(backlog)
+    sock.setblocking(False)
+    return sock
+
+
+def run_workers(server, sock, workers=1, profile=None, telemetry_path=None):
+    # workers > 1 forks after the index is loaded: the children share its pages copy-on-write (and a
+    # memory-mapped segment / docstore / faiss index through the page cache) and accept on one socket.
+    # Every worker writes its own profile / telemetry file, suffixed with its pid
+    if workers <= 1:
+        asyncio.run(server.serve(sock))
+        return
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                asyncio.run(server.serve(sock))
+                telemetry.finish(profile, telemetry_path, suffix=f'.{os.getpid()}')
+            finally:
+                os._exit(0)
+        children.append(pid)
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+        for pid in children:
+            os.waitpid(pid, 0)
+
+
+def load_engine(args):
+    # (modes, batch_modes, get_docs, stats) of the index the server fronts
+    for hw in ('HW3', 'HW4', 'HW5'):
+        sys.path.append(os.path.join(ROOT, hw))
+    from common.docstore import DocStore
+    df = pd.read_csv(args.path, sep='\t')
+    docs = DocStore.load(args.docs, mmap=True) if args.docs is not None and os.path.exists(args.docs) else None
+
+    lexical = None
+    if args.engine in ('hw3', 'hybrid'):
+        import inverted_index
+        if args.index is not None and os.path.exists(args.index):
+            lexical = inverted_index.InvIndex.load(args.index, df, docs=docs)
+        else:
+            lexical = inverted_index.InvIndex(df, stop_words=inverted_index.rus_stop, docs=docs, positions=args.positions)
+    elif args.engine == 'hw4':
+        import inverted_index_morph
+        if args.index is not None and os.path.exists(args.index):
+            lexical = inverted_index_morph.InvIndex.load(args.index, df, docs=docs)
+        else:
+            lexical = inverted_index_morph.InvIndex(df, morph=inverted_index_morph.morph, stop_words=inverted_index_morph.rus_stop,
+                                                    docs=docs, positions=args.positions)
+    if lexical is not None and args.index is not None and not os.path.exists(args.index):
+        lexical.save(args.index)
+    if lexical is not None and args.docs is not None and docs is None:
+        lexical.docs.save(args.docs)
+    if args.engine in ('hw3', 'hw4'):
+        modes = {'bm25': lexical.search_bm25, 'query': lexical.search_query}
+        return modes, {}, lexical.get_docs, lambda: {'results': lexical.results.stats()}
+
+    from inverted_index_bert import InvIndex as SemanticIndex
+    from ann_index import load_index
+    faiss_index = load_index(args.faiss_index, mmap=True) if args.faiss_index is not None and os.path.exists(args.faiss_index) else None
+    semantic = SemanticIndex(df, model_name=args.model_name, store=args.store, index=faiss_index, index_kind=args.index_kind,
+                             docs=lexical.docs if lexical is not None else docs)
+    if args.faiss_index is not None and faiss_index is None:
+        semantic.save_index(args.faiss_index)
+    semantic_stats = lambda: {'query_cache': semantic.query_cache.stats(), 'results': semantic.results.stats(),
+                              'batcher': semantic.batcher.stats()}
+    if args.engine == 'hw5':
+        # single queries go through the index's micro-batcher, so concurrent requests share one encode
+        return {'semantic': semantic.semantic_search}, {'semantic': semantic.semantic_search_batch}, semantic.get_docs, semantic_stats
+
+    from hybrid_search import HybridSearch
+    hybrid = HybridSearch(lexical, semantic, workers=max(args.threads, 1))
+    modes = {'hybrid': hybrid.search, 'bm25': lexical.search_bm25, 'semantic': semantic.semantic_search}
+    return modes, {'semantic': semantic.semantic_search_batch}, lexical.get_docs, \
+        lambda: {**semantic_stats(), 'lexical_results': lexical.results.stats(), 'stages': hybrid.stage_report()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', nargs='?', default='data/articles_extracted.tsv')
+    parser.add_argument('--engine', default='hw3', choices=ENGINES)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--unix', default=None, help='Unix socket path instead of host:port')
+    parser.add_argument('--workers', type=int, default=1, help='forked processes accepting on the same socket')
+    parser.add_argument('--threads', type=int, default=4, help='search threads per process, 0 runs them on the event loop thread (for --profile)')
+    parser.add_argument('--max_pending', type=int, default=256, help='queued + running requests per process before 503')
+    parser.add_argument('--index', default=None, help='segment file of the lexical index: loaded (memory-mapped) if it exists, written otherwise')
+    parser.add_argument('--docs', default=None, help='docstore file: loaded (memory-mapped) if it exists, written otherwise')
+    parser.add_argument('--positions', action='store_true', help='positional lexical index, for "phrase" and NEAR/k queries')
+    parser.add_argument('--model_name', default='distiluse-base-multilingual-cased-v2')
+    parser.add_argument('--store', default='data/embeddings', help='embedding store directory of the semantic index')
+    parser.add_argument('--faiss_index', default=None, help='faiss index file: loaded (memory-mapped) if it exists, written otherwise')
+    parser.add_argument('--index_kind', default='flat')
+    telemetry.add_arguments(parser)
+    args = parser.parse_args()
+    telemetry.start(args.profile, args.telemetry)
+
+    modes, batch_modes, get_docs, stats = load_engine(args)
+    server = SearchServer(modes, batch_modes, get_docs, stats, threads=args.threads, max_pending=args.max_pending)
+    sock = listen(args.host, args.port, args.unix)
+    print(f'Serving {args.engine} ({", ".join(modes)}) on {args.unix or f"{args.host}:{args.port}"}, {args.workers} worker(s)')
+    run_workers(server, sock, args.workers, args.profile, args.telemetry)
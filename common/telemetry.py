@@ -0,0 +1,194 @@
+import os
+import json
+import time
+import atexit
+import cProfile
+import threading
+import functools
+
+# stage timers and event counters for the hot paths, off unless enable() is called. Disabled, a
+# timer() is a flag check that hands back a shared no-op context manager and count() returns at
+# once, so instrumented code pays well under a microsecond per call; stages are timed per call
+# (a doc, a query, a batch), never per token.
+#   with telemetry.timer('tokenize'): ...
+#   telemetry.count('lemma_miss', n)
+# snapshot() is the JSON form, prometheus() the Prometheus text exposition format. Process pools
+# start their workers with init_worker and call through in_worker, the parent merge()s what comes back
+enabled = False
+timers = {}
+counters = {}
+lock = threading.Lock()
+profiler = None
+PREFIX = 'search'
+
+
+class Timer():
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class NoTimer():
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NO_TIMER = NoTimer()
+
+
+def enable(on=True):
+    global enabled
+    enabled = on
+
+
+def reset():
+    with lock:
+        timers.clear()
+        counters.clear()
+
+
+def timer(name):
+    return Timer(name) if enabled else NO_TIMER
+
+
+def timed(name):
+    # decorator form of timer() for a whole function
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            if not enabled:
+                return fn(*args, **kwargs)
+            with Timer(name):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+
+def record(name, seconds):
+    with lock:
+        stat = timers.get(name)
+        if stat is None:
+            timers[name] = [1, seconds, seconds]
+        else:
+            stat[0] += 1
+            stat[1] += seconds
+            stat[2] = max(stat[2], seconds)
+
+
+def count(name, n=1):
+    if not enabled:
+        return
+    with lock:
+        counters[name] = counters.get(name, 0) + n
+
+
+def merge(stats):
+    # adds a snapshot() taken elsewhere, e.g. in a pool worker, to the stats of this process
+    if stats is None:
+        return
+    with lock:
+        for name, stat in stats['timers'].items():
+            mine = timers.setdefault(name, [0, 0.0, 0.0])
+            mine[0] += stat['count']
+            mine[1] += stat['total_s']
+            mine[2] = max(mine[2], stat['max_ms'] / 1000)
+        for name, n in stats['counters'].items():
+            counters[name] = counters.get(name, 0) + n
+
+
+def init_worker(on, initializer=None, initargs=()):
+    # process pool initializer: the parent's enabled flag, and none of the stats a forked worker
+    # inherits, so merge() does not count them twice; then the pool's own initializer
+    enable(on)
+    reset()
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def in_worker(fn, *args):
+    # runs fn in a pool started with init_worker: its result and the stats it added (None when off),
+    # which the parent hands to merge()
+    result = fn(*args)
+    if not enabled:
+        return result, None
+    stats = snapshot()
+    reset()
+    return result, stats
+
+
+def snapshot():
+    with lock:
+        return {'timers': {name: {'count': c, 'total_s': total, 'mean_ms': total / c * 1000, 'max_ms': longest * 1000}
+                           for name, (c, total, longest) in sorted(timers.items())},
+                'counters': dict(sorted(counters.items()))}
+
+
+def prometheus():
+    # a summary per stage (seconds, labelled by stage) and a counter per event
+    with lock:
+        lines = [f'# TYPE {PREFIX}_stage_seconds summary']
+        for name, (c, total, _) in sorted(timers.items()):
+            lines.append(f'{PREFIX}_stage_seconds_sum{{stage="{name}"}} {total:.9f}')
+            lines.append(f'{PREFIX}_stage_seconds_count{{stage="{name}"}} {c}')
+        lines.append(f'# TYPE {PREFIX}_stage_seconds_max gauge')
+        for name, (_, _, longest) in sorted(timers.items()):
+            lines.append(f'{PREFIX}_stage_seconds_max{{stage="{name}"}} {longest:.9f}')
+        lines.append(f'# TYPE {PREFIX}_events_total counter')
+        for name, n in sorted(counters.items()):
+            lines.append(f'{PREFIX}_events_total{{event="{name}"}} {n}')
+    return '\n'.join(lines) + '\n'
+
+
+def write(path):
+    # .prom gets the Prometheus text format, anything else JSON
+    with open(path, 'w', encoding='utf-8') as f:
+        if path.endswith('.prom'):
+            f.write(prometheus())
+        else:
+            json.dump(snapshot(), f, indent=1)
+
+
+def add_arguments(parser):
+    parser.add_argument('--profile', default=None,
+                        help='cProfile the run into this file (pstats; snakeviz, flameprof or gprof2dot turn it into a flame graph)')
+    parser.add_argument('--telemetry', default=None, help='time the pipeline stages, write them to this .json / .prom file at exit')
+
+
+def start(profile=None, telemetry=None):
+    # for the entry points: turns on what add_arguments asked for and writes the files at exit
+    global profiler
+    if telemetry is not None:
+        enable()
+    if profile is not None:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    if profile is not None or telemetry is not None:
+        atexit.register(finish, profile, telemetry)
+
+
+def finish(profile=None, telemetry=None, suffix=''):
+    # also called by forked workers before os._exit (which skips atexit), with their pid as suffix
+    if profile is not None and profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(with_suffix(profile, suffix))
+    if telemetry is not None:
+        write(with_suffix(telemetry, suffix))
+
+
+def with_suffix(path, suffix):
+    root, ext = os.path.splitext(path)
+    return root + suffix + ext
@@ -0,0 +1,29 @@
+import re
+
+# lower() + collapsing \s + replacing [^\w\s] with spaces + split() leaves exactly the maximal
+# runs of \w characters, so one findall over the lowered text gives the same tokens
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text, stop_words=None):
+    tokens = TOKEN_RE.findall(text.lower())
+    if stop_words is not None:
+        return [t for t in tokens if t not in stop_words]
+    return tokens
+
+
+def iter_tokens(text, stop_words=None):
+    for match in TOKEN_RE.finditer(text.lower()):
+        token = match.group()
+        if stop_words is None or token not in stop_words:
+            yield token
+
+
+def tokenize_positions(text, stop_words=None):
+    # (token, position) pairs; positions count the stop words too, so the words of a phrase stay
+    # adjacent across a dropped stop word on both the index and the query side
+    pairs = []
+    for pos, token in enumerate(TOKEN_RE.findall(text.lower())):
+        if stop_words is None or token not in stop_words:
+            pairs.append((token, pos))
+    return pairs